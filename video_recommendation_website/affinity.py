@@ -0,0 +1,260 @@
+import bisect
+import heapq
+import os
+import threading
+import time
+from array import array
+from collections import Counter, OrderedDict
+
+from sqlalchemy import event, select, desc
+
+from app import db
+from models import Video, user_video_history
+
+# How long a user's affinity entry is trusted before it is reloaded from the
+# database. Other workers may have recorded views for the same user.
+USER_TTL = 300
+
+# Users kept in memory; the least recently used are evicted beyond this
+USER_CACHE_SIZE = int(os.environ.get("AFFINITY_USER_CACHE_SIZE", "10000"))
+
+# How long a per-category top list is trusted before view counts are re-read
+CATEGORY_TTL = 60
+
+# Number of videos kept in each per-category top list
+CATEGORY_LIST_SIZE = 200
+
+# Largest ID a WatchedSet stores in 4 bytes
+_MAX_NARROW_ID = 2 ** (8 * array('I').itemsize) - 1
+
+
+def rank_categories(counts, n=3):
+    """
+    Most watched categories of a Counter, ties broken by the lower category ID
+
+    Shared by the online path and batch_recommend, so both pick the same
+    categories.
+    """
+    ranked = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    return [category_id for category_id, _ in ranked[:n]]
+
+
+class WatchedSet:
+    """
+    Set of watched video IDs packed into a sorted array
+
+    Takes 4 bytes per ID instead of a Python int plus a hash table slot, and
+    answers membership with a binary search. IDs that do not fit in 32 bits
+    switch the array to 8 bytes per ID.
+    """
+
+    __slots__ = ('_ids',)
+
+    def __init__(self, video_ids=()):
+        video_ids = sorted(set(video_ids))
+        wide = video_ids and video_ids[-1] > _MAX_NARROW_ID
+        self._ids = array('Q' if wide else 'I', video_ids)
+
+    def __contains__(self, video_id):
+        position = bisect.bisect_left(self._ids, video_id)
+        return position < len(self._ids) and self._ids[position] == video_id
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def add(self, video_id):
+        position = bisect.bisect_left(self._ids, video_id)
+        if position == len(self._ids) or self._ids[position] != video_id:
+            if video_id > _MAX_NARROW_ID and self._ids.typecode == 'I':
+                self._ids = array('Q', self._ids)
+            self._ids.insert(position, video_id)
+
+
+class AffinityIndex:
+    """
+    Per-user category affinity and per-category popularity lists
+
+    For every user that has been asked for recommendations the index keeps the
+    number of distinct watched videos per category together with the watched
+    video IDs as a WatchedSet. For every category it keeps the top videos ordered by
+    view count. Both are loaded lazily with a single query each, updated
+    incrementally from recorded views and reloaded once their TTL expires.
+    At most max_users users are kept, evicting the least recently used.
+    Category lists are also dropped when a view flush changes their view
+    counts or a video is added to the category.
+    """
+
+    def __init__(self, user_ttl=USER_TTL, category_ttl=CATEGORY_TTL,
+                 category_list_size=CATEGORY_LIST_SIZE, max_users=USER_CACHE_SIZE):
+        self.user_ttl = user_ttl
+        self.max_users = max_users
+        self.category_ttl = category_ttl
+        self.category_list_size = category_list_size
+        self._lock = threading.Lock()
+        # user_id -> (loaded_at, Counter(category_id), WatchedSet), least recently used first
+        self._users = OrderedDict()
+        # category_id -> (loaded_at, [(-view_count, video_id), ...])
+        self._categories = {}
+        # Returns the (video_id, category_id) views of a user not written yet
+        self._pending_source = None
+
+    def set_pending_source(self, source):
+        """Merge source(user_id) -> [(video_id, category_id), ...] into users as they are loaded"""
+        self._pending_source = source
+
+    def _user_entry(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is not None:
+                self._users.move_to_end(user_id)
+        if entry and now - entry[0] < self.user_ttl:
+            return entry
+
+        stmt = select(user_video_history.c.video_id, Video.category_id).join(
+            Video, Video.id == user_video_history.c.video_id
+        ).where(user_video_history.c.user_id == user_id)
+
+        counts = Counter()
+        video_ids = []
+        for video_id, category_id in db.session.execute(stmt):
+            counts[category_id] += 1
+            video_ids.append(video_id)
+
+        # Views still buffered for writing are not in the database yet
+        if self._pending_source is not None:
+            loaded = set(video_ids)
+            for video_id, category_id in self._pending_source(user_id):
+                if video_id not in loaded and category_id is not None:
+                    loaded.add(video_id)
+                    counts[category_id] += 1
+                    video_ids.append(video_id)
+
+        entry = (now, counts, WatchedSet(video_ids))
+        with self._lock:
+            self._users[user_id] = entry
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return entry
+
+    def top_categories(self, user_id, n=3):
+        """
+        Get the IDs of the categories the user has watched most
+
+        Args:
+            user_id: The ID of the user
+            n: Maximum number of categories to return
+
+        Returns:
+            List of category IDs, empty if the user has no history; ties go
+            to the lower category ID
+        """
+        return rank_categories(self._user_entry(user_id)[1], n)
+
+    def watched(self, user_id):
+        """
+        Get the IDs of the videos the user has watched
+
+        Args:
+            user_id: The ID of the user
+
+        Returns:
+            WatchedSet of video IDs
+        """
+        return self._user_entry(user_id)[2]
+
+    def category_top(self, category_id):
+        """
+        Get the most viewed videos of a category
+
+        Args:
+            category_id: The ID of the category
+
+        Returns:
+            List of (-view_count, video_id) tuples in ranking order
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._categories.get(category_id)
+        if entry and now - entry[0] < self.category_ttl:
+            return entry[1]
+
+        stmt = select(Video.view_count, Video.id).where(
+            Video.category_id == category_id
+        ).order_by(desc(Video.view_count), Video.id).limit(self.category_list_size)
+        ranked = [(-(view_count or 0), video_id)
+                  for view_count, video_id in db.session.execute(stmt)]
+
+        with self._lock:
+            self._categories[category_id] = (now, ranked)
+        return ranked
+
+    def is_truncated(self, category_id):
+        """Return True if the category has more videos than its top list holds"""
+        return len(self.category_top(category_id)) >= self.category_list_size
+
+    def merged_candidates(self, category_ids, exclude, limit):
+        """
+        Merge the top lists of several categories by view count
+
+        Args:
+            category_ids: The categories to merge
+            exclude: Container of video IDs to skip
+            limit: Maximum number of video IDs to return
+
+        Returns:
+            List of video IDs ordered by view count
+        """
+        candidates = []
+        lists = [self.category_top(cat_id) for cat_id in category_ids]
+        for _, video_id in heapq.merge(*lists):
+            if video_id in exclude:
+                continue
+            candidates.append(video_id)
+            if len(candidates) >= limit:
+                break
+        return candidates
+
+    def record_view(self, user_id, video_id, category_id):
+        """
+        Record that a user watched a video for the first time
+
+        Users that are not loaded yet are skipped; their history is read from
+        the database on first use.
+        """
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None or video_id in entry[2]:
+                return
+            entry[1][category_id] += 1
+            entry[2].add(video_id)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+    def invalidate_category(self, category_id):
+        with self._lock:
+            self._categories.pop(category_id, None)
+
+    def on_views_flushed(self, views, history, categories):
+        """View flush listener; view counts changed, so re-read those categories' top lists"""
+        for category_id in categories:
+            self.invalidate_category(category_id)
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._categories.clear()
+
+
+affinity_index = AffinityIndex()
+
+
+@event.listens_for(Video, 'after_insert')
+def _invalidate_inserted_video(mapper, connection, target):
+    affinity_index.invalidate_category(target.category_id)
@@ -1,12 +1,18 @@
 import os
+import time
+_import_started = time.perf_counter()
+
 import logging
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
+import json
+import threading
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import desc, update
 from sqlalchemy.orm import DeclarativeBase
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
+# Configure logging (set LOG_LEVEL=DEBUG for per-request detail)
+logging.basicConfig(level=os.environ.get("LOG_LEVEL", "INFO").upper())
 logger = logging.getLogger(__name__)
 
 # Database setup
@@ -28,23 +34,143 @@ app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
 }
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Create the schema and seed data on first use. Defaults to on for in-memory
+# databases (which start empty in every process); persistent databases are
+# set up once with `flask init-db`.
+_in_memory_db = app.config["SQLALCHEMY_DATABASE_URI"] in ("sqlite://", "sqlite:///:memory:")
+app.config["AUTO_INIT_DB"] = os.environ.get("AUTO_INIT_DB", "1" if _in_memory_db else "0") == "1"
+
+# Fail (instead of warn) when a view exceeds its query budget
+app.config["QUERY_BUDGET_STRICT"] = os.environ.get("QUERY_BUDGET_STRICT") == "1"
+
 # Initialize the app with the extension
 db.init_app(app)
 
 # Import models and recommendation engine
+_modules_started = time.perf_counter()
 from models import Video, Category, Comment, User, user_video_history
-from recommendation import get_recommended_videos, get_related_videos, update_video_history
+from recommendation import get_recommended_videos, get_related_videos
+from search_index import MAX_PAGE as SEARCH_MAX_PAGE, search_index
+from suggest import suggest_index
+from view_events import view_events
+from trending import trending_index
+from affinity import affinity_index
+from content import content_index
+from cache import response_cache
+from querycount import query_budget
+from pagination import encode_cursor, keyset_desc, page_size
+from serializers import (
+    COMMENT_PAGE_SIZE, COMMENT_MAX_PAGE_SIZE, video_summary_select, comment_select, comment_page,
+    serialize_row, serialize_video_summary
+)
+import metrics
+import async_views
+import assets
+import thumbnails
 
-with app.app_context():
-    # Create tables
-    db.create_all()
-    
-    # Import seed data function and populate database if empty
+# Number of search results per page
+SEARCH_PAGE_SIZE = 24
+
+# Number of videos per category page
+CATEGORY_PAGE_SIZE = 24
+
+# Default and maximum page sizes of /api/videos
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 500
+
+# Rows fetched per round-trip when streaming /api/videos
+STREAM_CHUNK_SIZE = 1000
+
+# Buffer view counts and history entries, writing them out in batches
+view_events.init_app(app, background=not _in_memory_db)
+view_events.add_flush_listener(response_cache.on_views_flushed)
+view_events.add_flush_listener(trending_index.on_views_flushed)
+view_events.add_flush_listener(affinity_index.on_views_flushed)
+
+# Latency, query and cache metrics at /metrics
+metrics.init_app(app, response_cache)
+
+# Fingerprinted, precompressed static assets at /assets/ (flask build-assets)
+assets.init_app(app)
+
+# Locally cached, resized thumbnails at /thumb/<video_id>
+thumbnails.init_app(app)
+
+# Seconds spent in each startup step, reported by startup_report()
+startup_timings = {
+    'import flask and extensions': _modules_started - _import_started,
+    'import application modules': time.perf_counter() - _modules_started,
+}
+
+_initialized = False
+_init_lock = threading.Lock()
+
+def _timed(step, fn):
+    started = time.perf_counter()
+    result = fn()
+    startup_timings[step] = time.perf_counter() - started
+    return result
+
+def init_db():
+    """Create or migrate the schema and seed an empty database. Needs an app context."""
+    from migrations import upgrade
     from models import seed_initial_data
-    seed_initial_data()
+    _timed('apply migrations', upgrade)
+    _timed('seed data', seed_initial_data)
+
+def warm_up():
+    """Build in-process indexes so the first requests do not pay for them. Needs an app context."""
+    _timed('search index', search_index.setup)
+    _timed('suggestion index', suggest_index.build)
+    _timed('trending index', trending_index.build)
+    _timed('content index', content_index.load)
+
+def ensure_initialized():
+    """Run init_db once per process if AUTO_INIT_DB is enabled"""
+    global _initialized
+    if _initialized:
+        return
+    with _init_lock:
+        if _initialized:
+            return
+        if app.config["AUTO_INIT_DB"]:
+            with app.app_context():
+                init_db()
+        _initialized = True
+
+@app.before_request
+def _initialize_on_first_request():
+    ensure_initialized()
+
+def create_app(warm=True):
+    """
+    Prepare the application for serving and return it
+    
+    Used by main.py and gunicorn (see gunicorn.conf.py). Schema creation and
+    seeding only happen here when AUTO_INIT_DB is enabled; otherwise run
+    `flask init-db` once. With gunicorn's preload_app this runs in the
+    master, so forked workers share the warmed state.
+    
+    Args:
+        warm: Build the search, suggestion and trending indexes and map the content index up front
+    """
+    ensure_initialized()
+    if warm:
+        with app.app_context():
+            warm_up()
+    logger.info(startup_report())
+    return app
+
+def startup_report():
+    """Summarize where startup time went"""
+    lines = [f"  {step:30} {seconds * 1000:8.1f} ms" for step, seconds in startup_timings.items()]
+    total = sum(startup_timings.values())
+    return "Startup timings:\n" + "\n".join(lines) + f"\n  {'total':30} {total * 1000:8.1f} ms"
 
 # Routes
 @app.route('/')
+@response_cache.cached(lambda user_id: ['popular', 'related', 'categories', f'user:{user_id}'], per_user=True)
+@query_budget(8)
 def index():
     recommended_videos = get_recommended_videos(session.get('user_id'))
     categories = Category.query.all()
@@ -54,65 +180,131 @@ def index():
                            title="Home - Video Recommendations")
 
 @app.route('/video/<int:video_id>')
+@query_budget(8)
 def video_detail(video_id):
     try:
         video = Video.query.get_or_404(video_id)
         related_videos = get_related_videos(video_id)
-        comments = Comment.query.filter_by(video_id=video_id).order_by(Comment.created_at.desc()).all()
-        
-        # Update view count
-        video.view_count += 1
-        db.session.commit()
+        # First page of comments; the rest is loaded on demand from the API
+        comments, next_comments_cursor = comment_page(db.session.execute(
+            comment_select(video_id).limit(COMMENT_PAGE_SIZE + 1)
+        ).all())
         
-        # Record this view in user history if user is identified
-        if 'user_id' in session:
-            update_video_history(session['user_id'], video_id)
+        # Record the view (and user history if identified); written in batches
+        view_events.record_view(video_id, session.get('user_id'), video.category_id)
+        view_count = video.view_count + view_events.pending_views(video_id)
         
         # Log the successful video load
-        logger.debug(f"Video {video_id} loaded successfully, current view count: {video.view_count}")
+        logger.debug(f"Video {video_id} loaded successfully, current view count: {view_count}")
         
         return render_template('video.html', 
                               video=video, 
+                              view_count=view_count,
                               related_videos=related_videos,
                               comments=comments,
+                              next_comments_cursor=next_comments_cursor,
                               title=f"{video.title} - Video Recommendations")
     except Exception as e:
         logger.error(f"Error loading video {video_id}: {str(e)}")
         raise
 
 @app.route('/category/<int:category_id>')
+@response_cache.cached(lambda user_id, category_id: ['categories', f'category:{category_id}'])
+@query_budget(3)
 def category(category_id):
     category = Category.query.get_or_404(category_id)
-    videos = Video.query.filter_by(category_id=category_id).order_by(Video.view_count.desc()).all()
+    cursor = request.args.get('cursor')
+    
+    # Fetch one extra row to know whether there is a next page
+    videos = keyset_desc(
+        Video.query.filter_by(category_id=category_id), Video.view_count, Video.id, cursor
+    ).limit(CATEGORY_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(videos) > CATEGORY_PAGE_SIZE:
+        videos = videos[:CATEGORY_PAGE_SIZE]
+        next_cursor = encode_cursor(videos[-1].view_count, videos[-1].id)
+    
     return render_template('category.html', 
                           category=category, 
                           videos=videos,
+                          cursor=cursor,
+                          next_cursor=next_cursor,
                           title=f"{category.name} - Video Recommendations")
 
 @app.route('/search')
+@query_budget(4)
 def search():
     query = request.args.get('q', '')
     if not query:
         return redirect(url_for('index'))
     
-    videos = Video.query.filter(Video.title.ilike(f'%{query}%') | 
-                               Video.description.ilike(f'%{query}%')).all()
+    page = min(max(request.args.get('page', 1, type=int), 1), SEARCH_MAX_PAGE)
+    videos, total = search_index.search(query, page=page, per_page=SEARCH_PAGE_SIZE)
     return render_template('search.html', 
                           query=query, 
                           videos=videos,
+                          total=total,
+                          page=page,
+                          has_next=page * SEARCH_PAGE_SIZE < total,
                           title=f"Search Results for '{query}' - Video Recommendations")
 
 # API endpoints
 @app.route('/api/videos')
+@response_cache.cached(lambda user_id: ['popular'])
+@query_budget(1)
 def api_videos():
-    videos = Video.query.all()
-    return jsonify([{
-        'id': v.id,
-        'title': v.title,
-        'thumbnail': v.thumbnail,
-        'view_count': v.view_count,
-        'category': v.category.name
-    } for v in videos])
+    stream = request.args.get('stream')
+    if stream in ('ndjson', 'json'):
+        return _stream_videos(stream)
+    
+    limit = page_size(request.args.get('limit', type=int), API_PAGE_SIZE, API_MAX_PAGE_SIZE)
+    rows = db.session.execute(keyset_desc(
+        video_summary_select(), Video.view_count, Video.id, request.args.get('cursor')
+    ).limit(limit + 1)).all()
+    
+    response = jsonify([serialize_row(row) for row in rows[:limit]])
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.view_count, last.id)
+        next_url = url_for('api_videos', cursor=next_cursor, limit=limit)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+def _stream_videos(fmt):
+    """Stream every video as NDJSON or as a JSON array, in constant memory"""
+    stmt = video_summary_select().order_by(desc(Video.view_count), desc(Video.id))
+    
+    def generate():
+        rows = db.session.execute(stmt.execution_options(yield_per=STREAM_CHUNK_SIZE))
+        if fmt == 'ndjson':
+            for row in rows:
+                yield json.dumps(serialize_row(row)) + '\n'
+            return
+        yield '['
+        separator = ''
+        for row in rows:
+            yield separator + json.dumps(serialize_row(row))
+            separator = ','
+        yield ']'
+    
+    mimetype = 'application/x-ndjson' if fmt == 'ndjson' else 'application/json'
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
+@app.route('/api/videos/trending')
+@query_budget(2)
+def api_trending_videos():
+    limit = page_size(request.args.get('limit', type=int), API_PAGE_SIZE, API_MAX_PAGE_SIZE)
+    video_ids = trending_index.top(limit)
+    rows = {}
+    if video_ids:
+        rows = {row.id: row for row in db.session.execute(
+            video_summary_select().where(Video.id.in_(video_ids))
+        )}
+    return jsonify([
+        dict(serialize_row(rows[video_id]), views_24h=trending_index.window_views(video_id))
+        for video_id in video_ids if video_id in rows
+    ])
 
 @app.route('/api/videos/<int:video_id>')
 def api_video_detail(video_id):
@@ -129,14 +321,20 @@ def api_video_detail(video_id):
     })
 
 @app.route('/api/videos/<int:video_id>/comments', methods=['GET'])
+@response_cache.cached(lambda user_id, video_id: [f'comments:{video_id}'])
+@query_budget(1)
 def api_video_comments(video_id):
-    comments = Comment.query.filter_by(video_id=video_id).order_by(Comment.created_at.desc()).all()
-    return jsonify([{
-        'id': c.id,
-        'content': c.content,
-        'user': c.user.username,
-        'created_at': c.created_at.isoformat()
-    } for c in comments])
+    limit = page_size(request.args.get('limit', type=int), COMMENT_PAGE_SIZE, COMMENT_MAX_PAGE_SIZE)
+    rows, next_cursor = comment_page(db.session.execute(
+        comment_select(video_id, request.args.get('cursor')).limit(limit + 1)
+    ).all(), limit)
+    
+    response = jsonify([serialize_row(row) for row in rows])
+    if next_cursor:
+        next_url = url_for('api_video_comments', video_id=video_id, cursor=next_cursor, limit=limit)
+        response.headers['X-Next-Cursor'] = next_cursor
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
 
 @app.route('/api/videos/<int:video_id>/comments', methods=['POST'])
 def api_add_comment(video_id):
@@ -148,6 +346,14 @@ def api_add_comment(video_id):
     if not content:
         return jsonify({'error': 'Comment content is required'}), 400
     
+    # Keep the denormalized count in the same transaction as the insert
+    updated = db.session.execute(update(Video).where(Video.id == video_id).values(
+        comment_count=Video.comment_count + 1
+    ))
+    if updated.rowcount == 0:
+        db.session.rollback()
+        return jsonify({'error': 'Video not found'}), 404
+    
     new_comment = Comment(
         content=content,
         video_id=video_id,
@@ -155,6 +361,7 @@ def api_add_comment(video_id):
     )
     db.session.add(new_comment)
     db.session.commit()
+    response_cache.bump(f'comments:{video_id}')
     
     return jsonify({
         'id': new_comment.id,
@@ -163,17 +370,31 @@ def api_add_comment(video_id):
         'created_at': new_comment.created_at.isoformat()
     }), 201
 
+@app.route('/api/search/suggest')
+def api_search_suggest():
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 8, type=int)
+    suggestions = []
+    for kind, item_id, label in suggest_index.suggest(query, k=limit):
+        if kind == 'category':
+            url = url_for('category', category_id=item_id)
+        else:
+            url = url_for('video_detail', video_id=item_id)
+        suggestions.append({
+            'type': kind,
+            'id': item_id,
+            'label': label,
+            'url': url
+        })
+    return jsonify(suggestions)
+
 @app.route('/api/recommended')
+@response_cache.cached(lambda user_id: ['popular', 'related', f'user:{user_id}'], per_user=True)
+@query_budget(6)
 def api_recommended():
     user_id = session.get('user_id')
     videos = get_recommended_videos(user_id)
-    return jsonify([{
-        'id': v.id,
-        'title': v.title,
-        'thumbnail': v.thumbnail,
-        'view_count': v.view_count,
-        'category': v.category.name
-    } for v in videos])
+    return jsonify([serialize_video_summary(v) for v in videos])
 
 # Error handlers
 @app.errorhandler(404)
@@ -183,3 +404,9 @@ def page_not_found(e):
 @app.errorhandler(500)
 def server_error(e):
     return render_template('500.html', title="Server Error"), 500
+
+# Replace sync views with their async versions when ASYNC_VIEWS=1
+async_views.init_app(app, _in_memory_db)
+
+# Register CLI commands (flask init-db, flask bench, ...)
+import commands
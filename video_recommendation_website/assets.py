@@ -0,0 +1,155 @@
+import gzip
+import hashlib
+import io
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+from flask import abort, request, send_from_directory, url_for
+from werkzeug.security import safe_join
+
+logger = logging.getLogger(__name__)
+
+_ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Source assets, relative to static/, that get fingerprinted
+ASSET_DIRS = ('css', 'js')
+
+# Build output, served under /assets/
+DIST_DIR = os.path.join(_ROOT, 'static', 'dist')
+MANIFEST_PATH = os.path.join(DIST_DIR, 'manifest.json')
+
+# The project icon, shrunk to a favicon when Pillow is installed
+ICON_SOURCE = os.path.join(_ROOT, 'generated-icon.png')
+ICON_SIZE = 192
+
+# Fingerprinted files never change, so clients may keep them for a year
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Content encodings tried in order of preference, with their file suffixes
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprinted(path, content):
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:12]}{ext}"
+
+
+def _write_compressed(path, content):
+    """Write gzip (and brotli, if installed) variants next to path"""
+    with open(path + '.gz', 'wb') as f:
+        # mtime=0 keeps the output identical across builds
+        with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+            gz.write(content)
+    try:
+        import brotli
+    except ImportError:
+        return
+    with open(path + '.br', 'wb') as f:
+        f.write(brotli.compress(content, quality=11))
+
+
+def _icon_bytes():
+    try:
+        from PIL import Image
+    except ImportError:
+        logger.info("Pillow is not installed; skipping the favicon")
+        return None
+    with Image.open(ICON_SOURCE) as image:
+        image.thumbnail((ICON_SIZE, ICON_SIZE))
+        out = io.BytesIO()
+        image.save(out, format='PNG', optimize=True)
+        return out.getvalue()
+
+
+def build_assets(static_dir=os.path.join(_ROOT, 'static'), dist_dir=DIST_DIR):
+    """
+    Fingerprint and precompress static assets
+
+    Every file under ASSET_DIRS is copied to dist_dir with a content hash in
+    its name, next to a gzip (and, with the brotli package, a brotli)
+    compressed copy. The project icon is shrunk to a favicon when Pillow is
+    installed. manifest.json maps source paths to built paths.
+
+    Returns:
+        The manifest dict
+    """
+    if os.path.isdir(dist_dir):
+        shutil.rmtree(dist_dir)
+    os.makedirs(dist_dir)
+
+    sources = {}
+    for asset_dir in ASSET_DIRS:
+        for dirpath, _, filenames in os.walk(os.path.join(static_dir, asset_dir)):
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    sources[os.path.relpath(path, static_dir).replace(os.sep, '/')] = f.read()
+    if os.path.exists(ICON_SOURCE):
+        icon = _icon_bytes()
+        if icon is not None:
+            sources['icon.png'] = icon
+
+    manifest = {}
+    for path, content in sources.items():
+        built = _fingerprinted(path, content)
+        target = os.path.join(dist_dir, built)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(content)
+        if not path.endswith('.png'):
+            _write_compressed(target, content)
+        manifest[path] = built
+        logger.info(f"{path} -> {built} ({len(content)} bytes)")
+
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(path=MANIFEST_PATH):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def init_app(app):
+    """Register the /assets/ route and the asset_url template helper"""
+    manifest = load_manifest()
+    if not manifest:
+        logger.info("No built assets; serving static files directly (run `flask build-assets`)")
+
+    def asset_url(path):
+        """URL of a built asset, or of the plain static file if it was not built"""
+        built = manifest.get(path)
+        if built is None:
+            return url_for('static', filename=path)
+        return url_for('built_asset', filename=built)
+
+    @app.context_processor
+    def _asset_helpers():
+        # The favicon only exists as a built asset
+        favicon_url = asset_url('icon.png') if 'icon.png' in manifest else None
+        return {'asset_url': asset_url, 'favicon_url': favicon_url}
+
+    @app.route('/assets/<path:filename>')
+    def built_asset(filename):
+        path = safe_join(DIST_DIR, filename)
+        if path is None or filename.endswith(('.gz', '.br')) or filename == 'manifest.json':
+            abort(404)
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        accepted = request.accept_encodings
+        for encoding, suffix in _ENCODINGS:
+            if accepted[encoding] and os.path.exists(path + suffix):
+                response = send_from_directory(DIST_DIR, filename + suffix, mimetype=mimetype)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_from_directory(DIST_DIR, filename, mimetype=mimetype)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.vary.add('Accept-Encoding')
+        return response
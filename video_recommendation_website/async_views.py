@@ -0,0 +1,103 @@
+import asyncio
+import contextvars
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import render_template, session
+from sqlalchemy.orm import Session
+
+from app import db
+from models import Video
+from querycount import query_budget
+from recommendation import get_related_videos
+from serializers import COMMENT_PAGE_SIZE, comment_select, comment_page
+from view_events import view_events
+
+logger = logging.getLogger(__name__)
+
+# Serve video pages with the async view below (needs `pip install flask[async]`)
+ASYNC_VIEWS = os.environ.get("ASYNC_VIEWS") == "1"
+
+# Threads running the independent queries of async views, per process
+QUERY_THREADS = int(os.environ.get("ASYNC_QUERY_THREADS", "8"))
+
+_executor = ThreadPoolExecutor(max_workers=QUERY_THREADS, thread_name_prefix='async-query')
+
+
+def _in_session(fn, *args):
+    # Each concurrent query gets its own session (and pooled connection);
+    # objects stay usable after close since their attributes are loaded
+    with Session(db.engine) as query_session:
+        return fn(query_session, *args)
+
+
+async def run_query(fn, *args):
+    """
+    Run fn(session, *args) on the query thread pool
+
+    The app context is carried over, so query counting and metrics still see
+    the request.
+    """
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, context.run, _in_session, fn, *args)
+
+
+def _related_videos(query_session, video_id):
+    return get_related_videos(video_id, session=query_session)
+
+
+def _comments(query_session, video_id):
+    return comment_page(query_session.execute(
+        comment_select(video_id).limit(COMMENT_PAGE_SIZE + 1)
+    ).all())
+
+
+@query_budget(8)
+async def video_detail(video_id):
+    """Video page with the related-video and comment queries run concurrently"""
+    try:
+        video = db.get_or_404(Video, video_id)
+        # Each query gets its own session (see run_query); nothing on these
+        # paths may fall back to the request's db.session from another thread
+        related_videos, (comments, next_comments_cursor) = await asyncio.gather(
+            run_query(_related_videos, video_id),
+            run_query(_comments, video_id),
+        )
+
+        # Recording the view only touches in-memory buffers; the flush thread
+        # writes view counts and history outside the request
+        view_events.record_view(video_id, session.get('user_id'), video.category_id)
+        view_count = video.view_count + view_events.pending_views(video_id)
+
+        logger.debug(f"Video {video_id} loaded successfully, current view count: {view_count}")
+
+        return render_template('video.html',
+                               video=video,
+                               view_count=view_count,
+                               related_videos=related_videos,
+                               comments=comments,
+                               next_comments_cursor=next_comments_cursor,
+                               title=f"{video.title} - Video Recommendations")
+    except Exception as e:
+        logger.error(f"Error loading video {video_id}: {str(e)}")
+        raise
+
+
+def init_app(app, in_memory_db=False):
+    """Swap in the async video view when ASYNC_VIEWS=1 and it can run"""
+    if not ASYNC_VIEWS:
+        return
+    try:
+        import asgiref  # noqa: F401  (Flask runs async views through asgiref)
+    except ImportError:
+        logger.warning("ASYNC_VIEWS=1 needs asgiref (pip install flask[async]); using sync views")
+        return
+    if in_memory_db:
+        # The in-memory database is a single shared connection, so there is
+        # nothing to run concurrently
+        logger.warning("ASYNC_VIEWS=1 is ignored for in-memory databases; using sync views")
+        return
+    app.view_functions['video_detail'] = video_detail
+    logger.info("Serving video pages with async views")
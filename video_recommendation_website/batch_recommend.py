@@ -0,0 +1,249 @@
+import datetime
+import heapq
+import itertools
+import logging
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+from sqlalchemy import delete, desc, func, select
+
+from app import app, db
+from affinity import affinity_index, rank_categories
+from cache import response_cache
+from models import Video, Category, User, PrecomputedRecommendation, user_video_history
+from strategies import Exclusions, _top_videos
+
+try:
+    import numpy as np
+except ImportError:  # optional, see the "content" extra in pyproject.toml
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Strategy chain (see strategies.py) that recommend_for_history reproduces;
+# precomputed rows are only served while RECOMMEND_STRATEGIES matches it
+BATCH_CHAIN = ('category-affinity', 'popularity')
+
+# Categories whose top lists are merged per user
+TOP_CATEGORIES = 3
+
+# Recommendations stored per user. More than the page size, so the online
+# path can drop videos watched since the batch ran and still fill a page.
+DEPTH = 24
+
+# Popular videos kept as merge candidates. Per category, as many as the
+# online top lists hold (affinity_index.category_list_size). Users who have
+# watched most of them are filled up with the same deeper queries as online.
+CANDIDATE_LIST_SIZE = 1000
+
+# Users handled per read/compute/write round
+USERS_PER_CHUNK = 2000
+
+# History rows fetched per round-trip
+ROWS_PER_FETCH = 50000
+
+
+def _candidate_lists():
+    """
+    Top videos per category and overall, as lists of (-view_count, video_id)
+
+    Ordered like the online lists: per category as AffinityIndex.category_top,
+    overall as the popularity strategy (ties to the higher video ID).
+    """
+    lists = {}
+    for category_id in db.session.execute(select(Category.id)).scalars():
+        stmt = select(Video.view_count, Video.id).where(
+            Video.category_id == category_id
+        ).order_by(desc(Video.view_count), Video.id).limit(affinity_index.category_list_size)
+        lists[category_id] = [(-(views or 0), video_id) for views, video_id in db.session.execute(stmt)]
+
+    stmt = select(Video.view_count, Video.id).order_by(
+        desc(Video.view_count), desc(Video.id)
+    ).limit(CANDIDATE_LIST_SIZE)
+    popular = [(-(views or 0), video_id) for views, video_id in db.session.execute(stmt)]
+    return lists, popular
+
+
+def _user_histories(user_filter):
+    """Yield (user_id, [(video_id, category_id), ...]) for the selected users"""
+    stmt = select(
+        user_video_history.c.user_id, user_video_history.c.video_id, Video.category_id
+    ).join(Video, Video.id == user_video_history.c.video_id).where(
+        user_filter
+    ).order_by(user_video_history.c.user_id).execution_options(yield_per=ROWS_PER_FETCH)
+    rows = db.session.execute(stmt)
+    for user_id, group in itertools.groupby(rows, key=lambda row: row[0]):
+        yield user_id, [(row[1], row[2]) for row in group]
+
+
+def _merge(watched, top_categories, category_lists, popular, depth):
+    """Pick video IDs as the category-affinity and popularity strategies do"""
+    picked = []
+    picked_ids = set()
+    excluded = Exclusions(watched, picked_ids)
+
+    def fill(video_ids):
+        for video_id in video_ids:
+            if len(picked) >= depth:
+                return
+            if video_id not in excluded:
+                picked.append(video_id)
+                picked_ids.add(video_id)
+
+    lists = [category_lists.get(category_id, []) for category_id in top_categories]
+    fill(video_id for _, video_id in heapq.merge(*lists))
+    # The candidate lists are capped, so look deeper like the strategies do
+    if len(picked) < depth and any(len(ranked) >= affinity_index.category_list_size for ranked in lists):
+        fill(video.id for video in _top_videos(
+            depth - len(picked), excluded, Video.category_id.in_(top_categories)
+        ))
+    fill(video_id for _, video_id in popular)
+    if len(picked) < depth and len(popular) >= CANDIDATE_LIST_SIZE:
+        fill(video.id for video in _top_videos(depth - len(picked), excluded))
+    return picked
+
+
+def recommend_for_history(history, category_lists, popular, depth=DEPTH):
+    """
+    Compute recommendations for one user from their history
+
+    Same algorithm and tie-breaks as the online BATCH_CHAIN: merge the top
+    lists of the user's three most watched categories by view count, skip
+    watched videos and fill up with popular videos.
+
+    Args:
+        history: List of (video_id, category_id) the user has watched
+        category_lists: Dict of category_id -> [(-view_count, video_id), ...]
+        popular: [(-view_count, video_id), ...] over all categories
+        depth: Number of video IDs to return
+
+    Returns:
+        List of video IDs
+    """
+    watched = {video_id for video_id, _ in history}
+    top_categories = rank_categories(Counter(category_id for _, category_id in history), TOP_CATEGORIES)
+    return _merge(watched, top_categories, category_lists, popular, depth)
+
+
+def _chunk_affinities(user_filter):
+    """
+    Yield (user_id, watched video IDs, top category IDs) for the selected users
+
+    With numpy the category counts of the whole chunk are computed at once,
+    as a users x categories matrix, and ranked with one argsort. Without it
+    each user's history is counted on its own.
+    """
+    if np is None:
+        for user_id, history in _user_histories(user_filter):
+            yield (user_id, {video_id for video_id, _ in history},
+                   rank_categories(Counter(category_id for _, category_id in history), TOP_CATEGORIES))
+        return
+
+    stmt = select(
+        user_video_history.c.user_id, user_video_history.c.video_id, Video.category_id
+    ).join(Video, Video.id == user_video_history.c.video_id).where(
+        user_filter
+    ).order_by(user_video_history.c.user_id).execution_options(yield_per=ROWS_PER_FETCH)
+    rows = np.fromiter(itertools.chain.from_iterable(db.session.execute(stmt)), dtype=np.int64).reshape(-1, 3)
+    if not len(rows):
+        return
+
+    users, user_index = np.unique(rows[:, 0], return_inverse=True)
+    categories, category_index = np.unique(rows[:, 2], return_inverse=True)
+    counts = np.zeros((len(users), len(categories)), dtype=np.int32)
+    np.add.at(counts, (user_index, category_index), 1)
+    # Columns are in category ID order, so a stable sort breaks ties by ID
+    # as rank_categories does
+    top = np.argsort(-counts, axis=1, kind='stable')[:, :TOP_CATEGORIES]
+    watched_any = np.take_along_axis(counts, top, axis=1) > 0
+    bounds = np.append(np.searchsorted(rows[:, 0], users), len(rows))
+
+    for i, user_id in enumerate(users.tolist()):
+        yield (user_id, set(rows[bounds[i]:bounds[i + 1], 1].tolist()),
+               categories[top[i][watched_any[i]]].tolist())
+
+
+def _process_chunk(user_filter, category_lists, popular, depth, computed_at):
+    # The merge stays per user: it stops after depth + watched candidates
+    results = {
+        user_id: _merge(watched, top_categories, category_lists, popular, depth)
+        for user_id, watched, top_categories in _chunk_affinities(user_filter)
+    }
+    if not results:
+        return 0
+
+    db.session.execute(delete(PrecomputedRecommendation).where(
+        PrecomputedRecommendation.user_id.in_(list(results))
+    ))
+    db.session.execute(PrecomputedRecommendation.__table__.insert(), [
+        {'user_id': user_id, 'rank': rank, 'video_id': video_id, 'computed_at': computed_at}
+        for user_id, video_ids in results.items()
+        for rank, video_id in enumerate(video_ids)
+    ])
+    db.session.commit()
+    response_cache.bump(*(f'user:{user_id}' for user_id in results))
+    return len(results)
+
+
+def _run_range(start, end, depth):
+    """Compute recommendations for user IDs in [start, end); runs in a worker process"""
+    with app.app_context():
+        # Connections inherited from the parent process must not be reused
+        db.engine.dispose(close=False)
+        return batch_recommend(start=start, end=end, depth=depth)
+
+
+def batch_recommend(user_ids=None, start=None, end=None, depth=DEPTH, processes=1):
+    """
+    Precompute recommendations for many users in one pass
+
+    Candidate lists are loaded once per run. History is then read in large
+    chunks of users with one joined, streamed query per chunk. Results are
+    written with one bulk INSERT per chunk. Users without history get no rows
+    and keep using the online popular fallback.
+
+    Args:
+        user_ids: Explicit list of user IDs, or None to use a range
+        start: First user ID of the range (inclusive), default the smallest ID
+        end: Last user ID of the range (exclusive), default past the largest ID
+        depth: Recommendations stored per user
+        processes: Split a range across this many worker processes
+
+    Returns:
+        Number of users whose recommendations were written
+    """
+    if user_ids is None:
+        if start is None or end is None:
+            low, high = db.session.execute(select(func.min(User.id), func.max(User.id))).one()
+            if low is None:
+                return 0
+            start = low if start is None else start
+            end = high + 1 if end is None else end
+
+        if processes > 1:
+            if db.engine.url.database in (None, '', ':memory:'):
+                logger.warning("In-memory databases cannot be shared with worker processes; using one process")
+            else:
+                step = -(-(end - start) // processes)
+                bounds = [(low, min(low + step, end)) for low in range(start, end, step)]
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    futures = [pool.submit(_run_range, low, high, depth) for low, high in bounds]
+                    return sum(future.result() for future in futures)
+
+    category_lists, popular = _candidate_lists()
+    computed_at = datetime.datetime.utcnow()
+    history_user = user_video_history.c.user_id
+
+    written = 0
+    if user_ids is not None:
+        user_ids = sorted(set(user_ids))
+        for offset in range(0, len(user_ids), USERS_PER_CHUNK):
+            chunk = user_ids[offset:offset + USERS_PER_CHUNK]
+            written += _process_chunk(history_user.in_(chunk), category_lists, popular, depth, computed_at)
+    else:
+        for low in range(start, end, USERS_PER_CHUNK):
+            high = min(low + USERS_PER_CHUNK, end)
+            user_filter = (history_user >= low) & (history_user < high)
+            written += _process_chunk(user_filter, category_lists, popular, depth, computed_at)
+            logger.info(f"Precomputed recommendations for users {low}-{high - 1}")
+    return written
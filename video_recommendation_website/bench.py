@@ -0,0 +1,296 @@
+import datetime
+import json
+import platform
+import random
+import subprocess
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+
+from app import app, db
+from models import Video, Category, User, user_video_history
+from recommendation import get_recommended_videos, get_related_videos
+from search_index import search_index, tokenize
+from cache import response_cache
+from content import content_index
+from querycount import total_queries
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(fn, make_args, iterations, warmup):
+    """
+    Time a callable
+
+    Args:
+        fn: The callable to benchmark
+        make_args: Called before each call (outside the timed region) to get the
+                   argument tuple; may also reset state such as caches
+        iterations: Number of timed calls
+        warmup: Number of untimed calls made first
+
+    Returns:
+        Dict with latency percentiles in milliseconds, queries per call and
+        peak traced memory of a single call in KiB
+    """
+    for _ in range(warmup):
+        fn(*make_args())
+        db.session.remove()
+
+    timings = []
+    queries = 0
+    for _ in range(iterations):
+        args = make_args()
+        start_queries = total_queries()
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries += total_queries() - start_queries
+        db.session.remove()
+
+    # Memory is traced in a separate call so tracing does not skew timings
+    args = make_args()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    db.session.remove()
+
+    timings.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'p99_ms': round(percentile(timings, 99), 3),
+        'mean_ms': round(sum(timings) / len(timings), 3) if timings else 0.0,
+        'queries_per_call': round(queries / max(iterations, 1), 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def git_commit():
+    """Short hash of the checked-out commit, or None outside a git checkout"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(iterations=200, warmup=20, use_cache=False, seed=1):
+    """
+    Benchmark the recommendation functions and the main routes
+
+    Must run inside an app context, against a database that already has data
+    (see datagen.generate).
+
+    Args:
+        iterations: Timed calls per benchmark
+        warmup: Untimed calls per benchmark
+        use_cache: Keep the response cache between route calls
+        seed: Random seed for picking users, videos and search terms
+
+    Returns:
+        Dict with 'meta' and 'benchmarks' sections, ready to be saved as JSON
+    """
+    rng = random.Random(seed)
+
+    # Sample a pool of inputs up front so picking them is not timed
+    video_ids = list(db.session.execute(
+        select(Video.id).order_by(func.random()).limit(1000)
+    ).scalars())
+    category_ids = list(db.session.execute(select(Category.id)).scalars())
+    active_user_ids = list(db.session.execute(
+        select(user_video_history.c.user_id).distinct().limit(1000)
+    ).scalars()) or list(db.session.execute(select(User.id).limit(1000)).scalars())
+    titles = db.session.execute(select(Video.title).limit(1000)).scalars()
+    terms = sorted({term for title in titles for term in tokenize(title) if len(term) > 2})
+    counts = {
+        'videos': db.session.execute(select(func.count(Video.id))).scalar(),
+        'users': db.session.execute(select(func.count(User.id))).scalar(),
+        'history': db.session.execute(select(func.count()).select_from(user_video_history)).scalar(),
+    }
+    db.session.remove()
+
+    def pick(values):
+        return rng.choice(values)
+
+    benchmarks = {
+        'get_recommended_videos[user]': (
+            get_recommended_videos, lambda: (pick(active_user_ids),)),
+        'get_recommended_videos[anonymous]': (
+            get_recommended_videos, lambda: (None,)),
+        'get_related_videos': (
+            get_related_videos, lambda: (pick(video_ids),)),
+        'search': (
+            lambda query: search_index.search(query), lambda: (pick(terms),)),
+    }
+
+    if content_index.ready:
+        benchmarks['content_index.similar'] = (
+            content_index.similar, lambda: (pick(video_ids),))
+
+    client = app.test_client()
+
+    def get(path):
+        response = client.get(path)
+        if response.status_code >= 500:
+            raise RuntimeError(f"GET {path} returned {response.status_code}")
+
+    def route_args(make_path):
+        def make_args():
+            if not use_cache:
+                response_cache.backend.clear()
+            with client.session_transaction() as session:
+                session['user_id'] = pick(active_user_ids)
+            return (make_path(),)
+        return make_args
+
+    routes = {
+        'GET /': lambda: '/',
+        'GET /video/<id>': lambda: f'/video/{pick(video_ids)}',
+        'GET /category/<id>': lambda: f'/category/{pick(category_ids)}',
+        'GET /search': lambda: f'/search?q={pick(terms)}',
+        'GET /api/videos': lambda: '/api/videos',
+        'GET /api/recommended': lambda: '/api/recommended',
+        'GET /api/search/suggest': lambda: f'/api/search/suggest?q={pick(terms)[:3]}',
+    }
+    for name, make_path in routes.items():
+        benchmarks[name] = (get, route_args(make_path))
+
+    results = {}
+    for name, (fn, make_args) in benchmarks.items():
+        results[name] = measure(fn, make_args, iterations, warmup)
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'python': platform.python_version(),
+            'database': db.engine.dialect.name,
+            'use_cache': use_cache,
+            'dataset': counts,
+        },
+        'benchmarks': results,
+    }
+
+
+def _fetch(url, timeout):
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def run_load(base_url, paths=('/video/{id}',), requests=1000, concurrency=16, timeout=30.0, seed=1):
+    """
+    Load-test a running server over HTTP
+
+    Meant for comparing serving setups against the same database, e.g. the
+    sync gunicorn workers with and without ASYNC_VIEWS=1. Video IDs for the
+    `{id}` placeholder are taken from the server's /api/videos.
+
+    Args:
+        base_url: Server to test, e.g. http://127.0.0.1:5000
+        paths: Path templates; each request picks one at random
+        requests: Requests made per path template
+        concurrency: Client threads making requests at the same time
+        timeout: Per-request timeout in seconds
+        seed: Random seed for picking paths and video IDs
+
+    Returns:
+        Dict with 'meta' and 'benchmarks' sections, comparable with compare()
+    """
+    base_url = base_url.rstrip('/')
+    rng = random.Random(seed)
+    with urllib.request.urlopen(f'{base_url}/api/videos?limit=500', timeout=timeout) as response:
+        video_ids = [video['id'] for video in json.load(response)]
+    if not video_ids:
+        raise RuntimeError(f"{base_url} has no videos to request")
+
+    jobs = [(path, path.format(id=rng.choice(video_ids))) for path in paths for _ in range(requests)]
+    rng.shuffle(jobs)
+
+    timings = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    lock = threading.Lock()
+
+    def request(job):
+        path, url_path = job
+        start = time.perf_counter()
+        status = _fetch(base_url + url_path, timeout)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            timings[path].append(elapsed)
+            if status >= 500:
+                errors[path] += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(request, jobs))
+    wall = time.perf_counter() - started
+
+    results = {}
+    for path, values in timings.items():
+        values.sort()
+        results[f'GET {path}'] = {
+            'iterations': len(values),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p95_ms': round(percentile(values, 95), 3),
+            'p99_ms': round(percentile(values, 99), 3),
+            'mean_ms': round(sum(values) / len(values), 3) if values else 0.0,
+            'errors': errors[path],
+        }
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'base_url': base_url,
+            'concurrency': concurrency,
+            'requests_per_second': round(len(jobs) / wall, 1) if wall else 0.0,
+        },
+        'benchmarks': results,
+    }
+
+
+def compare(old, new, threshold=0.10, metric='p95_ms'):
+    """
+    Compare two benchmark result dicts
+
+    Returns:
+        List of (name, old value, new value, relative change, regressed) tuples
+    """
+    rows = []
+    for name, new_stats in new['benchmarks'].items():
+        old_stats = old['benchmarks'].get(name)
+        if old_stats is None:
+            continue
+        before, after = old_stats[metric], new_stats[metric]
+        change = (after - before) / before if before else 0.0
+        rows.append((name, before, after, change, change > threshold))
+    return rows
+
+
+def load_results(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_results(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
@@ -0,0 +1,225 @@
+import functools
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, make_response, request, session
+from sqlalchemy import event
+
+from models import Video, Category
+
+logger = logging.getLogger(__name__)
+
+# Default lifetime of a cached response, in seconds
+CACHE_TTL = int(os.environ.get("CACHE_TTL", "60"))
+
+# Maximum number of responses held by the in-process backend
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "1024"))
+
+# Response headers that are recomputed rather than replayed from the cache
+_UNCACHED_HEADERS = {'Content-Length', 'Set-Cookie', 'ETag', 'Cache-Control', 'Vary'}
+
+# Set to a redis:// URL to share the cache between workers
+CACHE_REDIS_URL = os.environ.get("CACHE_REDIS_URL")
+
+
+class LRUCacheBackend:
+    """
+    In-process LRU cache with per-entry TTL
+
+    Namespace versions live in the process too. With several workers
+    (gunicorn's WEB_CONCURRENCY), a bump only reaches the worker that made
+    it, such as a new comment or a view flush. The other workers keep
+    serving their cached responses, and answering their ETags with 304,
+    until the entries expire. Responses can therefore be stale for up to
+    the entry TTL, CACHE_TTL seconds by default. Set CACHE_REDIS_URL to
+    share versions and entries between workers.
+    """
+
+    name = 'lru'
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        # Versions are kept apart from entries so eviction never resets them
+        self._versions = {}
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_versions(self, namespaces):
+        with self._lock:
+            return [self._versions.get(namespace, 0) for namespace in namespaces]
+
+    def incr_version(self, namespace):
+        with self._lock:
+            self._versions[namespace] = self._versions.get(namespace, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+
+class RedisCacheBackend:
+    """Shared cache backend for multi-worker deployments (requires the redis package)"""
+
+    name = 'redis'
+
+    def __init__(self, url, prefix='vr:'):
+        import redis
+        self._client = redis.Redis.from_url(url)
+        self._prefix = prefix
+
+    def get(self, key):
+        return self._client.get(self._prefix + key)
+
+    def set(self, key, value, ttl):
+        self._client.set(self._prefix + key, value, ex=ttl)
+
+    def get_versions(self, namespaces):
+        if not namespaces:
+            return []
+        values = self._client.mget([self._prefix + 'v:' + namespace for namespace in namespaces])
+        return [int(value) if value else 0 for value in values]
+
+    def incr_version(self, namespace):
+        self._client.incr(self._prefix + 'v:' + namespace)
+
+    def clear(self):
+        for key in self._client.scan_iter(self._prefix + '*'):
+            self._client.delete(key)
+
+
+def make_backend():
+    """Pick the shared backend if configured and available, else the in-process one"""
+    if CACHE_REDIS_URL:
+        try:
+            return RedisCacheBackend(CACHE_REDIS_URL)
+        except ImportError:
+            logger.warning("CACHE_REDIS_URL is set but redis is not installed; using in-process cache")
+    return LRUCacheBackend()
+
+
+class ResponseCache:
+    """
+    Response cache with versioned namespaces and ETag revalidation
+
+    Every cached view declares the namespaces its output depends on, such as
+    'popular', 'category:3' or 'user:7'. The cache key is derived from the
+    request path, the user (for per-user views) and the current version of
+    each namespace, so bumping a namespace invalidates every response that
+    depends on it. The ETag is a hash of the body, so a response that is
+    regenerated with the same content still revalidates, and one with new
+    content never does. A request whose If-None-Match matches a cached
+    entry's ETag gets a 304 before the view runs.
+
+    Jobs that change what a view would render bump namespaces too: batch
+    recommendations bump the users they wrote, index rebuilds bump
+    'popular' (trending) or 'related' (co-view and content neighbors, which
+    recommendation chains may read).
+    """
+
+    def __init__(self, backend, ttl=CACHE_TTL):
+        self.backend = backend
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def bump(self, *namespaces):
+        """Invalidate every response depending on the given namespaces"""
+        for namespace in namespaces:
+            self.backend.incr_version(namespace)
+
+    def cached(self, namespaces, per_user=False, ttl=None):
+        """
+        Cache a view's response
+
+        Args:
+            namespaces: Function receiving the view arguments and user_id, returning
+                        the list of namespaces the response depends on
+            per_user: Whether the response depends on the session's user
+            ttl: Lifetime of cached entries, defaults to CACHE_TTL
+        """
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                user_id = session.get('user_id') if per_user else None
+                names = namespaces(user_id=user_id, **kwargs)
+                versions = self.backend.get_versions(names)
+                key = hashlib.sha1(
+                    repr((request.full_path, user_id, names, versions)).encode()
+                ).hexdigest()
+
+                entry = self.backend.get(key)
+                if entry is not None:
+                    meta, _, body = entry.partition(b'\0')
+                    meta = json.loads(meta)
+                    if request.if_none_match.contains(meta['etag']):
+                        self.not_modified += 1
+                        response = Response(status=304)
+                    else:
+                        self.hits += 1
+                        response = Response(body, headers=meta['headers'])
+                    response.set_etag(meta['etag'])
+                else:
+                    self.misses += 1
+                    response = make_response(view(**kwargs))
+                    if response.status_code != 200 or response.is_streamed:
+                        return response
+                    body = response.get_data()
+                    etag = hashlib.sha1(body).hexdigest()
+                    headers = [(name, value) for name, value in response.headers
+                               if name not in _UNCACHED_HEADERS]
+                    self.backend.set(key, json.dumps({'headers': headers, 'etag': etag}).encode()
+                                     + b'\0' + body, ttl or self.ttl)
+                    response.set_etag(etag)
+                    # The view already ran, but the client can still skip the body
+                    response.make_conditional(request)
+
+                response.headers['Cache-Control'] = 'private, no-cache' if per_user else 'no-cache'
+                if per_user:
+                    response.vary.add('Cookie')
+                return response
+            return wrapper
+        return decorator
+
+    def on_views_flushed(self, views, history, categories):
+        """Invalidate responses affected by a view-count flush"""
+        self.bump('popular', *(f'category:{category_id}' for category_id in categories))
+        self.bump(*{f'user:{user_id}' for user_id, _ in history})
+
+
+response_cache = ResponseCache(make_backend())
+
+
+@event.listens_for(Video, 'after_insert')
+def _invalidate_inserted_video(mapper, connection, target):
+    response_cache.bump('popular', f'category:{target.category_id}')
+
+
+@event.listens_for(Category, 'after_insert')
+def _invalidate_inserted_category(mapper, connection, target):
+    response_cache.bump('categories')
@@ -0,0 +1,189 @@
+import click
+
+from app import app, ensure_initialized, init_db, startup_report, warm_up
+from assets import build_assets
+from batch_recommend import DEPTH, batch_recommend
+from bench import compare, load_results, run_benchmarks, run_load, save_results
+from content import DIMENSIONS, FIT_SAMPLE, content_index
+from coview import TOP_K, build_neighbor_table
+from datagen import generate
+from migrations import MIGRATIONS, applied_versions, check_query_plans, upgrade
+from models import seed_initial_data
+
+
+@app.cli.command('build-neighbors')
+@click.option('--top-k', default=TOP_K, show_default=True, help='Neighbors kept per video.')
+@click.option('--metric', type=click.Choice(['jaccard', 'cosine']), default='jaccard', show_default=True)
+@click.option('--since', type=click.DateTime(), default=None,
+              help='Only recompute videos watched since this time.')
+@click.option('--shards', default=1, show_default=True,
+              help='Split the build into this many passes to bound memory.')
+def build_neighbors_command(top_k, metric, since, shards):
+    """Build the co-view neighbor table used for related videos."""
+    ensure_initialized()
+    written = build_neighbor_table(top_k=top_k, metric=metric, since=since, shards=shards)
+    click.echo(f"Wrote neighbors for {written} videos")
+
+
+@app.cli.command('build-content-index')
+@click.option('--dimensions', default=DIMENSIONS, show_default=True, help='Size of the video vectors.')
+@click.option('--fit-sample', default=FIT_SAMPLE, show_default=True,
+              help='Videos used to fit the SVD.')
+def build_content_index_command(dimensions, fit_sample):
+    """Vectorize video titles and descriptions for content-based related videos."""
+    ensure_initialized()
+    indexed = content_index.build(dimensions=dimensions, fit_sample=fit_sample)
+    click.echo(f"Indexed {indexed} videos")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and precompress CSS/JS under static/dist for /assets/."""
+    manifest = build_assets()
+    click.echo(f"Built {len(manifest)} assets; restart the app to serve them")
+
+
+@app.cli.command('init-db')
+def init_db_command():
+    """Create or migrate the schema and seed an empty database."""
+    init_db()
+    click.echo("Database initialized")
+
+
+@app.cli.command('seed')
+def seed_command():
+    """Insert the demo user, categories and videos if the database is empty."""
+    seed_initial_data()
+    click.echo("Seed data present")
+
+
+@app.cli.command('startup-report')
+def startup_report_command():
+    """Show how long importing and initializing the app takes."""
+    ensure_initialized()
+    warm_up()
+    click.echo(startup_report())
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade_command():
+    """Apply pending schema migrations."""
+    applied = upgrade()
+    click.echo(f"Applied {len(applied)} migration(s): {', '.join(applied) or 'none'}")
+
+
+@app.cli.command('db-status')
+def db_status_command():
+    """List schema migrations and whether they are applied."""
+    done = applied_versions()
+    for version, description, _ in MIGRATIONS:
+        mark = 'x' if version in done else ' '
+        click.echo(f"[{mark}] {version}  {description}")
+
+
+@app.cli.command('db-check-indexes')
+@click.option('--verbose', is_flag=True, help='Print the full query plans.')
+def db_check_indexes_command(verbose):
+    """Check with EXPLAIN that hot queries use their indexes."""
+    ensure_initialized()
+    failed = False
+    for description, index_name, used, plan in check_query_plans():
+        click.echo(f"{'ok  ' if used else 'MISS'} {description} ({index_name})")
+        if verbose or not used:
+            click.echo('     ' + plan.replace('\n', '\n     '))
+        failed = failed or not used
+    if failed:
+        raise SystemExit(1)
+
+
+@app.cli.command('gen-data')
+@click.option('--videos', default=1000, show_default=True)
+@click.option('--users', default=100, show_default=True)
+@click.option('--history', default=10000, show_default=True, help='Approximate history rows.')
+@click.option('--comments', default=0, show_default=True)
+@click.option('--zipf', 'zipf_s', default=1.1, show_default=True, help='Zipf exponent of popularity.')
+@click.option('--seed', default=42, show_default=True)
+def gen_data_command(videos, users, history, comments, zipf_s, seed):
+    """Bulk-insert synthetic data with Zipfian popularity."""
+    ensure_initialized()
+    inserted = generate(videos=videos, users=users, history=history,
+                        comments=comments, zipf_s=zipf_s, seed=seed)
+    for table, count in inserted.items():
+        click.echo(f"{table}: {count} rows")
+
+
+@app.cli.command('bench')
+@click.option('--iterations', default=200, show_default=True)
+@click.option('--warmup', default=20, show_default=True)
+@click.option('--cache/--no-cache', 'use_cache', default=False, show_default=True,
+              help='Keep the response cache between route calls.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Save results as JSON.')
+@click.option('--videos', default=0, help='Generate this many videos first (for in-memory databases).')
+@click.option('--users', default=0, help='Generate this many users first.')
+@click.option('--history', default=0, help='Generate about this many history rows first.')
+def bench_command(iterations, warmup, use_cache, output, videos, users, history):
+    """Benchmark recommendation functions and routes."""
+    ensure_initialized()
+    if videos or users or history:
+        generate(videos=videos, users=users, history=history)
+    # Measure a warmed-up process, like one started by create_app
+    warm_up()
+
+    results = run_benchmarks(iterations=iterations, warmup=warmup, use_cache=use_cache)
+    click.echo(f"{'benchmark':40} {'p50':>9} {'p95':>9} {'p99':>9} {'queries':>8} {'peak KiB':>9}")
+    for name, stats in results['benchmarks'].items():
+        click.echo(f"{name:40} {stats['p50_ms']:9.3f} {stats['p95_ms']:9.3f} {stats['p99_ms']:9.3f} "
+                   f"{stats['queries_per_call']:8.2f} {stats['peak_memory_kb']:9.1f}")
+    if output:
+        save_results(results, output)
+        click.echo(f"Saved results to {output}")
+
+
+@app.cli.command('bench-load')
+@click.option('--url', 'base_url', default='http://127.0.0.1:5000', show_default=True,
+              help='Running server to load-test.')
+@click.option('--path', 'paths', multiple=True, default=['/video/{id}'], show_default=True,
+              help='Path template to request; {id} is replaced by a video ID. Repeatable.')
+@click.option('--requests', default=1000, show_default=True, help='Requests per path.')
+@click.option('--concurrency', default=16, show_default=True, help='Concurrent client threads.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Save results as JSON.')
+def bench_load_command(base_url, paths, requests, concurrency, output):
+    """Load-test a running server, e.g. sync vs ASYNC_VIEWS=1 gunicorn."""
+    results = run_load(base_url, paths=paths, requests=requests, concurrency=concurrency)
+    click.echo(f"{'benchmark':40} {'p50':>9} {'p95':>9} {'p99':>9} {'errors':>7}")
+    for name, stats in results['benchmarks'].items():
+        click.echo(f"{name:40} {stats['p50_ms']:9.3f} {stats['p95_ms']:9.3f} {stats['p99_ms']:9.3f} "
+                   f"{stats['errors']:7d}")
+    click.echo(f"{results['meta']['requests_per_second']} requests/s")
+    if output:
+        save_results(results, output)
+        click.echo(f"Saved results to {output}")
+
+
+@app.cli.command('bench-compare')
+@click.argument('old', type=click.Path(exists=True, dir_okay=False))
+@click.argument('new', type=click.Path(exists=True, dir_okay=False))
+@click.option('--threshold', default=0.10, show_default=True, help='Relative p95 increase counted as a regression.')
+def bench_compare_command(old, new, threshold):
+    """Compare two saved benchmark runs by p95 latency."""
+    regressed = False
+    for name, before, after, change, is_regression in compare(load_results(old), load_results(new), threshold):
+        flag = 'REGRESSION' if is_regression else ''
+        click.echo(f"{name:40} {before:9.3f} -> {after:9.3f} ms {change:+7.1%} {flag}")
+        regressed = regressed or is_regression
+    if regressed:
+        raise SystemExit(1)
+
+
+@app.cli.command('batch-recommend')
+@click.option('--users', help='Comma-separated user IDs (default: every user).')
+@click.option('--start', type=int, help='First user ID of a range.')
+@click.option('--end', type=int, help='User ID after the last one of a range.')
+@click.option('--depth', default=DEPTH, show_default=True, help='Recommendations stored per user.')
+@click.option('--processes', default=1, show_default=True, help='Worker processes for a range.')
+def batch_recommend_command(users, start, end, depth, processes):
+    """Precompute recommendations for many users."""
+    ensure_initialized()
+    user_ids = [int(user_id) for user_id in users.split(',')] if users else None
+    written = batch_recommend(user_ids=user_ids, start=start, end=end, depth=depth, processes=processes)
+    click.echo(f"Wrote recommendations for {written} users")
@@ -0,0 +1,407 @@
+import datetime
+import json
+import logging
+import math
+import os
+import shutil
+import threading
+from collections import Counter
+
+from sqlalchemy import event, func, select
+
+from app import db
+from models import Video
+from cache import response_cache
+from search_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:  # optional, see the "content" extra in pyproject.toml
+    np = None
+
+logger = logging.getLogger(__name__)
+
+# Where built indexes are stored; each build goes to its own subdirectory
+CONTENT_INDEX_DIR = os.environ.get(
+    "CONTENT_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'content_index')
+)
+
+# Size of the video vectors
+DIMENSIONS = 64
+
+# Vocabulary: the most common terms appearing in at least MIN_DF videos
+MAX_FEATURES = 50000
+MIN_DF = 2
+
+# Videos used to fit the SVD; the rest are only projected
+FIT_SAMPLE = 100000
+
+# Smaller catalogs are not indexed: a video needs others to be similar to
+MIN_VIDEOS = 2
+
+# Videos vectorized per pass when writing the vectors
+BUILD_CHUNK = 20000
+
+# Catalogs up to this size are searched exhaustively, larger ones through IVF
+BRUTE_FORCE_MAX = 20000
+
+# IVF lists probed per query
+NPROBE = 8
+
+# k-means settings for the IVF centroids
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE = 50000
+
+
+def _document(title, description):
+    # Titles are short and the best signal, so they count twice
+    return tokenize(title) * 2 + tokenize(description)
+
+
+def _csr_dot(indptr, indices, data, dense):
+    """Multiply a CSR matrix given by its arrays with a dense matrix"""
+    out = np.zeros((len(indptr) - 1, dense.shape[1]), dtype=np.float32)
+    if len(indices) == 0:
+        return out
+    products = data[:, None] * dense[indices]
+    nonempty = np.diff(indptr) > 0
+    out[nonempty] = np.add.reduceat(products, indptr[:-1][nonempty], axis=0)
+    return out
+
+
+def _csr_tdot(indptr, indices, data, dense, n_features):
+    """Multiply the transpose of a CSR matrix with a dense matrix"""
+    rows = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    out = np.zeros((n_features, dense.shape[1]), dtype=np.float32)
+    np.add.at(out, indices, data[:, None] * dense[rows])
+    return out
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class _Vectorizer:
+    """TF-IDF weighting over a fixed vocabulary, followed by a fixed projection"""
+
+    def __init__(self, terms, idf, components):
+        self.terms = terms
+        self.vocab = {term: index for index, term in enumerate(terms)}
+        self.idf = idf
+        self.components = components
+
+    def tfidf(self, documents):
+        """Sublinear TF-IDF rows with unit length, as CSR arrays"""
+        indptr = [0]
+        indices = []
+        data = []
+        for tokens in documents:
+            counts = Counter(self.vocab[token] for token in tokens if token in self.vocab)
+            weights = [(1.0 + math.log(count)) * self.idf[index] for index, count in counts.items()]
+            norm = math.sqrt(sum(weight * weight for weight in weights)) or 1.0
+            indices.extend(counts)
+            data.extend(weight / norm for weight in weights)
+            indptr.append(len(indices))
+        return (np.array(indptr, dtype=np.int64), np.array(indices, dtype=np.int64),
+                np.array(data, dtype=np.float32))
+
+    def transform(self, documents):
+        """Unit-length vectors of the given token lists"""
+        return _normalize(_csr_dot(*self.tfidf(documents), self.components))
+
+
+def _fit_svd(matrix, n_features, dimensions, seed, power_iterations=2):
+    """
+    Randomized truncated SVD of a CSR matrix
+
+    Returns:
+        The top right singular vectors as an (n_features, d) matrix, where d
+        is dimensions or fewer for tiny samples or vocabularies
+    """
+    rng = np.random.default_rng(seed)
+    n_documents = len(matrix[0]) - 1  # indptr has one entry more than rows
+    rank = min(dimensions + 10, n_features, n_documents)
+    if rank < 1:
+        raise ValueError("The SVD needs at least one document and one term")
+    omega = rng.standard_normal((n_features, rank)).astype(np.float32)
+    q, _ = np.linalg.qr(_csr_dot(*matrix, omega))
+    for _ in range(power_iterations):
+        z, _ = np.linalg.qr(_csr_tdot(*matrix, q, n_features))
+        q, _ = np.linalg.qr(_csr_dot(*matrix, z))
+    b = _csr_tdot(*matrix, q, n_features).T
+    _, _, vt = np.linalg.svd(b, full_matrices=False)
+    return np.ascontiguousarray(vt[:dimensions].T, dtype=np.float32)
+
+
+def _kmeans(vectors, n_clusters, iterations, rng):
+    """Spherical k-means; returns unit-length centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        filled = np.linalg.norm(sums, axis=1) > 0
+        centroids[filled] = _normalize(sums[filled])
+    return centroids
+
+
+class _Snapshot:
+    """
+    A loaded index plus the videos added since; never modified
+
+    Adding a video creates a new snapshot, so a search that picked one up
+    sees a consistent set of arrays however the index changes meanwhile.
+    """
+
+    def __init__(self, vectorizer, ids, vectors, centroids, list_rows, list_offsets,
+                 extra_ids=(), extra_vectors=None):
+        self.vectorizer = vectorizer
+        self.ids = ids
+        self.vectors = vectors
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        self.extra_ids = extra_ids
+        self.extra_vectors = extra_vectors
+
+    def with_video(self, video_id, vector):
+        extra_vectors = vector if self.extra_vectors is None else np.vstack([self.extra_vectors, vector])
+        return _Snapshot(self.vectorizer, self.ids, self.vectors, self.centroids, self.list_rows,
+                         self.list_offsets, self.extra_ids + (video_id,), extra_vectors)
+
+    def vector(self, video_id):
+        position = np.searchsorted(self.ids, video_id)
+        if position < len(self.ids) and self.ids[position] == video_id:
+            return np.asarray(self.vectors[position])
+        if video_id in self.extra_ids:
+            return self.extra_vectors[self.extra_ids.index(video_id)]
+        return None
+
+
+class ContentIndex:
+    """
+    Content similarity between videos
+
+    Titles and descriptions are turned into TF-IDF vectors and reduced to
+    DIMENSIONS dense dimensions with a truncated SVD. The unit-length float32
+    vectors are stored in a file that every worker memory-maps, so the pages
+    are shared. Similar videos are found by cosine similarity: through an
+    IVF index (k-means centroids, NPROBE nearest lists searched) for large
+    catalogs, or by scanning all vectors for small ones.
+
+    `build` writes a new index (see `flask build-content-index`); `load`
+    maps the latest one. Videos inserted afterwards are projected with the
+    stored model and kept in a small in-memory segment that is always
+    scanned, until the next build.
+    """
+
+    def __init__(self, directory=CONTENT_INDEX_DIR, nprobe=NPROBE):
+        self.directory = directory
+        self.nprobe = nprobe
+        # Serializes writers; readers just take the current snapshot
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    @property
+    def ready(self):
+        return self._snapshot is not None
+
+    def _current_path(self):
+        return os.path.join(self.directory, 'CURRENT')
+
+    def build(self, dimensions=DIMENSIONS, fit_sample=FIT_SAMPLE, seed=0):
+        """
+        Build a new index from every video and make it current
+
+        Must run inside an app context. Workers pick it up on their next load().
+        Catalogs with fewer than MIN_VIDEOS videos or without any terms are
+        skipped, and the current index (if any) is kept.
+
+        Returns:
+            Number of videos indexed, 0 if skipped
+        """
+        if np is None:
+            raise RuntimeError("The content index needs numpy (pip install .[content])")
+
+        max_id = db.session.execute(select(func.max(Video.id))).scalar()
+        total = db.session.execute(select(func.count(Video.id)).where(Video.id <= max_id)).scalar() if max_id else 0
+        if total < MIN_VIDEOS:
+            logger.info(f"Content index not built: {total} videos, at least {MIN_VIDEOS} needed")
+            return 0
+
+        def documents():
+            stmt = select(Video.id, Video.title, Video.description).where(
+                Video.id <= max_id
+            ).order_by(Video.id).execution_options(yield_per=BUILD_CHUNK)
+            for video_id, title, description in db.session.execute(stmt):
+                yield video_id, _document(title, description)
+
+        # Pass 1: document frequencies and the SVD fitting sample
+        stride = max(1, total // fit_sample)
+        df = Counter()
+        sample = []
+        for position, (_, tokens) in enumerate(documents()):
+            df.update(set(tokens))
+            if position % stride == 0:
+                sample.append(tokens)
+        terms = [term for term, count in df.most_common(MAX_FEATURES) if count >= MIN_DF]
+        if not terms:
+            terms = [term for term, _ in df.most_common(MAX_FEATURES)]
+        if not terms:
+            logger.info("Content index not built: no video has a title or description")
+            return 0
+        idf = np.array([math.log((1 + total) / (1 + df[term])) + 1.0 for term in terms], dtype=np.float32)
+
+        tfidf = _Vectorizer(terms, idf, None)
+        components = _fit_svd(tfidf.tfidf(sample), len(terms), dimensions, seed)
+        vectorizer = _Vectorizer(terms, idf, components)
+        del sample
+
+        build_dir = os.path.join(self.directory, datetime.datetime.utcnow().strftime('build-%Y%m%d%H%M%S%f'))
+        os.makedirs(build_dir)
+        vectors = np.lib.format.open_memmap(
+            os.path.join(build_dir, 'vectors.npy'), mode='w+', dtype=np.float32,
+            shape=(total, components.shape[1])
+        )
+        ids = np.zeros(total, dtype=np.int64)
+
+        # Pass 2: project every video in chunks
+        row = 0
+        chunk_ids, chunk_docs = [], []
+        for video_id, tokens in documents():
+            chunk_ids.append(video_id)
+            chunk_docs.append(tokens)
+            if len(chunk_docs) >= BUILD_CHUNK:
+                vectors[row:row + len(chunk_docs)] = vectorizer.transform(chunk_docs)
+                ids[row:row + len(chunk_ids)] = chunk_ids
+                row += len(chunk_docs)
+                chunk_ids, chunk_docs = [], []
+        if chunk_docs:
+            vectors[row:row + len(chunk_docs)] = vectorizer.transform(chunk_docs)
+            ids[row:row + len(chunk_ids)] = chunk_ids
+            row += len(chunk_docs)
+        vectors.flush()
+
+        arrays = {'ids': ids[:row], 'terms': np.array(terms), 'idf': idf, 'components': components}
+        if row > BRUTE_FORCE_MAX:
+            arrays.update(self._build_ivf(vectors[:row], seed))
+        for name, array in arrays.items():
+            np.save(os.path.join(build_dir, f'{name}.npy'), array)
+        with open(os.path.join(build_dir, 'meta.json'), 'w') as f:
+            json.dump({'videos': row, 'dimensions': int(components.shape[1]), 'max_id': max_id}, f)
+
+        # Switch atomically, then remove older builds (open maps stay valid)
+        current = self._current_path()
+        with open(current + '.tmp', 'w') as f:
+            f.write(os.path.basename(build_dir))
+        os.replace(current + '.tmp', current)
+        for name in os.listdir(self.directory):
+            if name.startswith('build-') and name != os.path.basename(build_dir):
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+        response_cache.bump('related')
+        logger.info(f"Content index built for {row} videos with {len(terms)} terms")
+        return row
+
+    def _build_ivf(self, vectors, seed):
+        rng = np.random.default_rng(seed)
+        n_lists = max(1, min(4096, int(math.sqrt(len(vectors)))))
+        sample_rows = np.sort(rng.choice(len(vectors), min(len(vectors), KMEANS_SAMPLE), replace=False))
+        centroids = _kmeans(np.asarray(vectors[sample_rows]), n_lists, KMEANS_ITERATIONS, rng)
+
+        assignment = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), BUILD_CHUNK):
+            chunk = np.asarray(vectors[start:start + BUILD_CHUNK])
+            assignment[start:start + len(chunk)] = np.argmax(chunk @ centroids.T, axis=1)
+        list_rows = np.argsort(assignment, kind='stable').astype(np.int64)
+        list_offsets = np.searchsorted(assignment[list_rows], np.arange(n_lists + 1))
+        return {'centroids': centroids, 'list_rows': list_rows, 'list_offsets': list_offsets}
+
+    def load(self):
+        """Map the current index, if one has been built. Returns True if loaded."""
+        if np is None:
+            return False
+        try:
+            with open(self._current_path()) as f:
+                build_dir = os.path.join(self.directory, f.read().strip())
+        except FileNotFoundError:
+            logger.info("No content index built yet; run `flask build-content-index`")
+            return False
+
+        def array(name, mmap_mode=None):
+            path = os.path.join(build_dir, f'{name}.npy')
+            return np.load(path, mmap_mode=mmap_mode) if os.path.exists(path) else None
+
+        snapshot = _Snapshot(
+            _Vectorizer(list(array('terms')), array('idf'), array('components')),
+            array('ids'), array('vectors', mmap_mode='r'),
+            array('centroids'), array('list_rows'), array('list_offsets')
+        )
+        with self._lock:
+            self._snapshot = snapshot
+        response_cache.bump('related')
+        logger.info(f"Content index loaded with {len(snapshot.ids)} videos")
+        return True
+
+    def add(self, video_id, title, description):
+        """Add a video inserted after the index was built"""
+        if not self.ready:
+            return
+        with self._lock:
+            # Projected under the lock, so the vector matches the snapshot's model
+            snapshot = self._snapshot
+            vector = snapshot.vectorizer.transform([_document(title, description)])
+            self._snapshot = snapshot.with_video(video_id, vector)
+
+    def similar(self, video_id, k=10):
+        """
+        Get the videos most similar in content to a video
+
+        Args:
+            video_id: The ID of the video
+            k: Maximum number of video IDs to return
+
+        Returns:
+            List of video IDs, most similar first; empty if the video is not indexed
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            return []
+        query = snapshot.vector(video_id)
+        if query is None:
+            return []
+
+        if snapshot.centroids is not None:
+            centroids = snapshot.centroids
+            nearest_lists = np.argpartition(-(centroids @ query), min(self.nprobe, len(centroids) - 1))
+            rows = np.sort(np.concatenate([
+                snapshot.list_rows[snapshot.list_offsets[n]:snapshot.list_offsets[n + 1]]
+                for n in nearest_lists[:self.nprobe]
+            ]))
+            candidate_ids = snapshot.ids[rows]
+            scores = np.asarray(snapshot.vectors[rows]) @ query
+        else:
+            candidate_ids = snapshot.ids
+            scores = np.asarray(snapshot.vectors) @ query
+
+        if snapshot.extra_ids:
+            candidate_ids = np.concatenate([candidate_ids, np.array(snapshot.extra_ids, dtype=np.int64)])
+            scores = np.concatenate([scores, snapshot.extra_vectors @ query])
+
+        scores[candidate_ids == video_id] = -np.inf
+        top = min(k, len(scores) - 1)
+        if top <= 0:
+            return []
+        best = np.argpartition(-scores, top - 1)[:top]
+        best = best[np.argsort(-scores[best])]
+        return [int(candidate_ids[i]) for i in best if scores[i] > 0]
+
+
+content_index = ContentIndex()
+
+
+@event.listens_for(Video, 'after_insert')
+def _index_inserted_video(mapper, connection, target):
+    content_index.add(target.id, target.title, target.description)
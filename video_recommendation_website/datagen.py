@@ -0,0 +1,187 @@
+import bisect
+import datetime
+import itertools
+import logging
+import random
+
+from sqlalchemy import func, select, text, update
+
+from app import db
+from models import Video, Category, Comment, User, user_video_history
+
+logger = logging.getLogger(__name__)
+
+# Rows per INSERT batch
+BATCH_SIZE = 10000
+
+# History timestamps are spread over this many days before now
+HISTORY_DAYS = 90
+
+_WORDS = (
+    "amazing guide python guitar piano cooking cake recipe science black hole dna "
+    "minecraft zelda walkthrough javascript web development tutorial review live "
+    "concert beginner advanced tips tricks history space physics chemistry travel "
+    "vlog music remix speedrun strategy building quick easy perfect ultimate"
+).split()
+
+
+def zipf_cum_weights(n, s):
+    """Cumulative Zipf weights for ranks 1..n, usable with random.choices"""
+    return list(itertools.accumulate(1.0 / rank ** s for rank in range(1, n + 1)))
+
+
+def _insert_batches(table, rows, batch_size=BATCH_SIZE):
+    total = 0
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return total
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        total += len(batch)
+        if total % (batch_size * 10) == 0:
+            logger.info(f"{table.name}: {total} rows")
+
+
+def _next_id(model):
+    return (db.session.execute(select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _sync_sequence(model):
+    """
+    Move a PostgreSQL id sequence past rows inserted with explicit ids
+
+    Otherwise the next row the app inserts (a signup, a new video) would be
+    given an id that is already taken.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    table = model.__table__.name
+    db.session.execute(
+        text(f"SELECT setval(pg_get_serial_sequence(:table, 'id'), "
+             f"(SELECT COALESCE(MAX(id), 1) FROM \"{table}\"))"),
+        {'table': f'"{table}"'}
+    )
+    db.session.commit()
+
+
+def backfill_comment_counts(connection):
+    """Recompute video.comment_count from the comment table"""
+    video_table = Video.__table__
+    counts = select(func.count(Comment.id)).where(
+        Comment.video_id == video_table.c.id
+    ).scalar_subquery()
+    connection.execute(update(video_table).values(comment_count=counts))
+
+
+def generate(videos=1000, users=100, history=10000, comments=0, zipf_s=1.1, seed=42):
+    """
+    Bulk-insert synthetic users, videos, history rows and comments
+
+    Video popularity follows a Zipf distribution: each video gets a random
+    popularity rank, history rows pick videos with probability proportional
+    to 1 / rank ** zipf_s, and view counts are derived from the same weights.
+    Rows are added to whatever is already in the database.
+
+    Args:
+        videos: Number of videos to create
+        users: Number of users to create
+        history: Approximate number of user_video_history rows to create
+        comments: Number of comments to create
+        zipf_s: Zipf exponent; larger values concentrate views on fewer videos
+        seed: Random seed, so runs are reproducible
+
+    Returns:
+        Dict of table name -> rows inserted
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+
+    category_ids = list(db.session.execute(select(Category.id)).scalars())
+    if not category_ids:
+        _insert_batches(Category.__table__, (
+            {'name': f'Category {n}', 'description': 'Synthetic category'} for n in range(1, 6)
+        ))
+        category_ids = list(db.session.execute(select(Category.id)).scalars())
+
+    first_user = _next_id(User)
+    user_ids = list(range(first_user, first_user + users))
+    inserted = {'user': _insert_batches(User.__table__, (
+        {
+            'id': user_id,
+            'username': f'synthetic_{user_id}',
+            'email': f'synthetic_{user_id}@example.com',
+            'created_at': now,
+        }
+        for user_id in user_ids
+    ))}
+    _sync_sequence(User)
+
+    # Popularity rank r (1 = most popular) is assigned to a random video
+    first_video = _next_id(Video)
+    video_ids = list(range(first_video, first_video + videos))
+    ranked_video_ids = video_ids[:]
+    rng.shuffle(ranked_video_ids)
+    cum_weights = zipf_cum_weights(videos, zipf_s)
+    rank_of = {video_id: rank for rank, video_id in enumerate(ranked_video_ids, start=1)}
+    views_scale = max(history, 1) * 10
+
+    def pick_video():
+        return ranked_video_ids[bisect.bisect_right(cum_weights, rng.random() * cum_weights[-1])]
+
+    def video_rows():
+        for video_id in video_ids:
+            words = rng.sample(_WORDS, 4)
+            title = ' '.join(words).title()
+            yield {
+                'id': video_id,
+                'title': title,
+                'description': f"A synthetic video about {' and '.join(rng.sample(_WORDS, 3))}.",
+                'url': f'https://example.com/videos/{video_id}.mp4',
+                'thumbnail': f'https://dummyimage.com/320x180/3273dc/ffffff.png&text=Video+{video_id}',
+                'view_count': int(views_scale / cum_weights[-1] / rank_of[video_id] ** zipf_s),
+                'category_id': rng.choice(category_ids),
+                'created_at': now - datetime.timedelta(days=rng.uniform(0, 365)),
+            }
+
+    inserted['video'] = _insert_batches(Video.__table__, video_rows())
+    _sync_sequence(Video)
+
+    def history_rows():
+        if not users or not videos:
+            return
+        mean_per_user = history / users
+        for user_id in user_ids:
+            # Heavy-tailed per-user activity with the requested mean
+            wanted = min(videos, max(1, int(rng.expovariate(1 / mean_per_user))))
+            watched = set()
+            for _ in range(wanted * 3):
+                watched.add(pick_video())
+                if len(watched) >= wanted:
+                    break
+            for video_id in watched:
+                yield {
+                    'user_id': user_id,
+                    'video_id': video_id,
+                    'watched_at': now - datetime.timedelta(seconds=rng.uniform(0, HISTORY_DAYS * 86400)),
+                }
+
+    inserted['user_video_history'] = _insert_batches(user_video_history, history_rows())
+
+    def comment_rows():
+        for n in range(comments):
+            yield {
+                'content': f"Synthetic comment {n} about {rng.choice(_WORDS)}.",
+                'user_id': rng.choice(user_ids),
+                'video_id': pick_video(),
+                'created_at': now - datetime.timedelta(seconds=rng.uniform(0, HISTORY_DAYS * 86400)),
+            }
+
+    if user_ids and video_ids:
+        inserted['comment'] = _insert_batches(Comment.__table__, comment_rows())
+        if inserted['comment']:
+            # Bulk inserts bypass api_add_comment, which keeps the counts otherwise
+            backfill_comment_counts(db.session.connection())
+            db.session.commit()
+    return inserted
+
@@ -0,0 +1,87 @@
+"""
+Offline evaluation of recommendation strategies on a SQLite snapshot
+
+    python evaluate.py instance/videos.db --k 10 --output evaluation.json
+
+The snapshot is copied to a temporary directory and never modified. In the
+copy the most recent history is held out, derived state (co-view
+neighbors, trending and content indexes) is rebuilt from the rest, and
+every strategy is scored on the held-out views (see evaluation.py).
+"""
+import os
+import shutil
+import sqlite3
+import tempfile
+from contextlib import closing
+
+import click
+
+
+def copy_snapshot(path, directory):
+    """Copy a SQLite database with the backup API, so a database in use copies consistently"""
+    target = os.path.join(directory, 'snapshot.db')
+    with closing(sqlite3.connect(f'file:{path}?mode=ro', uri=True)) as source, \
+            closing(sqlite3.connect(target)) as copy:
+        source.backup(copy)
+    return target
+
+
+@click.command()
+@click.argument('snapshot', type=click.Path(exists=True, dir_okay=False))
+@click.option('--strategy', 'strategy_names', multiple=True,
+              help='Strategy to score. Repeatable; default all.')
+@click.option('--k', default=10, show_default=True, help='Videos asked for per user.')
+@click.option('--test-fraction', default=0.2, show_default=True,
+              help='Share of history rows, the most recent ones, held out.')
+@click.option('--users', 'max_users', default=1000, show_default=True, help='Users scored at most.')
+@click.option('--min-precision', default=0.0, help='Precision@k target for picking the fastest strategy.')
+@click.option('--min-recall', default=0.0, help='Recall@k target for picking the fastest strategy.')
+@click.option('--output', type=click.Path(dir_okay=False), help='Save results as JSON.')
+def main(snapshot, strategy_names, k, test_fraction, max_users, min_precision, min_recall, output):
+    """Score recommendation strategies on the most recent views of a SQLite snapshot."""
+    workdir = tempfile.mkdtemp(prefix='evaluate-')
+    try:
+        # The app binds its database and index paths on import, so point them
+        # at the copy before importing it
+        os.environ['DATABASE_URL'] = f"sqlite:///{copy_snapshot(snapshot, workdir)}"
+        os.environ['CONTENT_INDEX_DIR'] = os.path.join(workdir, 'content_index')
+        # Bring older snapshots up to the current schema
+        os.environ['AUTO_INIT_DB'] = '1'
+        os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+        from app import app, ensure_initialized
+        from bench import save_results
+        from evaluation import evaluate, fastest_meeting, split_history
+
+        ensure_initialized()
+        with app.app_context():
+            cutoff, held_out = split_history(test_fraction)
+            results = evaluate(held_out, cutoff, strategy_names or None, k=k, max_users=max_users)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    meta = results['meta']
+    click.echo(f"{meta['users']} users, {meta['held_out_views']} held-out views since {meta['cutoff']}")
+    click.echo(f"{'strategy':20} {'mode':10} {'P@k':>7} {'R@k':>7} {'fill':>5} {'p50':>8} {'p95':>8} "
+               f"{'queries':>8} {'state KiB':>10}")
+    for name, scores in results['results'].items():
+        if scores.get('skipped'):
+            click.echo(f"{name:20} skipped (see log)")
+        for method in ('recommend', 'related'):
+            if method not in scores:
+                continue
+            stats = scores[method]
+            state = f"{scores['state_kb']:10.1f}" if 'state_kb' in scores else f"{'':>10}"
+            click.echo(f"{name:20} {method:10} {stats['precision_at_k']:7.4f} {stats['recall_at_k']:7.4f} "
+                       f"{stats['fill_rate']:5.2f} {stats['p50_ms']:8.3f} {stats['p95_ms']:8.3f} "
+                       f"{stats['queries_per_call']:8.2f} {state}")
+    for method in ('recommend', 'related'):
+        name = fastest_meeting(results, method, min_precision, min_recall)
+        click.echo(f"Fastest {method} strategy meeting the targets: {name or 'none'}")
+    if output:
+        save_results(results, output)
+        click.echo(f"Saved results to {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,273 @@
+import datetime
+import logging
+import random
+import time
+import tracemalloc
+from collections import Counter, defaultdict
+
+from sqlalchemy import bindparam, case, delete, func, select, update
+
+from app import db
+from models import Video, PrecomputedRecommendation, user_video_history
+from bench import git_commit, percentile
+from querycount import total_queries
+from recommendation import RECOMMEND_CHAIN, RELATED_CHAIN
+from strategies import STRATEGIES, run_chain
+
+logger = logging.getLogger(__name__)
+
+# Share of history rows, the most recent ones, held out for scoring
+TEST_FRACTION = 0.2
+
+# Videos asked for per user
+K = 10
+
+# Users scored, sampled among those with views on both sides of the split
+MAX_USERS = 1000
+
+# Untimed calls per strategy and mode before timing starts
+WARMUP = 20
+
+# Untimed calls per strategy and mode traced for their peak memory
+TRACED_CALLS = 5
+
+
+def split_history(test_fraction=TEST_FRACTION):
+    """
+    Hold out the most recent history rows
+
+    The held-out rows are deleted from user_video_history and taken off the
+    videos' view counts, and batch-computed recommendations are dropped, so
+    that whatever is rebuilt afterwards only knows the past. This modifies
+    the database: run it on a copy (evaluate.py does).
+
+    Args:
+        test_fraction: Share of history rows to hold out
+
+    Returns:
+        (cutoff, held_out): the naive UTC datetime the test period starts at
+        and a dict of user_id -> set of video IDs watched from then on
+    """
+    total = db.session.execute(select(func.count()).select_from(user_video_history)).scalar()
+    if not total:
+        raise ValueError("The snapshot has no viewing history to evaluate on")
+    offset = min(total - 1, int(total * (1 - test_fraction)))
+    cutoff = db.session.execute(
+        select(user_video_history.c.watched_at).order_by(user_video_history.c.watched_at)
+        .limit(1).offset(offset)
+    ).scalar()
+
+    held_out = defaultdict(set)
+    views = Counter()
+    for user_id, video_id in db.session.execute(
+        select(user_video_history.c.user_id, user_video_history.c.video_id).where(
+            user_video_history.c.watched_at >= cutoff
+        )
+    ):
+        held_out[user_id].add(video_id)
+        views[video_id] += 1
+
+    db.session.execute(delete(user_video_history).where(user_video_history.c.watched_at >= cutoff))
+    video = Video.__table__
+    db.session.execute(
+        update(video).where(video.c.id == bindparam('b_id')).values(
+            view_count=case((video.c.view_count > bindparam('b_views'),
+                             video.c.view_count - bindparam('b_views')), else_=0)
+        ),
+        [{'b_id': video_id, 'b_views': count} for video_id, count in views.items()]
+    )
+    db.session.execute(delete(PrecomputedRecommendation))
+    db.session.commit()
+    logger.info(f"Held out {sum(views.values())} of {total} history rows, watched from {cutoff}")
+    return cutoff, dict(held_out)
+
+
+def _training_histories(user_ids):
+    """user_id -> (set of video IDs watched before the split, most recent one)"""
+    histories = {}
+    stmt = select(user_video_history.c.user_id, user_video_history.c.video_id).where(
+        user_video_history.c.user_id.in_(user_ids)
+    ).order_by(user_video_history.c.user_id, user_video_history.c.watched_at.desc())
+    for user_id, video_id in db.session.execute(stmt):
+        if user_id not in histories:
+            histories[user_id] = (set(), video_id)
+        histories[user_id][0].add(video_id)
+    return histories
+
+
+def _score(chain, method, cases, k, warmup=WARMUP, traced_calls=TRACED_CALLS):
+    """
+    Run a chain on every case and score the picks against the held-out views
+
+    Args:
+        chain: List of Strategy objects
+        method: 'recommend' or 'related'
+        cases: List of (subject, watched video IDs, held-out video IDs)
+        k: Videos asked for per case
+
+    Returns:
+        Dict with mean precision@k, recall@k and fill rate, latency
+        percentiles in milliseconds, queries per call and peak traced
+        memory of a call in KiB
+    """
+    for subject, watched, _ in cases[:warmup]:
+        run_chain(chain, method, subject, k, watched)
+        db.session.remove()
+
+    timings = []
+    queries = 0
+    precision = recall = filled = 0.0
+    for subject, watched, held_out in cases:
+        start_queries = total_queries()
+        start = time.perf_counter()
+        picked = run_chain(chain, method, subject, k, watched)
+        timings.append((time.perf_counter() - start) * 1000)
+        queries += total_queries() - start_queries
+        db.session.remove()
+
+        hits = sum(1 for video in picked if video.id in held_out)
+        precision += hits / k
+        recall += hits / len(held_out)
+        filled += len(picked) / k
+
+    # Memory is traced in separate calls so tracing does not skew timings
+    peak = 0
+    for subject, watched, _ in cases[:traced_calls]:
+        tracemalloc.start()
+        run_chain(chain, method, subject, k, watched)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        db.session.remove()
+
+    n = max(len(cases), 1)
+    timings.sort()
+    return {
+        'cases': len(cases),
+        'precision_at_k': round(precision / n, 4),
+        'recall_at_k': round(recall / n, 4),
+        'fill_rate': round(filled / n, 4),
+        'p50_ms': round(percentile(timings, 50), 3),
+        'p95_ms': round(percentile(timings, 95), 3),
+        'mean_ms': round(sum(timings) / n, 3),
+        'queries_per_call': round(queries / n, 2),
+        'peak_memory_kb': round(peak / 1024, 1),
+    }
+
+
+def evaluate(held_out, cutoff, strategy_names=None, k=K, max_users=MAX_USERS, seed=1):
+    """
+    Score recommendation strategies on held-out views
+
+    Every strategy's derived state is rebuilt from the remaining history
+    (see split_history), as of the cutoff. Each strategy is then scored on
+    its own, without the popularity fill of the live chains, in two modes:
+    'recommend' asks for a user's home page, 'related' for the videos next
+    to the last video the user watched before the cutoff. The configured
+    RECOMMEND_STRATEGIES and RELATED_STRATEGIES chains are scored as
+    'configured'. Videos the user already watched are excluded in both
+    modes, since they can never be hits.
+
+    Must run inside an app context.
+
+    Args:
+        held_out: Dict of user_id -> held-out video IDs, from split_history
+        cutoff: Start of the held-out period, from split_history
+        strategy_names: Strategies to score, default all registered ones
+        k: Videos asked for per user
+        max_users: Users scored at most
+        seed: Random seed for sampling users
+
+    Returns:
+        Dict with 'meta' and 'results' sections, ready to be saved as JSON.
+        Results hold per strategy the retained and peak traced memory of its
+        rebuild and the scores of both modes.
+    """
+    strategy_names = list(strategy_names or STRATEGIES)
+    unknown = [name for name in strategy_names if name not in STRATEGIES]
+    if unknown:
+        raise ValueError(f"Unknown strategies: {', '.join(unknown)}")
+
+    results = {}
+    rebuilt = set()
+    for strategy in [STRATEGIES[name] for name in strategy_names] + RECOMMEND_CHAIN + RELATED_CHAIN:
+        if strategy.name in rebuilt:
+            continue
+        rebuilt.add(strategy.name)
+        tracemalloc.start()
+        strategy.rebuild(as_of=cutoff)
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        db.session.remove()
+        results[strategy.name] = {
+            'state_kb': round(retained / 1024, 1),
+            'rebuild_peak_kb': round(peak / 1024, 1),
+        }
+
+    histories = _training_histories(list(held_out))
+    user_ids = sorted(user_id for user_id in held_out if user_id in histories)
+    random.Random(seed).shuffle(user_ids)
+    user_ids = user_ids[:max_users]
+    seeds = {v.id: v for v in db.session.query(Video).filter(
+        Video.id.in_({histories[user_id][1] for user_id in user_ids})
+    )}
+    db.session.remove()
+
+    cases = {
+        'recommend': [(user_id, histories[user_id][0], held_out[user_id]) for user_id in user_ids],
+        'related': [(seeds[histories[user_id][1]], histories[user_id][0], held_out[user_id])
+                    for user_id in user_ids if histories[user_id][1] in seeds],
+    }
+
+    for name in strategy_names:
+        strategy = STRATEGIES[name]
+        if not strategy.ready:
+            logger.warning(f"Skipping strategy {name}: its state could not be built")
+            results[name]['skipped'] = True
+            continue
+        for method, method_cases in cases.items():
+            results[name][method] = _score([strategy], method, method_cases, k)
+            logger.info(f"{name} {method}: {results[name][method]}")
+
+    results['configured'] = {
+        'recommend': _score(RECOMMEND_CHAIN, 'recommend', cases['recommend'], k),
+        'related': _score(RELATED_CHAIN, 'related', cases['related'], k),
+        'chains': {
+            'recommend': [strategy.name for strategy in RECOMMEND_CHAIN],
+            'related': [strategy.name for strategy in RELATED_CHAIN],
+        },
+    }
+
+    return {
+        'meta': {
+            'commit': git_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat(),
+            'cutoff': cutoff.isoformat(),
+            'k': k,
+            'users': len(user_ids),
+            'held_out_views': sum(len(held_out[user_id]) for user_id in user_ids),
+        },
+        'results': results,
+    }
+
+
+def fastest_meeting(results, method, min_precision=0.0, min_recall=0.0):
+    """
+    Name of the strategy with the lowest p95 latency that meets the quality targets
+
+    The configured chains are left out: they are not a strategy that could be
+    picked, and their popularity fill makes them look better than their parts.
+
+    Args:
+        results: Result dict from evaluate
+        method: 'recommend' or 'related'
+
+    Returns:
+        Strategy name, or None if none meets the targets
+    """
+    candidates = [
+        (scores[method]['p95_ms'], name) for name, scores in results['results'].items()
+        if name != 'configured' and method in scores
+        and scores[method]['precision_at_k'] >= min_precision
+        and scores[method]['recall_at_k'] >= min_recall
+    ]
+    return min(candidates)[1] if candidates else None
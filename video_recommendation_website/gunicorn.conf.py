@@ -0,0 +1,43 @@
+# Gunicorn settings: `gunicorn -c gunicorn.conf.py`
+#
+# With ASYNC_VIEWS=1 (and `pip install .[async]`) video pages run their
+# independent queries concurrently. Compare both setups against the same
+# database with `flask bench-load --output <file>` and `flask bench-compare`.
+import os
+
+wsgi_app = "main:app"
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# Import the app, run migrations/seeding (when enabled) and build the
+# in-process indexes once in the master; workers inherit them on fork
+preload_app = True
+
+# Recycle workers now and then; with preloading a fresh worker is a cheap fork
+max_requests = int(os.environ.get("MAX_REQUESTS", "5000"))
+max_requests_jitter = 500
+
+
+def post_fork(server, worker):
+    # Database connections must not be shared across processes. In-memory
+    # SQLite lives inside its connection, so each worker keeps its copy.
+    from app import app, db, _in_memory_db
+    if not _in_memory_db:
+        with app.app_context():
+            db.engine.dispose(close=False)
+
+
+def when_ready(server):
+    # The in-process response cache cannot invalidate other workers' entries
+    from cache import CACHE_TTL, response_cache
+    if workers > 1 and response_cache.backend.name == 'lru':
+        server.log.warning(
+            f"{workers} workers share no response cache: pages may be up to "
+            f"{CACHE_TTL}s stale after changes; set CACHE_REDIS_URL to share it"
+        )
+
+
+def worker_exit(server, worker):
+    # Write out buffered view counts before the worker goes away
+    from view_events import view_events
+    view_events.shutdown()
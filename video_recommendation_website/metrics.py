@@ -0,0 +1,288 @@
+import bisect
+import collections
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+from flask import Response, g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from querycount import query_count
+
+logger = logging.getLogger(__name__)
+
+# Latency bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+# Bucket upper bounds for queries per request
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55)
+
+# Allow requests to ask for a sampling profile with ?_profile=1
+PROFILER_ENABLED = os.environ.get("PROFILER_ENABLED") == "1"
+
+# Seconds between profiler samples
+PROFILER_INTERVAL = 0.005
+
+# Number of recent profiles kept for /metrics/profiles
+PROFILES_KEPT = 20
+
+
+def _escape(value, quotes=True):
+    """Escape backslashes and newlines, and quotes unless the text is a HELP line"""
+    value = str(value).replace('\\', '\\\\').replace('\n', '\\n')
+    return value.replace('"', '\\"') if quotes else value
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join('%s="%s"' % (key, _escape(value)) for key, value in labels)
+    return '{' + pairs + '}'
+
+
+class Counter:
+    """Monotonic counter with labels; the name must end in _total"""
+
+    kind = 'counter'
+
+    def __init__(self, name, description):
+        if not name.endswith('_total'):
+            raise ValueError(f"Counter names must end in _total, got {name}")
+        self.name = name
+        self.description = description
+        self._lock = threading.Lock()
+        self._values = collections.defaultdict(float)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] += amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, description, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def time(self, **labels):
+        """Decorator recording the duration of each call"""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(time.perf_counter() - started, **labels)
+            return wrapper
+        return decorator
+
+    def samples(self):
+        with self._lock:
+            values = {key: counts[:] for key, counts in self._values.items()}
+        samples = []
+        for key, counts in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append((self.name + '_bucket', key + (('le', bound),), cumulative))
+            samples.append((self.name + '_count', key, cumulative))
+            samples.append((self.name + '_sum', key, counts[-1]))
+        return samples
+
+
+class Registry:
+    """Collection of metrics rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, description):
+        metric = Counter(name, description)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, description, buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, description, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """Register a function returning [(name, kind, description, [(labels, value), ...]), ...] at scrape time"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.description, quotes=False)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+        for collector in self._collectors:
+            for name, kind, description, values in collector():
+                lines.append(f"# HELP {name} {_escape(description, quotes=False)}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+request_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time spent handling a request, by endpoint')
+request_queries = registry.histogram(
+    'http_request_queries', 'SQL statements executed per request, by endpoint', QUERY_COUNT_BUCKETS)
+function_duration = registry.histogram(
+    'recommendation_function_duration_seconds', 'Time spent in recommendation functions')
+query_duration = registry.histogram(
+    'db_query_duration_seconds', 'Time spent executing SQL statements, by statement type')
+
+
+def timed(fn):
+    """Record the duration of every call of a recommendation function"""
+    return function_duration.time(function=fn.__name__)(fn)
+
+
+# The start time lives on the statement's execution context, which is
+# discarded with it, so a failed statement leaves nothing behind
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_query_started', None)
+    if started is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else 'OTHER'
+    query_duration.observe(time.perf_counter() - started, operation=operation)
+
+
+class SamplingProfiler:
+    """
+    Wall-clock sampling profiler for single requests
+
+    A background thread records the stack of the request's thread every
+    PROFILER_INTERVAL seconds. Profiles are kept in the collapsed-stack format
+    used by flame graph tools.
+    """
+
+    def __init__(self, interval=PROFILER_INTERVAL, kept=PROFILES_KEPT):
+        self.interval = interval
+        self.profiles = collections.deque(maxlen=kept)
+
+    def start(self, label):
+        target = threading.get_ident()
+        stop = threading.Event()
+        stacks = collections.Counter()
+
+        def sample():
+            while not stop.wait(self.interval):
+                frame = sys._current_frames().get(target)
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if names:
+                    stacks[';'.join(reversed(names))] += 1
+
+        thread = threading.Thread(target=sample, name='request-profiler', daemon=True)
+        thread.start()
+
+        def finish():
+            stop.set()
+            thread.join()
+            self.profiles.append((label, stacks))
+            return sum(stacks.values())
+        return finish
+
+    def render(self):
+        lines = []
+        for label, stacks in self.profiles:
+            lines.append(f"# {label}")
+            lines.extend(f"{stack} {count}" for stack, count in stacks.most_common())
+        return '\n'.join(lines) + '\n'
+
+
+profiler = SamplingProfiler()
+
+
+def init_app(app, response_cache=None):
+    """Register request hooks and the /metrics endpoints"""
+
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+        g.request_queries_started = query_count()
+        if PROFILER_ENABLED and request.args.get('_profile') == '1':
+            g.profile_finish = profiler.start(f"{request.method} {request.full_path}")
+
+    @app.after_request
+    def _record_request(response):
+        started = g.pop('request_started', None)
+        if started is None:
+            return response
+        endpoint = request.endpoint or 'unmatched'
+        request_duration.observe(time.perf_counter() - started, endpoint=endpoint)
+        request_queries.observe(query_count() - g.pop('request_queries_started', 0), endpoint=endpoint)
+        finish = g.pop('profile_finish', None)
+        if finish is not None:
+            response.headers['X-Profile-Samples'] = str(finish())
+        return response
+
+    if response_cache is not None:
+        def cache_collector():
+            lookups = response_cache.hits + response_cache.misses + response_cache.not_modified
+            served = response_cache.hits + response_cache.not_modified
+            return [
+                ('response_cache_requests_total', 'counter', 'Cached view lookups by result', [
+                    ({'result': 'hit'}, response_cache.hits),
+                    ({'result': 'miss'}, response_cache.misses),
+                    ({'result': 'not_modified'}, response_cache.not_modified),
+                ]),
+                ('response_cache_hit_ratio', 'gauge', 'Share of lookups served without running the view', [
+                    ({}, served / lookups if lookups else 0.0),
+                ]),
+            ]
+        registry.add_collector(cache_collector)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/profiles')
+    def metrics_profiles():
+        if not PROFILER_ENABLED:
+            return Response('Profiler disabled; set PROFILER_ENABLED=1\n', status=404, mimetype='text/plain')
+        return Response(profiler.render(), mimetype='text/plain')
@@ -0,0 +1,254 @@
+import datetime
+import logging
+
+from sqlalchemy import (
+    Column, DateTime, Float, ForeignKey, Index, Integer, MetaData, String, Table, Text,
+    inspect, select, text
+)
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.schema import CreateTable
+
+from app import db
+from models import Video, Comment, user_video_history
+
+logger = logging.getLogger(__name__)
+
+# Applied migrations, one row per version
+schema_migrations = db.Table('schema_migrations',
+    db.Column('version', db.String(64), primary_key=True),
+    db.Column('applied_at', db.DateTime, default=datetime.datetime.utcnow)
+)
+
+
+# The schema each migration creates, frozen here. Migrations never read the
+# models, so editing a model cannot change what an old migration does; every
+# schema change goes into a new migration instead.
+_frozen = MetaData()
+
+_user = Table('user', _frozen,
+    Column('id', Integer, primary_key=True),
+    Column('username', String(64), unique=True, nullable=False),
+    Column('email', String(120), unique=True, nullable=False),
+    Column('password_hash', String(256)),
+    Column('created_at', DateTime)
+)
+
+_category = Table('category', _frozen,
+    Column('id', Integer, primary_key=True),
+    Column('name', String(100), nullable=False),
+    Column('description', Text)
+)
+
+_video = Table('video', _frozen,
+    Column('id', Integer, primary_key=True),
+    Column('title', String(200), nullable=False),
+    Column('description', Text),
+    Column('url', String(500), nullable=False),
+    Column('thumbnail', String(500)),
+    Column('view_count', Integer),
+    Column('created_at', DateTime),
+    Column('category_id', Integer, ForeignKey('category.id'), nullable=False)
+)
+
+_comment = Table('comment', _frozen,
+    Column('id', Integer, primary_key=True),
+    Column('content', Text, nullable=False),
+    Column('created_at', DateTime),
+    Column('user_id', Integer, ForeignKey('user.id'), nullable=False),
+    Column('video_id', Integer, ForeignKey('video.id'), nullable=False)
+)
+
+_user_video_history = Table('user_video_history', _frozen,
+    Column('user_id', Integer, ForeignKey('user.id'), primary_key=True),
+    Column('video_id', Integer, ForeignKey('video.id'), primary_key=True),
+    Column('watched_at', DateTime)
+)
+
+_video_neighbor = Table('video_neighbor', _frozen,
+    Column('video_id', Integer, ForeignKey('video.id'), primary_key=True),
+    Column('rank', Integer, primary_key=True),
+    Column('neighbor_id', Integer, ForeignKey('video.id'), nullable=False),
+    Column('score', Float, nullable=False)
+)
+
+_precomputed_recommendation = Table('precomputed_recommendation', _frozen,
+    Column('user_id', Integer, ForeignKey('user.id'), primary_key=True),
+    Column('rank', Integer, primary_key=True),
+    Column('video_id', Integer, ForeignKey('video.id'), nullable=False),
+    Column('computed_at', DateTime, nullable=False)
+)
+
+# 0002
+_hot_path_indexes = (
+    Index('ix_video_category_view_count', _video.c.category_id, _video.c.view_count.desc(), _video.c.id.desc()),
+    Index('ix_video_view_count', _video.c.view_count.desc(), _video.c.id.desc()),
+    Index('ix_comment_video_created_at', _comment.c.video_id, _comment.c.created_at.desc()),
+    Index('ix_user_video_history_user_watched_at', _user_video_history.c.user_id,
+          _user_video_history.c.watched_at),
+)
+
+# 0004 (replaces ix_comment_video_created_at)
+_comment_keyset_index = Index('ix_comment_video_created_at_id', _comment.c.video_id,
+                              _comment.c.created_at.desc(), _comment.c.id.desc())
+
+
+def _create_tables(connection, tables):
+    # Tables that already exist are left alone, so the baseline is safe to
+    # run against a database created by an older db.create_all()
+    existing = set(inspect(connection).get_table_names())
+    for table in tables:
+        if table.name not in existing:
+            connection.execute(CreateTable(table))
+
+
+def _create_baseline(connection):
+    _create_tables(connection, (_user, _category, _video, _comment, _user_video_history, _video_neighbor))
+
+
+def _create_hot_path_indexes(connection):
+    for index in _hot_path_indexes:
+        index.create(bind=connection, checkfirst=True)
+
+
+def _create_precomputed_recommendations(connection):
+    _create_tables(connection, (_precomputed_recommendation,))
+
+
+def _add_comment_counts(connection):
+    connection.execute(text('ALTER TABLE video ADD COLUMN comment_count INTEGER NOT NULL DEFAULT 0'))
+    connection.execute(text(
+        'UPDATE video SET comment_count = (SELECT COUNT(*) FROM comment WHERE comment.video_id = video.id)'
+    ))
+
+    # Keyset pagination of comments orders by (created_at, id)
+    connection.execute(text('DROP INDEX IF EXISTS ix_comment_video_created_at'))
+    _comment_keyset_index.create(bind=connection, checkfirst=True)
+
+
+def _fts5_available(connection):
+    try:
+        connection.execute(text("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(x)"))
+        connection.execute(text("DROP TABLE temp.fts5_probe"))
+        return True
+    except OperationalError:
+        return False
+
+
+def _create_video_search(connection):
+    # SQLite only; other databases (and SQLite builds without FTS5) are
+    # searched by the in-process index of search_index.PythonBackend
+    if connection.dialect.name != 'sqlite' or not _fts5_available(connection):
+        logger.info("FTS5 is not available; video search uses the in-process index")
+        return
+    # Databases searched before this migration existed created the table on first use
+    if inspect(connection).has_table('video_fts'):
+        return
+
+    connection.execute(text(
+        "CREATE VIRTUAL TABLE video_fts USING fts5("
+        "title, description, content='video', content_rowid='id', "
+        "tokenize='unicode61 remove_diacritics 2')"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER video_fts_ai AFTER INSERT ON video BEGIN "
+        "INSERT INTO video_fts(rowid, title, description) "
+        "VALUES (new.id, new.title, new.description); END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER video_fts_ad AFTER DELETE ON video BEGIN "
+        "INSERT INTO video_fts(video_fts, rowid, title, description) "
+        "VALUES ('delete', old.id, old.title, old.description); END"
+    ))
+    connection.execute(text(
+        "CREATE TRIGGER video_fts_au AFTER UPDATE OF title, description ON video BEGIN "
+        "INSERT INTO video_fts(video_fts, rowid, title, description) "
+        "VALUES ('delete', old.id, old.title, old.description); "
+        "INSERT INTO video_fts(rowid, title, description) "
+        "VALUES (new.id, new.title, new.description); END"
+    ))
+    # Index the rows that already exist
+    connection.execute(text("INSERT INTO video_fts(video_fts) VALUES ('rebuild')"))
+
+
+# Ordered list of (version, description, function taking a connection)
+MIGRATIONS = [
+    ('0001_baseline', 'Create tables', _create_baseline),
+    ('0002_hot_path_indexes', 'Indexes for recommendation, listing and history queries',
+     _create_hot_path_indexes),
+    ('0003_precomputed_recommendations', 'Table for batch-computed recommendations',
+     _create_precomputed_recommendations),
+    ('0004_comment_counts', 'Denormalized comment counts and a keyset index for comment pages',
+     _add_comment_counts),
+    ('0005_video_search', 'SQLite FTS5 table and triggers for video search', _create_video_search),
+]
+
+
+def applied_versions():
+    """Get the set of migration versions already applied"""
+    schema_migrations.create(bind=db.engine, checkfirst=True)
+    with db.engine.connect() as connection:
+        return set(connection.execute(select(schema_migrations.c.version)).scalars())
+
+
+def upgrade():
+    """
+    Apply every pending migration in order, each in its own transaction
+
+    Returns:
+        List of versions that were applied
+    """
+    done = applied_versions()
+    applied = []
+    for version, description, migrate in MIGRATIONS:
+        if version in done:
+            continue
+        logger.info(f"Applying migration {version}: {description}")
+        with db.engine.begin() as connection:
+            migrate(connection)
+            connection.execute(schema_migrations.insert().values(version=version))
+        applied.append(version)
+    return applied
+
+
+def _plan(stmt):
+    """Get the query plan of a statement as a single string"""
+    sql = str(stmt.compile(dialect=db.engine.dialect, compile_kwargs={'literal_binds': True}))
+    with db.engine.connect() as connection:
+        if db.engine.dialect.name == 'sqlite':
+            rows = connection.execute(text('EXPLAIN QUERY PLAN ' + sql))
+            return '\n'.join(row[-1] for row in rows)
+        # Small tables are cheaper to scan; make the planner show whether an
+        # index is usable at all
+        connection.execute(text('SET LOCAL enable_seqscan = off'))
+        return '\n'.join(row[0] for row in connection.execute(text('EXPLAIN ' + sql)))
+
+
+def check_query_plans():
+    """
+    Check that the hot queries are planned with their indexes
+
+    Returns:
+        List of (description, expected index, used, plan) tuples
+    """
+    history = user_video_history
+    checks = [
+        ('Recommendations from top categories', 'ix_video_category_view_count',
+         select(Video.id).where(Video.category_id.in_([1, 2, 3])).order_by(
+             Video.view_count.desc()).limit(12)),
+        ('Category page', 'ix_video_category_view_count',
+         select(Video.id).where(Video.category_id == 1).order_by(
+             Video.view_count.desc(), Video.id.desc()).limit(25)),
+        ('Popular videos', 'ix_video_view_count',
+         select(Video.id).order_by(Video.view_count.desc(), Video.id.desc()).limit(12)),
+        ('Comment listing', 'ix_comment_video_created_at_id',
+         select(Comment.id).where(Comment.video_id == 1).order_by(
+             Comment.created_at.desc(), Comment.id.desc()).limit(20)),
+        ('Recent history of a user', 'ix_user_video_history_user_watched_at',
+         select(history.c.video_id).where(history.c.user_id == 1).order_by(
+             history.c.watched_at.desc())),
+    ]
+    results = []
+    for description, index_name, stmt in checks:
+        plan = _plan(stmt)
+        results.append((description, index_name, index_name in plan, plan))
+    return results
@@ -46,6 +46,7 @@ class Video(db.Model):
     url = db.Column(db.String(500), nullable=False)  # URL to the video source
     thumbnail = db.Column(db.String(500))  # URL to the thumbnail image
     view_count = db.Column(db.Integer, default=0)
+    comment_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Kept in step by api_add_comment
     created_at = db.Column(db.DateTime, default=datetime.datetime.utcnow)
     
     # Foreign keys
@@ -57,6 +58,10 @@ class Video(db.Model):
     def __repr__(self):
         return f'<Video {self.title}>'
 
+# Secondary indexes for the hot query predicates (see migrations.py)
+db.Index('ix_video_category_view_count', Video.category_id, Video.view_count.desc(), Video.id.desc())
+db.Index('ix_video_view_count', Video.view_count.desc(), Video.id.desc())
+
 class Comment(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.Text, nullable=False)
@@ -67,7 +72,31 @@ class Comment(db.Model):
     video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
     
     def __repr__(self):
-        return f'<Comment {self.id} by {self.user.username}>'
+        return f'<Comment {self.id} by user {self.user_id}>'
+
+db.Index('ix_comment_video_created_at_id', Comment.video_id, Comment.created_at.desc(), Comment.id.desc())
+db.Index('ix_user_video_history_user_watched_at',
+         user_video_history.c.user_id, user_video_history.c.watched_at)
+
+class VideoNeighbor(db.Model):
+    """Precomputed co-view neighbors of a video, written by coview.build_neighbor_table"""
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    neighbor_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+    
+    def __repr__(self):
+        return f'<VideoNeighbor {self.video_id} #{self.rank} -> {self.neighbor_id}>'
+
+class PrecomputedRecommendation(db.Model):
+    """Recommendations written by batch_recommend, served before the online path"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    rank = db.Column(db.Integer, primary_key=True)
+    video_id = db.Column(db.Integer, db.ForeignKey('video.id'), nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.datetime.utcnow, nullable=False)
+    
+    def __repr__(self):
+        return f'<PrecomputedRecommendation {self.user_id} #{self.rank} -> {self.video_id}>'
 
 def seed_initial_data():
     """Seed the database with initial data if tables are empty"""
@@ -194,5 +223,6 @@ def seed_initial_data():
                 video_id=video.id
             )
             db.session.add(comment)
+            video.comment_count = 1
         
         db.session.commit()
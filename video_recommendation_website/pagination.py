@@ -0,0 +1,81 @@
+import base64
+import datetime
+import json
+
+from flask import abort
+from sqlalchemy import DateTime, and_, desc, or_
+
+
+def encode_cursor(*values):
+    """Encode the sort key of the last row on a page as an opaque cursor"""
+    raw = json.dumps(values, separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size):
+    """
+    Decode a cursor produced by encode_cursor
+
+    Aborts with 400 if the cursor is malformed.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        abort(400)
+    if not isinstance(values, list) or len(values) != size:
+        abort(400)
+    return values
+
+
+def _integer_key(value):
+    """Whether a decoded cursor value can be bound as a BIGINT"""
+    return isinstance(value, int) and not isinstance(value, bool) and -2 ** 63 <= value < 2 ** 63
+
+
+def after_desc(primary, tiebreak, last_primary, last_tiebreak):
+    """Criterion for the rows after (last_primary, last_tiebreak) in (primary DESC, tiebreak DESC) order"""
+    return or_(
+        primary < last_primary,
+        and_(primary == last_primary, tiebreak < last_tiebreak)
+    )
+
+
+def keyset_desc(stmt, primary, tiebreak, cursor):
+    """
+    Order a statement by (primary DESC, tiebreak DESC) and start after a cursor
+
+    Args:
+        stmt: A select or ORM query
+        primary: The main sort column, e.g. Video.view_count or Comment.created_at
+        tiebreak: A unique column, e.g. Video.id
+        cursor: Cursor of the last row already returned, or None for the first page.
+                Aborts with 400 unless it holds an integer (an ISO 8601 string
+                for DateTime columns) and an integer tiebreak.
+
+    Returns:
+        The filtered and ordered statement
+    """
+    if cursor:
+        last_primary, last_tiebreak = decode_cursor(cursor, 2)
+        if isinstance(primary.type, DateTime):
+            # encode_cursor stores datetimes as strings
+            if not isinstance(last_primary, str):
+                abort(400)
+            try:
+                last_primary = datetime.datetime.fromisoformat(last_primary)
+            except ValueError:
+                abort(400)
+        elif not _integer_key(last_primary):
+            abort(400)
+        if not _integer_key(last_tiebreak):
+            abort(400)
+        stmt = stmt.filter(after_desc(primary, tiebreak, last_primary, last_tiebreak))
+    return stmt.order_by(desc(primary), desc(tiebreak))
+
+
+def page_size(value, default, maximum):
+    """Clamp a requested page size"""
+    if value is None or value < 1:
+        return default
+    return min(value, maximum)
@@ -0,0 +1,68 @@
+import functools
+import inspect
+import logging
+import threading
+
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Statements executed by this process, across all contexts and threads
+_total_queries = 0
+_total_lock = threading.Lock()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    global _total_queries
+    with _total_lock:
+        _total_queries += 1
+    if has_app_context():
+        g.query_count = g.get('query_count', 0) + 1
+
+
+def total_queries():
+    """Number of SQL statements executed by this process so far"""
+    return _total_queries
+
+
+def query_count():
+    """Number of SQL statements executed in the current app context"""
+    return g.get('query_count', 0)
+
+
+def query_budget(limit):
+    """
+    Warn when a view executes more than `limit` SQL statements
+
+    With QUERY_BUDGET_STRICT enabled the view fails instead, which is meant
+    for tests and development.
+    """
+    def check(view, start):
+        used = query_count() - start
+        if used > limit:
+            message = f"{view.__name__} executed {used} queries (budget {limit})"
+            if current_app.config.get("QUERY_BUDGET_STRICT"):
+                raise AssertionError(message)
+            logger.warning(message)
+
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def async_wrapper(*args, **kwargs):
+                start = query_count()
+                response = await view(*args, **kwargs)
+                check(view, start)
+                return response
+            return async_wrapper
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            start = query_count()
+            response = view(*args, **kwargs)
+            check(view, start)
+            return response
+        return wrapper
+    return decorator
@@ -1,18 +1,59 @@
+import datetime
+import os
 from app import db
-from models import Video, Category, user_video_history
-from sqlalchemy import func, desc, select
-from collections import Counter
+from models import Video, Category, PrecomputedRecommendation
+from affinity import affinity_index
+from metrics import timed
+from strategies import parse_chain, run_chain
+from batch_recommend import BATCH_CHAIN
+from sqlalchemy.orm import joinedload
 import random
 
+# Strategies (see strategies.py) tried in order for a user's home page and
+# for the related videos of a video page; later ones fill what earlier ones left
+RECOMMEND_STRATEGIES = os.environ.get("RECOMMEND_STRATEGIES", "category-affinity,popularity")
+RELATED_STRATEGIES = os.environ.get("RELATED_STRATEGIES", "co-view,category-affinity,popularity")
+
+RECOMMEND_CHAIN = parse_chain(RECOMMEND_STRATEGIES)
+RELATED_CHAIN = parse_chain(RELATED_STRATEGIES)
+
+# Rows written by batch_recommend follow BATCH_CHAIN; with another chain
+# configured they would override it, so they are not served
+SERVE_PRECOMPUTED = tuple(strategy.name for strategy in RECOMMEND_CHAIN) == BATCH_CHAIN
+
+# How long recommendations written by batch_recommend are served
+PRECOMPUTED_MAX_AGE = datetime.timedelta(hours=24)
+
+def _precomputed_videos(user_id, limit):
+    """Get the user's batch-computed recommendations, minus videos watched since"""
+    cutoff = datetime.datetime.utcnow() - PRECOMPUTED_MAX_AGE
+    videos = Video.query.options(joinedload(Video.category)).join(
+        PrecomputedRecommendation, PrecomputedRecommendation.video_id == Video.id
+    ).filter(
+        PrecomputedRecommendation.user_id == user_id,
+        PrecomputedRecommendation.computed_at >= cutoff
+    ).order_by(PrecomputedRecommendation.rank).all()
+    if not videos:
+        return []
+    
+    watched_video_ids = affinity_index.watched(user_id)
+    videos = [v for v in videos if v.id not in watched_video_ids][:limit]
+    # Only serve a full page; otherwise compute online
+    return videos if len(videos) == limit else []
+
+@timed
 def get_recommended_videos(user_id=None, limit=12):
     """
     Get recommended videos for a user or generic recommendations if no user_id
     
     Algorithm:
-    1. If user_id is provided, get videos based on user's viewing history
-       - Find most watched categories
+    1. If user_id is provided and batch-computed recommendations are fresh, serve
+       them (only while the chain is BATCH_CHAIN, which the batch job computes)
+    2. Otherwise run the RECOMMEND_STRATEGIES chain, skipping videos the user
+       has watched. By default:
+       - Find the user's most watched categories
        - Recommend videos from those categories that user hasn't watched
-    2. If no user_id, return popular videos
+       - Fill up with popular videos (the only step for anonymous users)
     
     Args:
         user_id: The ID of the user to get recommendations for
@@ -21,113 +62,38 @@ def get_recommended_videos(user_id=None, limit=12):
     Returns:
         List of Video objects
     """
-    
-    # If user_id is provided, get personalized recommendations
+    watched_video_ids = ()
     if user_id:
-        # Get videos the user has watched
-        stmt = select(user_video_history).where(user_video_history.c.user_id == user_id)
-        result = db.session.execute(stmt).fetchall()
-        
-        if result:
-            # Get the video IDs the user has watched
-            watched_video_ids = [row[1] for row in result]
-            
-            # Get the categories of videos the user has watched
-            watched_videos = Video.query.filter(Video.id.in_(watched_video_ids)).all()
-            watched_categories = [video.category_id for video in watched_videos]
-            
-            # Count category frequencies
-            category_counts = Counter(watched_categories)
-            top_categories = [cat_id for cat_id, _ in category_counts.most_common(3)]
-            
-            # Get recommendations from top categories that user hasn't watched yet
-            recommendations = Video.query.filter(
-                Video.category_id.in_(top_categories),
-                ~Video.id.in_(watched_video_ids)
-            ).order_by(desc(Video.view_count)).limit(limit).all()
-            
-            # If not enough recommendations, add popular videos from other categories
-            if len(recommendations) < limit:
-                more_videos = Video.query.filter(
-                    ~Video.id.in_(watched_video_ids),
-                    ~Video.id.in_([v.id for v in recommendations])
-                ).order_by(desc(Video.view_count)).limit(limit - len(recommendations)).all()
-                
-                recommendations.extend(more_videos)
-            
-            return recommendations
+        if SERVE_PRECOMPUTED:
+            recommendations = _precomputed_videos(user_id, limit)
+            if recommendations:
+                return recommendations
+        watched_video_ids = affinity_index.watched(user_id)
     
-    # Default: return popular videos
-    return Video.query.order_by(desc(Video.view_count)).limit(limit).all()
+    return run_chain(RECOMMEND_CHAIN, 'recommend', user_id, limit, watched_video_ids)
 
-def get_related_videos(video_id, limit=6):
+@timed
+def get_related_videos(video_id, limit=6, session=None):
     """
     Get videos related to the given video_id
     
-    Algorithm:
-    1. Get videos from the same category
-    2. Exclude the current video
-    3. Order by view count
+    Runs the RELATED_STRATEGIES chain, excluding the current video. By default:
+    1. Co-viewed videos from the precomputed neighbor table
+    2. Fill up with videos from the same category, ordered by popularity
+    3. Fill up with popular videos from other categories
     
     Args:
         video_id: The ID of the video to find related videos for
         limit: Maximum number of videos to return
+        session: Session to query with, default the request's db.session
         
     Returns:
         List of Video objects
     """
-    # Get the video's category
-    video = Video.query.get(video_id)
+    session = session or db.session
+    
+    video = session.get(Video, video_id)
     if not video:
         return []
     
-    # Get videos from the same category, excluding the current video
-    related = Video.query.filter(
-        Video.category_id == video.category_id,
-        Video.id != video_id
-    ).order_by(desc(Video.view_count)).limit(limit).all()
-    
-    # If not enough related videos, add some popular videos from other categories
-    if len(related) < limit:
-        more_videos = Video.query.filter(
-            Video.category_id != video.category_id,
-            Video.id != video_id
-        ).order_by(desc(Video.view_count)).limit(limit - len(related)).all()
-        
-        related.extend(more_videos)
-    
-    return related
-
-def update_video_history(user_id, video_id):
-    """
-    Update the user's video viewing history
-    
-    Args:
-        user_id: The ID of the user
-        video_id: The ID of the video being watched
-    """
-    # Check if entry already exists
-    stmt = select(user_video_history).where(
-        user_video_history.c.user_id == user_id,
-        user_video_history.c.video_id == video_id
-    )
-    result = db.session.execute(stmt).fetchone()
-    
-    if not result:
-        # Add new entry to history
-        stmt = user_video_history.insert().values(
-            user_id=user_id,
-            video_id=video_id
-        )
-        db.session.execute(stmt)
-        db.session.commit()
-    else:
-        # Update the watched_at timestamp
-        stmt = user_video_history.update().where(
-            user_video_history.c.user_id == user_id,
-            user_video_history.c.video_id == video_id
-        ).values(
-            watched_at=func.current_timestamp()
-        )
-        db.session.execute(stmt)
-        db.session.commit()
+    return run_chain(RELATED_CHAIN, 'related', video, limit, {video_id}, session)
@@ -0,0 +1,273 @@
+import bisect
+import logging
+import math
+import re
+import threading
+import time
+from collections import defaultdict
+
+from sqlalchemy import event, inspect, select, text
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import Video
+
+logger = logging.getLogger(__name__)
+
+# Relative weight of title matches over description matches
+TITLE_WEIGHT = 5.0
+DESCRIPTION_WEIGHT = 1.0
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# How long the in-process index is trusted before it is rebuilt from the
+# database. Other workers may have changed videos in the meantime.
+PYTHON_INDEX_MAX_AGE = 600
+
+# Deepest page served; the offset of much deeper pages would overflow the bind
+MAX_PAGE = 1000
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(value):
+    """Split text into lowercase search terms"""
+    return _TOKEN_RE.findall((value or '').lower())
+
+
+class FTS5Backend:
+    """
+    Search backend using an SQLite FTS5 external-content table
+
+    The virtual table mirrors video.title and video.description and is kept
+    up to date by triggers, so every write path (ORM or bulk SQL) is covered.
+    Both are created by migration 0005 (see migrations.py).
+    """
+
+    name = 'fts5'
+
+    @staticmethod
+    def available():
+        # The table and its triggers are created by migration 0005, where
+        # FTS5 is available
+        if db.engine.dialect.name != 'sqlite':
+            return False
+        return db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'video_fts'"
+        )).first() is not None
+
+    def setup(self):
+        pass
+
+    def search(self, terms, limit, offset):
+        # Every term must match, each as a prefix
+        match = ' '.join('"%s"*' % term for term in terms)
+        total = db.session.execute(
+            text("SELECT count(*) FROM video_fts WHERE video_fts MATCH :match"),
+            {'match': match}
+        ).scalar()
+        rows = db.session.execute(
+            text(
+                "SELECT rowid FROM video_fts WHERE video_fts MATCH :match "
+                "ORDER BY bm25(video_fts, :title_weight, :description_weight) "
+                "LIMIT :limit OFFSET :offset"
+            ),
+            {
+                'match': match,
+                'title_weight': TITLE_WEIGHT,
+                'description_weight': DESCRIPTION_WEIGHT,
+                'limit': limit,
+                'offset': offset,
+            }
+        )
+        return [row[0] for row in rows], total
+
+
+class PythonBackend:
+    """
+    In-process inverted index with BM25 ranking
+
+    Used when FTS5 is not available (for example on PostgreSQL). Postings map
+    each term to {video_id: weighted term frequency}; a sorted vocabulary
+    allows prefix matching with bisect. The index is built lazily, updated
+    from Video mapper events and rebuilt once it is older than
+    PYTHON_INDEX_MAX_AGE.
+    """
+
+    name = 'python'
+
+    def __init__(self, max_age=PYTHON_INDEX_MAX_AGE):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._reset()
+
+    def _reset(self):
+        self._postings = defaultdict(dict)
+        self._doc_terms = {}
+        self._doc_lengths = {}
+        self._total_length = 0.0
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def setup(self):
+        pass
+
+    def _ensure_built(self):
+        if self._built_at is not None and time.monotonic() - self._built_at < self.max_age:
+            return
+        with self._lock:
+            self._reset()
+            stmt = select(Video.id, Video.title, Video.description).execution_options(
+                yield_per=1000
+            )
+            for video_id, title, description in db.session.execute(stmt):
+                self._add(video_id, title, description)
+            self._built_at = time.monotonic()
+
+    def _add(self, video_id, title, description):
+        weights = defaultdict(float)
+        for term in tokenize(title):
+            weights[term] += TITLE_WEIGHT
+        for term in tokenize(description):
+            weights[term] += DESCRIPTION_WEIGHT
+
+        for term, weight in weights.items():
+            if term not in self._postings:
+                self._vocabulary_dirty = True
+            self._postings[term][video_id] = weight
+        length = sum(weights.values())
+        self._doc_terms[video_id] = list(weights)
+        self._doc_lengths[video_id] = length
+        self._total_length += length
+
+    def _remove(self, video_id):
+        for term in self._doc_terms.pop(video_id, ()):
+            postings = self._postings.get(term)
+            if postings is None:
+                continue
+            postings.pop(video_id, None)
+            if not postings:
+                del self._postings[term]
+                self._vocabulary_dirty = True
+        self._total_length -= self._doc_lengths.pop(video_id, 0.0)
+
+    def update(self, video_id, title, description):
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._remove(video_id)
+            self._add(video_id, title, description)
+
+    def remove(self, video_id):
+        if self._built_at is None:
+            return
+        with self._lock:
+            self._remove(video_id)
+
+    def _expand(self, prefix):
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self._postings)
+            self._vocabulary_dirty = False
+        start = bisect.bisect_left(self._vocabulary, prefix)
+        end = bisect.bisect_left(self._vocabulary, prefix + '\uffff', start)
+        return self._vocabulary[start:end]
+
+    def search(self, terms, limit, offset):
+        self._ensure_built()
+        with self._lock:
+            doc_count = len(self._doc_lengths)
+            if not doc_count:
+                return [], 0
+            avg_length = self._total_length / doc_count
+
+            scores = None
+            for prefix in terms:
+                term_scores = defaultdict(float)
+                for term in self._expand(prefix):
+                    postings = self._postings[term]
+                    idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                    for video_id, tf in postings.items():
+                        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._doc_lengths[video_id] / avg_length)
+                        term_scores[video_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+                # Every term must match
+                if scores is None:
+                    scores = term_scores
+                else:
+                    scores = {video_id: score + term_scores[video_id]
+                              for video_id, score in scores.items() if video_id in term_scores}
+                if not scores:
+                    return [], 0
+
+        ranked = sorted(scores, key=lambda video_id: (-scores[video_id], video_id))
+        return ranked[offset:offset + limit], len(ranked)
+
+
+class SearchIndex:
+    """Full-text video search, backed by FTS5 when available"""
+
+    def __init__(self):
+        self.backend = None
+
+    def setup(self):
+        """Pick a backend and prepare it. Must run inside an app context."""
+        if FTS5Backend.available():
+            self.backend = FTS5Backend()
+        else:
+            self.backend = PythonBackend()
+        self.backend.setup()
+        logger.info(f"Search index ready using the {self.backend.name} backend")
+
+    def search(self, query, page=1, per_page=24):
+        """
+        Search videos by title and description
+
+        Args:
+            query: The user's search string; every word must match as a prefix
+            page: 1-based page number, clamped to 1..MAX_PAGE
+            per_page: Number of results per page
+
+        Returns:
+            Tuple of (list of Video objects in rank order, total number of matches)
+        """
+        terms = tokenize(query)
+        if not terms:
+            return [], 0
+        if self.backend is None:
+            self.setup()
+
+        page = min(max(page, 1), MAX_PAGE)
+        video_ids, total = self.backend.search(terms, per_page, (page - 1) * per_page)
+        if not video_ids:
+            return [], total
+
+        videos = {v.id: v for v in Video.query.options(joinedload(Video.category)).filter(
+            Video.id.in_(video_ids)
+        ).all()}
+        return [videos[video_id] for video_id in video_ids if video_id in videos], total
+
+
+search_index = SearchIndex()
+
+
+@event.listens_for(Video, 'after_insert')
+def _index_inserted_video(mapper, connection, target):
+    if isinstance(search_index.backend, PythonBackend):
+        search_index.backend.update(target.id, target.title, target.description)
+
+
+@event.listens_for(Video, 'after_update')
+def _index_updated_video(mapper, connection, target):
+    if not isinstance(search_index.backend, PythonBackend):
+        return
+    state = inspect(target)
+    if state.attrs.title.history.has_changes() or state.attrs.description.history.has_changes():
+        search_index.backend.update(target.id, target.title, target.description)
+
+
+@event.listens_for(Video, 'after_delete')
+def _index_deleted_video(mapper, connection, target):
+    if isinstance(search_index.backend, PythonBackend):
+        search_index.backend.remove(target.id)
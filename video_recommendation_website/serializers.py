@@ -0,0 +1,81 @@
+from sqlalchemy import select
+
+from models import Video, Category, Comment, User
+from pagination import encode_cursor, keyset_desc
+
+# Columns needed to render a video card in API responses
+VIDEO_SUMMARY_COLUMNS = (
+    Video.id,
+    Video.title,
+    Video.thumbnail,
+    Video.view_count,
+    Category.name.label('category'),
+)
+
+# Default and maximum number of comments per page
+COMMENT_PAGE_SIZE = 20
+COMMENT_MAX_PAGE_SIZE = 100
+
+# Columns needed to render a comment in API responses
+COMMENT_COLUMNS = (
+    Comment.id,
+    Comment.content,
+    User.username.label('user'),
+    Comment.created_at,
+)
+
+
+def video_summary_select():
+    """Select video card columns with the category name joined in"""
+    return select(*VIDEO_SUMMARY_COLUMNS).join(Category, Video.category_id == Category.id)
+
+
+def comment_select(video_id, cursor=None):
+    """
+    Select a page of a video's comments with the author name joined in
+
+    Comments are ordered newest first by (created_at, id). Add a LIMIT to get
+    one page; pass the cursor of the last comment shown to get the next one.
+    """
+    stmt = select(*COMMENT_COLUMNS).join(User, Comment.user_id == User.id).where(
+        Comment.video_id == video_id
+    )
+    return keyset_desc(stmt, Comment.created_at, Comment.id, cursor)
+
+
+def comment_page(rows, page_size=COMMENT_PAGE_SIZE):
+    """
+    Split the rows of comment_select(...).limit(page_size + 1) into a page
+
+    Returns:
+        (rows of the page, cursor of the next page or None)
+    """
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    return rows, encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def serialize_row(row):
+    """Convert a result row of the column selects above to a JSON-ready dict"""
+    data = dict(row._mapping)
+    for key, value in data.items():
+        if hasattr(value, 'isoformat'):
+            data[key] = value.isoformat()
+    return data
+
+
+def serialize_video_summary(video):
+    """
+    Serialize a Video object as a video card
+
+    The video's category must already be loaded (e.g. with joinedload),
+    otherwise this triggers a lazy load per video.
+    """
+    return {
+        'id': video.id,
+        'title': video.title,
+        'thumbnail': video.thumbnail,
+        'view_count': video.view_count,
+        'category': video.category.name
+    }
@@ -42,6 +42,14 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     });
 
+    // Load further pages of comments on the video page
+    const loadMoreComments = document.getElementById('load-more-comments');
+    if (loadMoreComments) {
+        loadMoreComments.addEventListener('click', function() {
+            loadCommentsPage(this);
+        });
+    }
+
     // Log page visit for analytics
     console.log('Page loaded:', window.location.pathname);
 });
@@ -71,3 +79,68 @@ function formatDate(dateString) {
     const options = { year: 'numeric', month: 'short', day: 'numeric' };
     return date.toLocaleDateString(undefined, options);
 }
+
+/**
+ * Escape text for insertion into HTML
+ * @param {string} text - Untrusted text
+ * @returns {string} Escaped text
+ */
+function escapeHtml(text) {
+    const div = document.createElement('div');
+    div.textContent = text;
+    return div.innerHTML;
+}
+
+/**
+ * Render a comment returned by the comments API
+ * @param {Object} comment - Comment with user, content and created_at
+ * @returns {string} HTML for the comments list
+ */
+function renderComment(comment) {
+    return `
+    <div class="card mb-3 comment">
+        <div class="card-body">
+            <div class="d-flex justify-content-between mb-2">
+                <h6 class="card-subtitle mb-2 text-primary">${escapeHtml(comment.user)}</h6>
+                <small class="text-muted">${new Date(comment.created_at).toLocaleString()}</small>
+            </div>
+            <p class="card-text">${escapeHtml(comment.content)}</p>
+        </div>
+    </div>
+    `;
+}
+
+/**
+ * Fetch the next page of comments and append it to the comments list
+ * @param {HTMLElement} button - The "load more" button holding the video ID and page cursor
+ */
+function loadCommentsPage(button) {
+    const videoId = button.getAttribute('data-video-id');
+    const cursor = button.getAttribute('data-cursor');
+    const commentsContainer = document.getElementById('comments-container');
+
+    button.disabled = true;
+    fetch(`/api/videos/${videoId}/comments?cursor=${encodeURIComponent(cursor)}`)
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const nextCursor = response.headers.get('X-Next-Cursor');
+            return response.json().then(comments => ({ comments, nextCursor }));
+        })
+        .then(({ comments, nextCursor }) => {
+            commentsContainer.insertAdjacentHTML('beforeend', comments.map(renderComment).join(''));
+
+            // The last page has no next cursor
+            if (nextCursor) {
+                button.setAttribute('data-cursor', nextCursor);
+                button.disabled = false;
+            } else {
+                button.parentElement.remove();
+            }
+        })
+        .catch(error => {
+            console.error('Error loading comments:', error);
+            button.disabled = false;
+        });
+}
@@ -33,17 +33,130 @@ function handleSearchSubmit(event) {
     }
 }
 
+// Delay before asking the backend for suggestions, in milliseconds
+const SUGGEST_DEBOUNCE_MS = 150;
+
+let suggestTimer = null;
+let suggestController = null;
+
 /**
  * Handle search input changes
  * @param {Event} event - Input event
  */
 function handleSearchInput(event) {
-    // You could implement search suggestions here
-    const searchTerm = event.target.value.trim();
+    const input = event.target;
+    const searchTerm = input.value.trim();
+    
+    clearTimeout(suggestTimer);
+    
+    if (searchTerm.length < 2) {
+        hideSuggestions(input);
+        return;
+    }
+    
+    // Wait for the user to pause typing before fetching suggestions
+    suggestTimer = setTimeout(() => fetchSuggestions(input, searchTerm), SUGGEST_DEBOUNCE_MS);
+}
+
+/**
+ * Fetch search suggestions from the backend, cancelling any request in flight
+ * @param {HTMLInputElement} input - The search input
+ * @param {string} searchTerm - The text typed so far
+ */
+function fetchSuggestions(input, searchTerm) {
+    if (suggestController) {
+        suggestController.abort();
+    }
+    suggestController = new AbortController();
+    
+    fetch(`/api/search/suggest?q=${encodeURIComponent(searchTerm)}`, { signal: suggestController.signal })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`Suggestions request failed with status ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(suggestions => renderSuggestions(input, suggestions))
+        .catch(error => {
+            if (error.name !== 'AbortError') {
+                console.error('Error fetching suggestions:', error);
+                // Do not leave suggestions for an earlier term on screen
+                clearSuggestions(input);
+            }
+        });
+}
+
+/**
+ * Show suggestions in a dropdown below the search input
+ * @param {HTMLInputElement} input - The search input
+ * @param {Array} suggestions - Suggestions returned by the backend
+ */
+function renderSuggestions(input, suggestions) {
+    const menu = getSuggestionMenu(input);
+    menu.innerHTML = '';
+    
+    if (suggestions.length === 0) {
+        hideSuggestions(input);
+        return;
+    }
+    
+    suggestions.forEach(suggestion => {
+        const item = document.createElement('a');
+        item.className = 'dropdown-item text-truncate';
+        item.href = suggestion.url;
+        
+        const icon = document.createElement('i');
+        icon.className = suggestion.type === 'category' ? 'fas fa-tags me-2' : 'fas fa-play me-2';
+        item.appendChild(icon);
+        item.appendChild(document.createTextNode(suggestion.label));
+        
+        menu.appendChild(item);
+    });
+    
+    menu.classList.add('show');
+}
+
+/**
+ * Get or create the dropdown menu holding suggestions
+ * @param {HTMLInputElement} input - The search input
+ * @returns {HTMLElement} The dropdown menu
+ */
+function getSuggestionMenu(input) {
+    let menu = input.form.querySelector('.search-suggestions');
+    
+    if (!menu) {
+        menu = document.createElement('div');
+        menu.className = 'dropdown-menu search-suggestions';
+        input.form.classList.add('position-relative');
+        input.form.appendChild(menu);
+        
+        // Hide suggestions once the input loses focus, after clicks are handled
+        input.addEventListener('blur', () => setTimeout(() => hideSuggestions(input), 200));
+    }
     
-    if (searchTerm.length >= 3) {
-        console.log('Search term entered:', searchTerm);
-        // Here you could fetch search suggestions from backend
+    return menu;
+}
+
+/**
+ * Hide the suggestion dropdown
+ * @param {HTMLInputElement} input - The search input
+ */
+function hideSuggestions(input) {
+    const menu = input.form ? input.form.querySelector('.search-suggestions') : null;
+    if (menu) {
+        menu.classList.remove('show');
+    }
+}
+
+/**
+ * Empty and hide the suggestion dropdown
+ * @param {HTMLInputElement} input - The search input
+ */
+function clearSuggestions(input) {
+    const menu = input.form ? input.form.querySelector('.search-suggestions') : null;
+    if (menu) {
+        menu.innerHTML = '';
+        menu.classList.remove('show');
     }
 }
 
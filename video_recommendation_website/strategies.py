@@ -0,0 +1,364 @@
+import logging
+from collections import Counter
+
+from sqlalchemy import desc, select
+from sqlalchemy.orm import joinedload
+
+from app import db
+from models import Video, VideoNeighbor, user_video_history
+from affinity import affinity_index
+from trending import trending_index
+from content import content_index, np
+from coview import build_neighbor_table
+from pagination import after_desc
+
+logger = logging.getLogger(__name__)
+
+# Over-fetching up to this many videos is done with a single ORM query
+OBJECT_BATCH = 100
+
+# Rows per query when paging past many excluded videos
+ID_BATCH = 5000
+
+# Most recent views a user's co-view and content recommendations start from
+RECENT_VIEWS = 10
+
+
+class Exclusions:
+    """Several containers of video IDs checked as one; sizes are read live"""
+
+    def __init__(self, *containers):
+        self.containers = containers
+
+    def __contains__(self, video_id):
+        return any(video_id in ids for ids in self.containers)
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.containers)
+
+
+def _videos_by_ids(video_ids, session=None):
+    """Load videos by ID, preserving the order of video_ids"""
+    if not video_ids:
+        return []
+    session = session or db.session
+    videos = {v.id: v for v in session.query(Video).options(joinedload(Video.category)).filter(
+        Video.id.in_(video_ids)
+    ).all()}
+    return [videos[video_id] for video_id in video_ids if video_id in videos]
+
+
+def _top_videos(limit, exclude=(), criterion=None, session=None):
+    """
+    Get the most viewed videos, skipping the IDs in exclude
+
+    Exclusions are checked in process against over-fetched rows, so the SQL
+    has the same shape however many videos are excluded. With few exclusions
+    one query for limit + excluded videos is enough. With many (heavy users)
+    narrow (id, view_count) rows are paged through and only the picked
+    videos are loaded.
+
+    Args:
+        limit: Maximum number of videos to return
+        exclude: Container of video IDs to skip (set, WatchedSet, Exclusions, ...)
+        criterion: Optional SQL filter, e.g. on the category
+        session: Session to query with, default the request's db.session
+
+    Returns:
+        List of Video objects ordered by view count, with categories loaded
+    """
+    session = session or db.session
+    overfetch = limit + len(exclude)
+    order = (desc(Video.view_count), desc(Video.id))
+
+    if overfetch <= OBJECT_BATCH:
+        query = session.query(Video).options(joinedload(Video.category))
+        if criterion is not None:
+            query = query.filter(criterion)
+        videos = query.order_by(*order).limit(overfetch).all()
+        return [v for v in videos if v.id not in exclude][:limit]
+
+    stmt = select(Video.id, Video.view_count)
+    if criterion is not None:
+        stmt = stmt.where(criterion)
+    batch = min(overfetch, ID_BATCH)
+    picked = []
+    last = None
+    while len(picked) < limit:
+        page = stmt
+        if last is not None:
+            page = page.where(after_desc(Video.view_count, Video.id, last.view_count, last.id))
+        rows = session.execute(page.order_by(*order).limit(batch)).all()
+        for row in rows:
+            if row.id not in exclude:
+                picked.append(row.id)
+                if len(picked) >= limit:
+                    break
+        if len(rows) < batch:
+            break
+        last = rows[-1]
+    return _videos_by_ids(picked, session)
+
+
+def _recent_views(user_id, session):
+    """IDs of the user's most recently watched videos, newest first"""
+    stmt = select(user_video_history.c.video_id).where(
+        user_video_history.c.user_id == user_id
+    ).order_by(user_video_history.c.watched_at.desc()).limit(RECENT_VIEWS)
+    return list(session.execute(stmt).scalars())
+
+
+def _best(scores, exclude, limit):
+    """The highest scoring IDs that are not excluded, ties broken by ID"""
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    return [video_id for video_id, _ in ranked if video_id not in exclude][:limit]
+
+
+class Strategy:
+    """
+    A way of picking videos, for a user's home page and for a video's page
+
+    Strategies are chained (see run_chain): each one fills the slots the
+    previous ones left, skipping the videos they picked. A strategy may
+    return fewer videos than asked for, or none when it has nothing to say
+    (e.g. co-view recommendations for an anonymous user).
+    """
+
+    name = None
+
+    @property
+    def ready(self):
+        """False if the strategy's state is missing (e.g. an optional dependency)"""
+        return True
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        """
+        Pick videos for a user's home page
+
+        Args:
+            user_id: The ID of the user, or None for anonymous visitors
+            limit: Maximum number of videos to return
+            exclude: Container of video IDs to skip
+            session: Session to query with, default the request's db.session
+
+        Returns:
+            List of Video objects, best first
+        """
+        return []
+
+    def related(self, video, limit, exclude, session=None):
+        """
+        Pick videos to show next to a video; same arguments as recommend,
+        with the Video being watched instead of a user ID
+        """
+        return []
+
+    def rebuild(self, as_of=None):
+        """
+        Recompute derived state from the current history and catalog
+
+        Used by the offline evaluator after it removed the held-out history;
+        in production the same state comes from the CLI jobs and warm_up.
+
+        Args:
+            as_of: Time (naive UTC datetime) that counts as now
+        """
+
+
+class PopularityStrategy(Strategy):
+    """Most viewed videos of all time"""
+
+    name = 'popularity'
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        return _top_videos(limit, exclude, session=session)
+
+    def related(self, video, limit, exclude, session=None):
+        return _top_videos(limit, exclude, session=session)
+
+
+class CategoryAffinityStrategy(Strategy):
+    """Most viewed videos of the user's three most watched categories, or of the video's category"""
+
+    name = 'category-affinity'
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        if not user_id:
+            return []
+        top_categories = affinity_index.top_categories(user_id)
+        if not top_categories:
+            return []
+
+        # Merge the precomputed per-category top lists
+        candidate_ids = affinity_index.merged_candidates(top_categories, exclude, limit)
+        videos = _videos_by_ids(candidate_ids, session)
+
+        # The top lists are capped, so look deeper in the categories if needed
+        if len(videos) < limit and any(affinity_index.is_truncated(cat_id) for cat_id in top_categories):
+            videos.extend(_top_videos(
+                limit - len(videos),
+                Exclusions(exclude, {v.id for v in videos}),
+                Video.category_id.in_(top_categories),
+                session
+            ))
+        return videos
+
+    def related(self, video, limit, exclude, session=None):
+        return _top_videos(limit, exclude, Video.category_id == video.category_id, session)
+
+    def rebuild(self, as_of=None):
+        affinity_index.clear()
+
+
+class CoViewStrategy(Strategy):
+    """Videos watched by the same users, from the neighbor table built by coview.py"""
+
+    name = 'co-view'
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        if not user_id:
+            return []
+        session = session or db.session
+        recent = _recent_views(user_id, session)
+        if not recent:
+            return []
+
+        # Neighbors of several recent views add up their similarities
+        scores = Counter()
+        stmt = select(VideoNeighbor.neighbor_id, VideoNeighbor.score).where(
+            VideoNeighbor.video_id.in_(recent)
+        )
+        for neighbor_id, score in session.execute(stmt):
+            scores[neighbor_id] += score
+        return _videos_by_ids(_best(scores, exclude, limit), session)
+
+    def related(self, video, limit, exclude, session=None):
+        session = session or db.session
+        # Neighbors are ranked by the offline job
+        related = session.query(Video).join(
+            VideoNeighbor, VideoNeighbor.neighbor_id == Video.id
+        ).filter(
+            VideoNeighbor.video_id == video.id
+        ).order_by(VideoNeighbor.rank).limit(limit + len(exclude)).all()
+        return [v for v in related if v.id not in exclude][:limit]
+
+    def rebuild(self, as_of=None):
+        build_neighbor_table()
+
+
+class ContentSimilarityStrategy(Strategy):
+    """Videos with similar titles and descriptions, from the content index"""
+
+    name = 'content-similarity'
+
+    @property
+    def ready(self):
+        return content_index.ready
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        if not user_id or not content_index.ready:
+            return []
+        session = session or db.session
+
+        # Reciprocal rank votes from the neighbors of each recent view
+        scores = Counter()
+        for video_id in _recent_views(user_id, session):
+            for rank, similar_id in enumerate(content_index.similar(video_id, limit + len(exclude))):
+                scores[similar_id] += 1.0 / (rank + 1)
+        return _videos_by_ids(_best(scores, exclude, limit), session)
+
+    def related(self, video, limit, exclude, session=None):
+        similar_ids = content_index.similar(video.id, limit + len(exclude))
+        return _videos_by_ids([i for i in similar_ids if i not in exclude][:limit], session)
+
+    def rebuild(self, as_of=None):
+        if np is None:
+            logger.warning("The content-similarity strategy needs numpy (pip install .[content])")
+            return
+        content_index.build()
+        content_index.load()
+
+
+class TrendingStrategy(Strategy):
+    """Videos with the most time-decayed views, in the user's or the video's categories"""
+
+    name = 'trending'
+
+    @property
+    def ready(self):
+        return trending_index.ready
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        # Anonymous users and users without history get the overall ranking
+        top_categories = affinity_index.top_categories(user_id) if user_id else None
+        return _videos_by_ids(trending_index.top(limit, top_categories or None, exclude), session)
+
+    def related(self, video, limit, exclude, session=None):
+        return _videos_by_ids(trending_index.top(limit, [video.category_id], exclude), session)
+
+    def rebuild(self, as_of=None):
+        trending_index.build(now=as_of)
+
+
+STRATEGIES = {}
+
+
+def register(strategy):
+    """Make a strategy available to chains by its name"""
+    STRATEGIES[strategy.name] = strategy
+    return strategy
+
+
+for _strategy in (PopularityStrategy(), CategoryAffinityStrategy(), CoViewStrategy(),
+                  ContentSimilarityStrategy(), TrendingStrategy()):
+    register(_strategy)
+
+
+def parse_chain(names):
+    """
+    Turn a comma-separated list of strategy names into a chain
+
+    Unknown names are logged and skipped; popularity is appended so that
+    every chain can fill a page.
+
+    Returns:
+        List of Strategy objects
+    """
+    chain = []
+    for name in (n.strip() for n in names.split(',')):
+        if not name:
+            continue
+        if name not in STRATEGIES:
+            logger.warning(f"Unknown recommendation strategy {name!r}; known: {', '.join(STRATEGIES)}")
+            continue
+        chain.append(STRATEGIES[name])
+    if STRATEGIES['popularity'] not in chain:
+        chain.append(STRATEGIES['popularity'])
+    return chain
+
+
+def run_chain(chain, method, subject, limit, exclude=(), session=None):
+    """
+    Fill up to limit videos from a chain of strategies
+
+    Args:
+        chain: List of Strategy objects, tried in order
+        method: 'recommend' or 'related'
+        subject: The user ID or the Video passed to that method
+        limit: Maximum number of videos to return
+        exclude: Container of video IDs none of the strategies may return
+        session: Session to query with, default the request's db.session
+
+    Returns:
+        List of Video objects
+    """
+    picked = []
+    picked_ids = set()
+    excluded = Exclusions(exclude, picked_ids)
+    for strategy in chain:
+        if len(picked) >= limit:
+            break
+        for video in getattr(strategy, method)(subject, limit - len(picked), excluded, session):
+            picked.append(video)
+            picked_ids.add(video.id)
+    return picked
@@ -0,0 +1,166 @@
+import bisect
+import heapq
+import logging
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import event, func, select
+
+from app import db
+from models import Video, Category
+
+logger = logging.getLogger(__name__)
+
+# How long view counts in the index are trusted before a background rebuild
+REBUILD_INTERVAL = 300
+
+# Prefix ranges larger than this are answered from a cached top-k list
+# instead of being scanned on every request
+SCAN_LIMIT = 1000
+
+# Largest number of suggestions a cached prefix list holds
+MAX_SUGGESTIONS = 20
+
+
+def _keys_for(label):
+    """Index a label under its full text and under every word it contains"""
+    words = label.lower().split()
+    return {' '.join(words[i:]) for i in range(len(words))}
+
+
+class SuggestIndex:
+    """
+    Prefix index over video titles and category names
+
+    Keys are kept in a sorted list so a prefix maps to a contiguous range found
+    with bisect. Each key points at an item reference ('video' or 'category',
+    id); item labels and popularity live in a separate dict. Queries never
+    touch the database: the index is built once, extended from mapper events
+    on insert and rebuilt in a background thread when it gets stale.
+    """
+
+    def __init__(self, rebuild_interval=REBUILD_INTERVAL):
+        self.rebuild_interval = rebuild_interval
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._built_at = None
+        self._keys = []
+        self._refs = []
+        self._items = {}
+        self._prefix_top = {}
+
+    def build(self):
+        """Rebuild the index from the database. Must run inside an app context."""
+        items = {}
+        category_views = func.coalesce(func.sum(Video.view_count), 0)
+        stmt = select(Category.id, Category.name, category_views).outerjoin(
+            Video, Video.category_id == Category.id
+        ).group_by(Category.id, Category.name)
+        for category_id, name, views in db.session.execute(stmt):
+            items[('category', category_id)] = (name, views)
+
+        stmt = select(Video.id, Video.title, Video.view_count).execution_options(yield_per=1000)
+        for video_id, title, view_count in db.session.execute(stmt):
+            items[('video', video_id)] = (title, view_count or 0)
+
+        entries = sorted(
+            (key, ref) for ref, (label, _) in items.items() for key in _keys_for(label)
+        )
+        with self._lock:
+            self._keys = [key for key, _ in entries]
+            self._refs = [ref for _, ref in entries]
+            self._items = items
+            self._prefix_top = {}
+            self._built_at = time.monotonic()
+        logger.info(f"Suggestion index built with {len(entries)} keys")
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self.build()
+        except Exception as e:
+            logger.error(f"Suggestion index rebuild failed: {str(e)}")
+        finally:
+            self._rebuilding = False
+
+    def _schedule_rebuild(self):
+        with self._lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        app = current_app._get_current_object()
+        threading.Thread(target=self._rebuild_in_background, args=(app,), daemon=True).start()
+
+    def add(self, kind, item_id, label, popularity=0):
+        """Add a new video or category to the index"""
+        ref = (kind, item_id)
+        with self._lock:
+            if self._built_at is None or ref in self._items:
+                return
+            self._items[ref] = (label, popularity)
+            for key in _keys_for(label):
+                position = bisect.bisect_right(self._keys, key)
+                self._keys.insert(position, key)
+                self._refs.insert(position, ref)
+                # Keep cached prefix lists consistent with the new key
+                for length in range(1, len(key) + 1):
+                    top = self._prefix_top.get(key[:length])
+                    if top is not None and ref not in top:
+                        top.append(ref)
+                        top.sort(key=self._rank)
+                        del top[MAX_SUGGESTIONS:]
+
+    def _rank(self, ref):
+        label, popularity = self._items[ref]
+        # Categories first, then videos by popularity
+        return (ref[0] != 'category', -popularity, label)
+
+    def _top_refs(self, prefix, k):
+        start = bisect.bisect_left(self._keys, prefix)
+        end = bisect.bisect_left(self._keys, prefix + '\uffff', start)
+        if end - start <= SCAN_LIMIT:
+            return heapq.nsmallest(k, set(self._refs[start:end]), key=self._rank)
+
+        top = self._prefix_top.get(prefix)
+        if top is None:
+            top = heapq.nsmallest(MAX_SUGGESTIONS, set(self._refs[start:end]), key=self._rank)
+            self._prefix_top[prefix] = top
+        return top[:k]
+
+    def suggest(self, query, k=8):
+        """
+        Get suggestions for a partially typed query
+
+        Args:
+            query: The text typed so far
+            k: Maximum number of suggestions
+
+        Returns:
+            List of (kind, id, label) tuples, categories first, then videos by view count
+        """
+        prefix = ' '.join(query.lower().split())
+        if not prefix:
+            return []
+        if self._built_at is None:
+            self.build()
+        elif time.monotonic() - self._built_at > self.rebuild_interval:
+            self._schedule_rebuild()
+
+        k = min(k, MAX_SUGGESTIONS)
+        with self._lock:
+            return [(kind, item_id, self._items[(kind, item_id)][0])
+                    for kind, item_id in self._top_refs(prefix, k)]
+
+
+suggest_index = SuggestIndex()
+
+
+@event.listens_for(Video, 'after_insert')
+def _suggest_inserted_video(mapper, connection, target):
+    suggest_index.add('video', target.id, target.title, target.view_count or 0)
+
+
+@event.listens_for(Category, 'after_insert')
+def _suggest_inserted_category(mapper, connection, target):
+    suggest_index.add('category', target.id, target.name)
@@ -0,0 +1,47 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# The app binds its database and index paths on import, so point them at a
+# scratch directory before anything imports it
+_workdir = tempfile.mkdtemp(prefix='video-recommendation-tests-')
+os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(_workdir, 'test.db')}"
+os.environ['AUTO_INIT_DB'] = '1'
+os.environ['CONTENT_INDEX_DIR'] = os.path.join(_workdir, 'content_index')
+os.environ['THUMBNAIL_CACHE_DIR'] = os.path.join(_workdir, 'thumbnails')
+# Views are flushed by the tests, not by the background thread
+os.environ['VIEW_FLUSH_INTERVAL'] = '3600'
+os.environ.pop('CACHE_REDIS_URL', None)
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The other modules import db from app, so app has to be imported first
+import app as _app  # noqa: E402,F401
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app, ensure_initialized
+    from view_events import view_events
+    ensure_initialized()
+    yield app
+    # Write out what is still buffered while the database exists
+    view_events.shutdown()
+    shutil.rmtree(_workdir, ignore_errors=True)
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def app_context(app):
+    from app import db
+    with app.app_context():
+        yield
+        db.session.remove()
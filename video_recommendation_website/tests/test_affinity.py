@@ -0,0 +1,197 @@
+import datetime
+import random
+from collections import Counter
+
+import pytest
+from sqlalchemy import delete, desc, func, select
+
+from affinity import AffinityIndex, WatchedSet, affinity_index
+from view_events import view_events
+
+
+@pytest.fixture
+def histories(app_context):
+    """Users with histories spread unevenly over three new categories"""
+    from app import db
+    from models import Category, User, Video, user_video_history
+
+    categories = [Category(name=f'Affinity {n}', description='Affinity test category') for n in range(3)]
+    db.session.add_all(categories)
+    db.session.flush()
+    rng = random.Random(3)
+    videos = [Video(title=f'Affinity {n}', url=f'https://example.com/affinity/{n}.mp4',
+                    category_id=categories[n % 3].id, view_count=rng.randrange(100))
+              for n in range(30)]
+    users = [User(username=f'affinity{n}', email=f'affinity{n}@example.com') for n in range(6)]
+    db.session.add_all(videos + users)
+    db.session.commit()
+
+    db.session.execute(user_video_history.insert(), [
+        {'user_id': user.id, 'video_id': video.id, 'watched_at': datetime.datetime(2024, 1, 1)}
+        for user in users
+        for video in rng.sample(videos, rng.randint(1, 12))
+    ])
+    db.session.commit()
+
+    yield {
+        'users': [user.id for user in users],
+        'videos': {video.id: video.category_id for video in videos},
+        'categories': [category.id for category in categories],
+    }
+
+    view_events.flush()
+    user_ids = [user.id for user in users]
+    db.session.execute(delete(user_video_history).where(user_video_history.c.user_id.in_(user_ids)))
+    db.session.execute(delete(User).where(User.id.in_(user_ids)))
+    db.session.execute(delete(Video).where(Video.id.in_([video.id for video in videos])))
+    db.session.execute(delete(Category).where(Category.id.in_([category.id for category in categories])))
+    db.session.commit()
+    affinity_index.clear()
+
+
+def sql_top_categories(user_id, n=3):
+    from app import db
+    from models import Video, user_video_history
+    views = func.count()
+    return list(db.session.execute(
+        select(Video.category_id).join(
+            user_video_history, user_video_history.c.video_id == Video.id
+        ).where(user_video_history.c.user_id == user_id).group_by(
+            Video.category_id
+        ).order_by(desc(views), Video.category_id).limit(n)
+    ).scalars())
+
+
+def sql_watched(user_id):
+    from app import db
+    from models import user_video_history
+    return set(db.session.execute(
+        select(user_video_history.c.video_id).where(user_video_history.c.user_id == user_id)
+    ).scalars())
+
+
+def sql_category_top(category_id, size):
+    from app import db
+    from models import Video
+    return [(-views, video_id) for views, video_id in db.session.execute(
+        select(Video.view_count, Video.id).where(Video.category_id == category_id).order_by(
+            desc(Video.view_count), Video.id
+        ).limit(size)
+    )]
+
+
+def test_matches_what_the_database_computes(histories):
+    index = AffinityIndex(category_list_size=5)
+    for user_id in histories['users']:
+        assert index.top_categories(user_id) == sql_top_categories(user_id)
+        assert set(index.watched(user_id)) == sql_watched(user_id)
+    for category_id in histories['categories']:
+        assert index.category_top(category_id) == sql_category_top(category_id, 5)
+        assert index.is_truncated(category_id)
+
+
+def test_least_recently_used_users_are_evicted(histories):
+    first, second, third = histories['users'][:3]
+    index = AffinityIndex(max_users=2)
+    index.watched(first)
+    index.watched(second)
+    # Using the first user again makes the second the least recently used
+    index.top_categories(first)
+    index.watched(third)
+
+    assert list(index._users) == [first, third]
+
+
+def test_entries_are_reloaded_after_their_ttl(histories):
+    from app import db
+    from models import Video, user_video_history
+
+    user_id = histories['users'][0]
+    unseen = next(video_id for video_id in histories['videos'] if video_id not in sql_watched(user_id))
+    category_id = histories['videos'][unseen]
+    trusted = AffinityIndex(user_ttl=3600, category_ttl=3600)
+    expiring = AffinityIndex(user_ttl=0, category_ttl=0)
+    for index in (trusted, expiring):
+        index.watched(user_id)
+        index.category_top(category_id)
+
+    # Another worker writes a view and bumps the view count
+    db.session.execute(user_video_history.insert(), [
+        {'user_id': user_id, 'video_id': unseen, 'watched_at': datetime.datetime(2024, 1, 2)}
+    ])
+    db.session.get(Video, unseen).view_count = 1000
+    db.session.commit()
+
+    assert unseen not in trusted.watched(user_id)
+    assert trusted.category_top(category_id)[0] != (-1000, unseen)
+    assert unseen in expiring.watched(user_id)
+    assert expiring.category_top(category_id)[0] == (-1000, unseen)
+
+    trusted.invalidate_user(user_id)
+    trusted.invalidate_category(category_id)
+    assert unseen in trusted.watched(user_id)
+    assert trusted.category_top(category_id)[0] == (-1000, unseen)
+
+
+def test_recorded_views_update_loaded_users_and_survive_a_flush(histories):
+    user_id = histories['users'][1]
+    watched = sql_watched(user_id)
+    new_views = [video_id for video_id in histories['videos'] if video_id not in watched][:4]
+    affinity_index.invalidate_user(user_id)
+    counts = Counter(histories['videos'][video_id] for video_id in watched)
+
+    affinity_index.watched(user_id)
+    for video_id in new_views:
+        view_events.record_view(video_id, user_id, histories['videos'][video_id])
+        counts[histories['videos'][video_id]] += 1
+    # Updated in place before anything is written
+    entry = affinity_index._users[user_id]
+    assert entry[1] == counts
+    assert set(affinity_index.watched(user_id)) == watched | set(new_views)
+
+    view_events.flush()
+    # The flush drops the entry; it is reloaded from the written rows
+    assert user_id not in affinity_index._users
+    assert set(affinity_index.watched(user_id)) == watched | set(new_views) == sql_watched(user_id)
+    assert affinity_index.top_categories(user_id) == sql_top_categories(user_id)
+
+
+def test_flushed_view_counts_refresh_category_lists(histories):
+    category_id = histories['categories'][0]
+    video_id = next(video_id for video_id, category in histories['videos'].items() if category == category_id)
+    affinity_index.category_top(category_id)
+
+    for _ in range(500):
+        view_events.record_view(video_id, None, category_id)
+    view_events.flush()
+    assert affinity_index.category_top(category_id) == sql_category_top(
+        category_id, affinity_index.category_list_size
+    )
+    assert affinity_index.category_top(category_id)[0][1] == video_id
+
+
+def test_watched_set_drops_duplicates_and_keeps_ids_sorted():
+    watched = WatchedSet([7, 3, 7, 11, 3])
+    assert list(watched) == [3, 7, 11]
+    assert len(watched) == 3
+
+    for video_id in (5, 3, 12, 1, 5):
+        watched.add(video_id)
+    assert list(watched) == [1, 3, 5, 7, 11, 12]
+    assert 5 in watched and 12 in watched
+    assert 4 not in watched and 0 not in watched and 13 not in watched
+    assert 2 not in WatchedSet()
+
+
+@pytest.mark.parametrize('big', [2 ** 31, 2 ** 32 - 1, 2 ** 32, 2 ** 40])
+def test_watched_set_holds_ids_above_31_bits(big):
+    watched = WatchedSet([big, 1])
+    assert list(watched) == [1, big]
+    assert big in watched and big - 1 not in watched
+
+    later = WatchedSet([1, 2])
+    later.add(big)
+    later.add(big)
+    later.add(2 ** 31 + 5)
+    assert list(later) == sorted({1, 2, big, 2 ** 31 + 5})
+    assert big in later
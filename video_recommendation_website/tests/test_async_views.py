@@ -0,0 +1,51 @@
+import logging
+
+import pytest
+
+pytest.importorskip('asgiref')
+
+import async_views  # noqa: E402
+import recommendation  # noqa: E402
+import strategies  # noqa: E402
+from trending import TrendingIndex  # noqa: E402
+
+
+@pytest.fixture
+def async_client(app, client, monkeypatch):
+    monkeypatch.setitem(app.view_functions, 'video_detail', async_views.video_detail)
+    return client
+
+
+def test_related_videos_use_the_query_thread_session(async_client, monkeypatch):
+    from app import db
+
+    # A trending index that was never built must not be built from the
+    # query thread, which would use the request's db.session
+    monkeypatch.setattr(strategies, 'trending_index', TrendingIndex())
+    sessions = []
+    trending = strategies.STRATEGIES['trending']
+    related = trending.related
+
+    def spy(video, limit, exclude, session=None):
+        sessions.append(session)
+        return related(video, limit, exclude, session)
+
+    monkeypatch.setattr(trending, 'related', spy)
+    monkeypatch.setattr(recommendation, 'RELATED_CHAIN', [trending, strategies.STRATEGIES['popularity']])
+
+    response = async_client.get('/video/1')
+    assert response.status_code == 200
+    assert len(sessions) == 1
+    assert sessions[0] is not None and sessions[0] is not db.session
+    assert not strategies.trending_index.ready
+
+
+def test_errors_are_logged(async_client, monkeypatch, caplog):
+    def fail(video_id, session=None):
+        raise RuntimeError('related videos are down')
+
+    monkeypatch.setattr(async_views, 'get_related_videos', fail)
+    with caplog.at_level(logging.ERROR, logger='async_views'):
+        response = async_client.get('/video/1')
+    assert response.status_code == 500
+    assert 'Error loading video 1: related videos are down' in caplog.text
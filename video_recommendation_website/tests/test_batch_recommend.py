@@ -0,0 +1,83 @@
+import datetime
+import random
+
+import pytest
+from sqlalchemy import delete, select
+
+import batch_recommend
+from affinity import affinity_index
+from batch_recommend import DEPTH, batch_recommend as run_batch
+from strategies import STRATEGIES, run_chain
+
+
+@pytest.fixture
+def viewers(app_context):
+    """Users with histories over three new categories, with tied view counts"""
+    from app import db
+    from models import Category, PrecomputedRecommendation, User, Video, user_video_history
+
+    categories = [Category(name=f'Batch {n}', description='Batch test category') for n in range(3)]
+    db.session.add_all(categories)
+    db.session.flush()
+    rng = random.Random(11)
+    videos = [Video(title=f'Batch {n}', url=f'https://example.com/batch/{n}.mp4',
+                    category_id=categories[n % 3].id, view_count=rng.choice([0, 7, 7, 50]))
+              for n in range(60)]
+    users = [User(username=f'batch_viewer{n}', email=f'batch_viewer{n}@example.com') for n in range(12)]
+    db.session.add_all(videos + users)
+    db.session.commit()
+
+    watched_at = datetime.datetime(2024, 1, 1)
+    db.session.execute(user_video_history.insert(), [
+        {'user_id': user.id, 'video_id': video.id, 'watched_at': watched_at}
+        for user in users
+        # Even sizes give categories tied by count for some users
+        for video in rng.sample(videos, rng.choice([2, 4, 6, 30]))
+    ])
+    db.session.commit()
+    affinity_index.clear()
+
+    yield [user.id for user in users]
+
+    user_ids = [user.id for user in users]
+    db.session.execute(delete(PrecomputedRecommendation).where(PrecomputedRecommendation.user_id.in_(user_ids)))
+    db.session.execute(delete(user_video_history).where(user_video_history.c.user_id.in_(user_ids)))
+    db.session.execute(delete(User).where(User.id.in_(user_ids)))
+    db.session.execute(delete(Video).where(Video.id.in_([video.id for video in videos])))
+    db.session.execute(delete(Category).where(Category.id.in_([category.id for category in categories])))
+    db.session.commit()
+    affinity_index.clear()
+
+
+def stored(user_id):
+    from app import db
+    from models import PrecomputedRecommendation
+    return list(db.session.execute(
+        select(PrecomputedRecommendation.video_id).where(
+            PrecomputedRecommendation.user_id == user_id
+        ).order_by(PrecomputedRecommendation.rank)
+    ).scalars())
+
+
+def online(user_id):
+    chain = [STRATEGIES[name] for name in batch_recommend.BATCH_CHAIN]
+    videos = run_chain(chain, 'recommend', user_id, DEPTH, affinity_index.watched(user_id))
+    return [video.id for video in videos]
+
+
+@pytest.mark.parametrize('counting', ['numpy', 'python'])
+@pytest.mark.parametrize('list_sizes', [None, (4, 6)], ids=['full-lists', 'short-lists'])
+def test_batch_matches_online(viewers, monkeypatch, counting, list_sizes):
+    if counting == 'python':
+        monkeypatch.setattr(batch_recommend, 'np', None)
+    else:
+        pytest.importorskip('numpy')
+    if list_sizes:
+        # Short candidate lists send heavy users to the deeper fallbacks
+        monkeypatch.setattr(affinity_index, 'category_list_size', list_sizes[0])
+        monkeypatch.setattr(batch_recommend, 'CANDIDATE_LIST_SIZE', list_sizes[1])
+
+    assert run_batch(user_ids=viewers) == len(viewers)
+    for user_id in viewers:
+        assert stored(user_id) == online(user_id)
+        assert len(stored(user_id)) == DEPTH
@@ -0,0 +1,75 @@
+import pytest
+from sqlalchemy import update
+
+from cache import response_cache
+
+
+CACHED_ROUTES = [
+    ('/', 'popular'),
+    ('/', 'related'),
+    ('/', 'categories'),
+    ('/', 'user:None'),
+    ('/category/1', 'categories'),
+    ('/category/1', 'category:1'),
+    ('/api/videos', 'popular'),
+    ('/api/videos/1/comments', 'comments:1'),
+]
+
+
+@pytest.mark.parametrize('url, namespace', CACHED_ROUTES)
+def test_bump_reruns_the_view_and_keeps_an_unchanged_etag(client, url, namespace):
+    first = client.get(url)
+    assert first.status_code == 200
+    etag = first.headers['ETag']
+
+    misses = response_cache.misses
+    assert client.get(url, headers={'If-None-Match': etag}).status_code == 304
+    assert response_cache.misses == misses
+
+    response_cache.bump(namespace)
+    revalidated = client.get(url, headers={'If-None-Match': etag})
+    assert response_cache.misses == misses + 1
+    # Same content, so the ETag (a hash of the body) still matches
+    assert revalidated.status_code == 304
+    assert revalidated.headers['ETag'] == etag
+
+
+def test_changed_content_gets_a_new_etag_after_a_bump(client, app_context):
+    from app import db
+    from models import Video
+
+    first = client.get('/api/videos')
+    etag = first.headers['ETag']
+    original = db.session.get(Video, 1).title
+    db.session.execute(update(Video).where(Video.id == 1).values(title='Renamed for the cache test'))
+    db.session.commit()
+    try:
+        # Not invalidated yet: the cached response still revalidates
+        assert client.get('/api/videos', headers={'If-None-Match': etag}).status_code == 304
+
+        response_cache.bump('popular')
+        changed = client.get('/api/videos', headers={'If-None-Match': etag})
+        assert changed.status_code == 200
+        assert changed.headers['ETag'] != etag
+        assert b'Renamed for the cache test' in changed.data
+    finally:
+        db.session.execute(update(Video).where(Video.id == 1).values(title=original))
+        db.session.commit()
+        response_cache.bump('popular')
+
+
+def test_view_flush_invalidates_the_video_category(client, app_context):
+    from app import db
+    from models import Video
+    from view_events import view_events
+
+    video = db.session.get(Video, 1)
+    url = f'/category/{video.category_id}'
+    etag = client.get(url).headers['ETag']
+
+    view_events.record_view(video.id, None, video.category_id)
+    view_events.flush()
+    response = client.get(url, headers={'If-None-Match': etag})
+    # The view count shown on the page changed
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
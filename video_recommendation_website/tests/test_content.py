@@ -0,0 +1,103 @@
+import os
+
+import pytest
+from sqlalchemy import delete
+
+np = pytest.importorskip('numpy')
+
+import content  # noqa: E402
+from content import ContentIndex, _Vectorizer, _fit_svd  # noqa: E402
+
+TOPICS = {
+    'astronomy': ('telescope nebula galaxy', 'stars orbit comet planets'),
+    'baking': ('sourdough bread flour', 'oven yeast crust dough'),
+    'knitting': ('wool yarn needles', 'scarf stitch pattern sweater'),
+}
+
+
+@pytest.fixture
+def topic_videos(app_context):
+    """Four videos per topic, each using a different part of its words"""
+    from app import db
+    from models import Video
+
+    videos = {}
+    for topic, (title_words, description_words) in TOPICS.items():
+        titles = title_words.split()
+        descriptions = description_words.split()
+        videos[topic] = [
+            Video(title=f'{titles[n % 3]} {titles[(n + 1) % 3]} episode',
+                  description=f'All about {descriptions[n]} and {descriptions[(n + 1) % 4]}.',
+                  url=f'https://example.com/content/{topic}/{n}.mp4', category_id=1)
+            for n in range(4)
+        ]
+        db.session.add_all(videos[topic])
+    db.session.commit()
+
+    yield {topic: [video.id for video in group] for topic, group in videos.items()}
+
+    db.session.execute(delete(Video).where(
+        Video.id.in_([video.id for group in videos.values() for video in group])
+    ))
+    db.session.commit()
+
+
+@pytest.fixture
+def index(tmp_path):
+    return ContentIndex(directory=str(tmp_path))
+
+
+def assert_topics_recalled(index, topic_videos):
+    for video_ids in topic_videos.values():
+        for video_id in video_ids:
+            mates = set(video_ids) - {video_id}
+            assert set(index.similar(video_id, k=3)) == mates
+
+
+@pytest.mark.parametrize('search', ['exhaustive', 'ivf'])
+def test_similar_videos_share_a_topic(index, topic_videos, monkeypatch, search):
+    if search == 'ivf':
+        monkeypatch.setattr(content, 'BRUTE_FORCE_MAX', 0)
+    assert index.build() >= 12
+    assert index.load()
+    assert (index._snapshot.centroids is not None) == (search == 'ivf')
+    assert_topics_recalled(index, topic_videos)
+
+
+def test_added_videos_swap_in_a_new_snapshot(index, topic_videos, tmp_path):
+    index.build()
+    index.load()
+    before = index._snapshot
+
+    index.add(10 ** 6, 'galaxy telescope live', 'Comet and planets tonight.')
+    after = index._snapshot
+    assert after is not before
+    assert before.extra_ids == () and before.vector(10 ** 6) is None
+    assert set(index.similar(10 ** 6, k=4)) == set(topic_videos['astronomy'])
+    assert 10 ** 6 in index.similar(topic_videos['astronomy'][0], k=4)
+
+    # A rebuild replaces the files; a search still holding the old snapshot
+    # keeps working on its mapped arrays
+    old_build = os.listdir(tmp_path)
+    index.build()
+    index.load()
+    assert index._snapshot.extra_ids == ()
+    assert not set(old_build) & set(name for name in os.listdir(tmp_path) if name.startswith('build-'))
+    assert after.vector(topic_videos['baking'][0]) is not None
+    assert_topics_recalled(index, topic_videos)
+
+
+def test_small_catalogs_are_not_indexed(index, topic_videos, monkeypatch, tmp_path):
+    monkeypatch.setattr(content, 'MIN_VIDEOS', 10 ** 9)
+    assert index.build() == 0
+    assert not index.load()
+    assert not index.ready
+    assert index.similar(topic_videos['baking'][0]) == []
+
+
+def test_svd_of_a_single_document():
+    vectorizer = _Vectorizer(['wool', 'yarn', 'scarf'], np.ones(3, dtype=np.float32), None)
+    components = _fit_svd(vectorizer.tfidf([['wool', 'yarn', 'yarn']]), 3, 64, seed=0)
+    assert components.shape == (3, 1)
+    with pytest.raises(ValueError):
+        _fit_svd(vectorizer.tfidf([]), 3, 64, seed=0)
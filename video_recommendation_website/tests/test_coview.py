@@ -0,0 +1,146 @@
+import datetime
+import itertools
+import random
+from collections import defaultdict
+
+import pytest
+from sqlalchemy import delete, select
+
+import coview
+from coview import build_neighbor_table
+from recommendation import get_related_videos
+
+
+@pytest.fixture
+def watched(app_context):
+    """Ten new videos and forty users with random histories over them"""
+    from app import db
+    from models import User, Video, VideoNeighbor, user_video_history
+
+    category_id = db.session.get(Video, 1).category_id
+    videos = [Video(title=f'Co-view {n}', url=f'https://example.com/coview/{n}.mp4',
+                    category_id=category_id) for n in range(10)]
+    users = [User(username=f'coviewer{n}', email=f'coviewer{n}@example.com') for n in range(40)]
+    db.session.add_all(videos + users)
+    db.session.commit()
+
+    rng = random.Random(7)
+    start = datetime.datetime(2024, 1, 1)
+    rows = [
+        {'user_id': user.id, 'video_id': video.id,
+         'watched_at': start + datetime.timedelta(minutes=n)}
+        for user in users
+        for n, video in enumerate(rng.sample(videos, rng.randint(1, 6)))
+    ]
+    db.session.execute(user_video_history.insert(), rows)
+    db.session.commit()
+
+    yield [video.id for video in videos]
+
+    video_ids = [video.id for video in videos]
+    user_ids = [user.id for user in users]
+    db.session.execute(delete(VideoNeighbor).where(
+        VideoNeighbor.video_id.in_(video_ids) | VideoNeighbor.neighbor_id.in_(video_ids)
+    ))
+    db.session.execute(delete(user_video_history).where(user_video_history.c.user_id.in_(user_ids)))
+    db.session.execute(delete(User).where(User.id.in_(user_ids)))
+    db.session.execute(delete(Video).where(Video.id.in_(video_ids)))
+    db.session.commit()
+
+
+def brute_force(metric, top_k):
+    """Neighbors computed pair by pair from the whole history table"""
+    from app import db
+    from models import user_video_history
+
+    histories = defaultdict(list)
+    stmt = select(user_video_history.c.user_id, user_video_history.c.video_id).order_by(
+        user_video_history.c.user_id, user_video_history.c.watched_at.desc()
+    )
+    for user_id, video_id in db.session.execute(stmt):
+        histories[user_id].append(video_id)
+
+    viewers = defaultdict(set)
+    for user_id, video_ids in histories.items():
+        for video_id in video_ids[:coview.MAX_USER_HISTORY]:
+            viewers[video_id].add(user_id)
+
+    neighbors = {}
+    for video_a, video_b in itertools.permutations(viewers, 2):
+        both = len(viewers[video_a] & viewers[video_b])
+        if both:
+            score = coview._similarity(metric, both, len(viewers[video_a]), len(viewers[video_b]))
+            neighbors.setdefault(video_a, []).append((score, video_b))
+    return {video_id: sorted(ranked, reverse=True)[:top_k] for video_id, ranked in neighbors.items()}
+
+
+def stored_neighbors():
+    from app import db
+    from models import VideoNeighbor
+
+    neighbors = defaultdict(list)
+    stmt = select(VideoNeighbor.video_id, VideoNeighbor.score, VideoNeighbor.neighbor_id).order_by(
+        VideoNeighbor.video_id, VideoNeighbor.rank
+    )
+    for video_id, score, neighbor_id in db.session.execute(stmt):
+        neighbors[video_id].append((pytest.approx(score), neighbor_id))
+    return dict(neighbors)
+
+
+@pytest.fixture(params=['numpy', 'python'])
+def counting(request, monkeypatch):
+    if request.param == 'numpy':
+        pytest.importorskip('numpy')
+    else:
+        monkeypatch.setattr(coview, 'np', None)
+    return request.param
+
+
+@pytest.mark.parametrize('metric', ['jaccard', 'cosine'])
+def test_neighbor_table_matches_brute_force(watched, counting, metric):
+    build_neighbor_table(top_k=3, metric=metric, shards=2)
+    assert stored_neighbors() == brute_force(metric, 3)
+
+
+def test_incremental_build_refreshes_reverse_neighbors(watched, counting):
+    from app import db
+    from models import User, user_video_history
+
+    build_neighbor_table(top_k=3)
+    # A new viewer of two videos changes the scores of both, and of every
+    # video that lists one of them as a neighbor
+    user = User(username='late_coviewer', email='late_coviewer@example.com')
+    db.session.add(user)
+    db.session.commit()
+    since = datetime.datetime(2025, 1, 1)
+    db.session.execute(user_video_history.insert(), [
+        {'user_id': user.id, 'video_id': watched[0], 'watched_at': since},
+        {'user_id': user.id, 'video_id': watched[1], 'watched_at': since},
+    ])
+    db.session.commit()
+    try:
+        before = stored_neighbors()
+        build_neighbor_table(top_k=3, since=since)
+        after = stored_neighbors()
+        expected = brute_force('jaccard', 3)
+
+        listing = {video_id for video_id, ranked in before.items()
+                   if {watched[0], watched[1]} & {neighbor_id for _, neighbor_id in ranked}}
+        for video_id in listing | {watched[0], watched[1]}:
+            assert after.get(video_id) == expected.get(video_id)
+    finally:
+        db.session.execute(delete(user_video_history).where(user_video_history.c.user_id == user.id))
+        db.session.execute(delete(User).where(User.id == user.id))
+        db.session.commit()
+
+
+def test_related_videos_fill_up_after_neighbors(watched):
+    build_neighbor_table(top_k=2)
+    neighbor_ids = [neighbor_id for _, neighbor_id in stored_neighbors()[watched[0]]]
+    assert len(neighbor_ids) == 2
+
+    related = [video.id for video in get_related_videos(watched[0], limit=6)]
+    assert related[:2] == neighbor_ids
+    assert len(related) == 6
+    assert len(set(related)) == 6
+    assert watched[0] not in related
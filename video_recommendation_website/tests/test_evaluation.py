@@ -0,0 +1,23 @@
+from evaluation import fastest_meeting
+
+
+def scores(p95_ms, precision, recall):
+    return {'p95_ms': p95_ms, 'precision_at_k': precision, 'recall_at_k': recall}
+
+
+RESULTS = {'results': {
+    'popularity': {'recommend': scores(1.0, 0.02, 0.05), 'state_kb': 0.0},
+    'co-view': {'recommend': scores(3.0, 0.10, 0.20), 'related': scores(2.0, 0.10, 0.20)},
+    'content-similarity': {'skipped': True},
+    'configured': {'recommend': scores(0.5, 0.50, 0.50), 'related': scores(0.5, 0.50, 0.50)},
+}}
+
+
+def test_fastest_meeting_picks_the_lowest_p95_among_strategies():
+    assert fastest_meeting(RESULTS, 'recommend') == 'popularity'
+    assert fastest_meeting(RESULTS, 'recommend', min_precision=0.05) == 'co-view'
+    assert fastest_meeting(RESULTS, 'related') == 'co-view'
+
+
+def test_fastest_meeting_ignores_the_configured_chains():
+    assert fastest_meeting(RESULTS, 'recommend', min_recall=0.3) is None
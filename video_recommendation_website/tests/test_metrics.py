@@ -0,0 +1,42 @@
+import re
+
+import pytest
+
+from metrics import Registry, _format_labels
+
+# A sample line of the Prometheus text format: name, optional labels, value
+SAMPLE = re.compile(r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_][a-zA-Z0-9_]*="([^"\\\n]|\\[\\"n])*",?)*\})? \S+$')
+
+
+def test_metrics_endpoint_renders_the_text_format(client):
+    assert client.get('/api/videos').status_code == 200
+    response = client.get('/metrics')
+
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert response.mimetype_params['version'] == '0.0.4'
+    text = response.get_data(as_text=True)
+    assert '# TYPE http_request_duration_seconds histogram' in text
+    assert 'http_request_duration_seconds_count{endpoint="api_videos"}' in text
+    assert '# TYPE response_cache_requests_total counter' in text
+    for line in text.splitlines():
+        if not line.startswith('#'):
+            assert SAMPLE.match(line), line
+
+
+def test_label_values_are_escaped():
+    assert _format_labels((('path', 'C:\\videos\n"new"'),)) == r'{path="C:\\videos\n\"new\""}'
+    assert SAMPLE.match('x' + _format_labels((('path', 'a\\"\nb'),)) + ' 1')
+
+
+def test_counter_names_end_in_total():
+    registry = Registry()
+    with pytest.raises(ValueError):
+        registry.counter('thumbnail_fetches', 'Thumbnails fetched')
+    counter = registry.counter('thumbnail_fetches_total', 'Thumbnails fetched\nfrom "origin" C:\\')
+    counter.inc(result='ok')
+    assert registry.render() == (
+        '# HELP thumbnail_fetches_total Thumbnails fetched\\nfrom "origin" C:\\\\\n'
+        '# TYPE thumbnail_fetches_total counter\n'
+        'thumbnail_fetches_total{result="ok"} 1.0\n'
+    )
@@ -0,0 +1,93 @@
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, inspect, text
+
+import migrations
+from app import db
+
+
+def describe(url):
+    """Tables, columns, keys and indexes of a database, for comparing schemas"""
+    engine = create_engine(url)
+    try:
+        inspector = inspect(engine)
+        return {
+            table: {
+                'columns': sorted((c['name'], str(c['type']), c['nullable']) for c in inspector.get_columns(table)),
+                'primary_key': inspector.get_pk_constraint(table)['constrained_columns'],
+                'foreign_keys': sorted((tuple(fk['constrained_columns']), fk['referred_table'])
+                                       for fk in inspector.get_foreign_keys(table)),
+                'indexes': sorted((index['name'], tuple(index['column_names']))
+                                  for index in inspector.get_indexes(table)),
+            }
+            # video_fts and its shadow tables are not models
+            for table in inspector.get_table_names()
+            if table != 'schema_migrations' and not table.startswith('video_fts')
+        }
+    finally:
+        engine.dispose()
+
+
+@pytest.fixture
+def database(tmp_path):
+    """An app bound to an empty database file; yields the database URL inside its app context"""
+    url = f"sqlite:///{tmp_path / 'migrated.db'}"
+    other = Flask(__name__)
+    other.config['SQLALCHEMY_DATABASE_URI'] = url
+    db.init_app(other)
+    with other.app_context():
+        yield url
+        db.engine.dispose()
+
+
+def test_fresh_database_matches_the_models(database, tmp_path):
+    assert migrations.upgrade() == [version for version, _, _ in migrations.MIGRATIONS]
+    assert migrations.upgrade() == []
+
+    models_url = f"sqlite:///{tmp_path / 'models.db'}"
+    engine = create_engine(models_url)
+    db.metadata.create_all(engine)
+    engine.dispose()
+    assert describe(database) == describe(models_url)
+    with db.engine.connect() as connection:
+        assert inspect(connection).has_table('video_fts') == migrations._fts5_available(connection)
+
+
+@pytest.mark.parametrize('applied', [0, 3])
+def test_upgraded_database_matches_a_fresh_one(database, tmp_path, monkeypatch, applied):
+    # A database from before migrations existed (created by db.create_all on
+    # the baseline models), or one migrated up to before comment counts
+    if applied:
+        monkeypatch.setattr(migrations, 'MIGRATIONS', migrations.MIGRATIONS[:applied])
+        migrations.upgrade()
+        monkeypatch.undo()
+    else:
+        with db.engine.begin() as connection:
+            migrations._create_baseline(connection)
+    with db.engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO user (id, username, email) VALUES (1, 'old', 'old@example.com')"
+        ))
+        connection.execute(text("INSERT INTO category (id, name) VALUES (1, 'Old')"))
+        connection.execute(text(
+            "INSERT INTO video (id, title, url, view_count, category_id) VALUES "
+            "(1, 'Commented', 'https://example.com/1', 0, 1), (2, 'Quiet', 'https://example.com/2', 0, 1)"
+        ))
+        connection.execute(text(
+            "INSERT INTO comment (content, user_id, video_id) VALUES ('a', 1, 1), ('b', 1, 1)"
+        ))
+
+    assert migrations.upgrade() == [version for version, _, _ in migrations.MIGRATIONS[applied:]]
+
+    fresh_url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    fresh = Flask(__name__)
+    fresh.config['SQLALCHEMY_DATABASE_URI'] = fresh_url
+    db.init_app(fresh)
+    with fresh.app_context():
+        migrations.upgrade()
+        db.engine.dispose()
+    assert describe(database) == describe(fresh_url)
+
+    with db.engine.connect() as connection:
+        counts = dict(connection.execute(text('SELECT id, comment_count FROM video')).all())
+    assert counts == {1: 2, 2: 0}
@@ -0,0 +1,98 @@
+import datetime
+
+import pytest
+from sqlalchemy import desc, select
+from werkzeug.exceptions import BadRequest
+
+from pagination import decode_cursor, encode_cursor
+
+
+def walk(client, path, limit):
+    """Follow X-Next-Cursor from the first page; returns the IDs of every page in order and the page count"""
+    ids = []
+    pages = 0
+    cursor = None
+    while True:
+        query = {'limit': limit, 'cursor': cursor} if cursor else {'limit': limit}
+        response = client.get(path, query_string=query)
+        assert response.status_code == 200
+        ids.extend(item['id'] for item in response.get_json())
+        pages += 1
+        cursor = response.headers.get('X-Next-Cursor')
+        if not cursor:
+            return ids, pages
+
+
+def test_cursor_round_trip():
+    created_at = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456)
+    assert decode_cursor(encode_cursor(42, 7), 2) == [42, 7]
+    last_created_at, last_id = decode_cursor(encode_cursor(created_at, 9), 2)
+    assert datetime.datetime.fromisoformat(last_created_at) == created_at
+    assert last_id == 9
+
+
+@pytest.mark.parametrize('cursor', [
+    'not base64 !',
+    encode_cursor(1),
+    encode_cursor(1, 2, 3),
+    'eyJhIjoxfQ',  # {"a":1}
+    '',
+])
+def test_malformed_cursor_is_rejected(app, cursor):
+    with app.test_request_context():
+        with pytest.raises(BadRequest):
+            decode_cursor(cursor, 2)
+
+
+def test_video_pages_cover_every_video_once(app, client, app_context):
+    from app import db
+    from models import Video
+
+    expected = list(db.session.execute(
+        select(Video.id).order_by(desc(Video.view_count), desc(Video.id))
+    ).scalars())
+    ids, pages = walk(client, '/api/videos', 3)
+    assert ids == expected
+    assert pages == -(-len(expected) // 3)
+
+
+def test_comment_pages_break_timestamp_ties_by_id(app, client, app_context):
+    from app import db
+    from cache import response_cache
+    from models import Comment, User, Video
+
+    video = db.session.execute(select(Video).order_by(Video.id.desc())).scalars().first()
+    user = db.session.execute(select(User)).scalars().first()
+    created_at = datetime.datetime(2024, 1, 1)
+    db.session.add_all(
+        Comment(content=f'Comment {n}', user_id=user.id, video_id=video.id, created_at=created_at)
+        for n in range(7)
+    )
+    db.session.commit()
+    response_cache.bump(f'comments:{video.id}')
+
+    expected = list(db.session.execute(
+        select(Comment.id).where(Comment.video_id == video.id)
+        .order_by(desc(Comment.created_at), desc(Comment.id))
+    ).scalars())
+    ids, _ = walk(client, f'/api/videos/{video.id}/comments', 2)
+    assert ids == expected
+
+
+@pytest.mark.parametrize('url', [
+    '/api/videos?cursor=garbage',
+    f'/api/videos?cursor={encode_cursor(1)}',
+    f'/api/videos/1/comments?cursor={encode_cursor("yesterday", 1)}',
+    '/category/1?cursor=garbage',
+    f'/api/videos?cursor={encode_cursor({"a": 1}, 2)}',
+    f'/api/videos?cursor={encode_cursor("x", "y")}',
+    f'/api/videos?cursor={encode_cursor(10, 2 ** 70)}',
+    f'/api/videos?cursor={encode_cursor(True, 2)}',
+    f'/category/1?cursor={encode_cursor([1], 2)}',
+    f'/category/1?cursor={encode_cursor(None, 2)}',
+    f'/api/videos/1/comments?cursor={encode_cursor("2020-01-01", {"a": 1})}',
+    f'/api/videos/1/comments?cursor={encode_cursor(5, 1)}',
+    f'/api/videos/1/comments?cursor={encode_cursor("2020-01-01", 1.5)}',
+])
+def test_bad_cursor_is_a_client_error(client, url):
+    assert client.get(url).status_code == 400
@@ -0,0 +1,56 @@
+import pytest
+
+from cache import response_cache
+from view_events import view_events
+
+ROUTES = [
+    '/',
+    '/video/1',
+    '/video/2',
+    '/category/1',
+    '/search?q=video',
+    '/search?q=video&page=2',
+    '/api/videos',
+    '/api/videos?limit=2',
+    '/api/videos/trending',
+    '/api/videos/1/comments',
+    '/api/recommended',
+]
+
+
+@pytest.fixture
+def strict(app, monkeypatch):
+    # Budget overruns raise, and the error reaches the test with its message
+    monkeypatch.setitem(app.config, 'QUERY_BUDGET_STRICT', True)
+    monkeypatch.setitem(app.config, 'PROPAGATE_EXCEPTIONS', True)
+    response_cache.backend.clear()
+    yield
+    response_cache.backend.clear()
+    # Write out the views of the requested pages
+    with app.app_context():
+        view_events.flush()
+
+
+@pytest.mark.parametrize('user_id', [None, 1], ids=['anonymous', 'signed-in'])
+def test_main_routes_stay_within_their_query_budgets(client, strict, user_id):
+    if user_id:
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+    # Twice: the first requests also load the in-process indexes
+    for _ in range(2):
+        for route in ROUTES:
+            assert client.get(route).status_code == 200, route
+
+
+def test_strict_mode_fails_views_over_budget(app, strict):
+    from querycount import query_budget
+
+    @query_budget(0)
+    def over_budget():
+        from models import Video
+        Video.query.first()
+        return 'ok'
+
+    with app.test_request_context():
+        with pytest.raises(AssertionError, match='over_budget executed 1 queries'):
+            over_budget()
@@ -0,0 +1,91 @@
+import pytest
+from sqlalchemy import delete
+
+from search_index import FTS5Backend, MAX_PAGE, PythonBackend, search_index
+
+
+@pytest.fixture(params=['fts5', 'python'])
+def backend(request, app_context):
+    if request.param == 'fts5' and not FTS5Backend.available():
+        pytest.skip('SQLite was built without FTS5')
+    previous = search_index.backend
+    search_index.backend = FTS5Backend() if request.param == 'fts5' else PythonBackend()
+    yield search_index.backend
+    search_index.backend = previous
+
+
+@pytest.fixture
+def add_videos(app_context):
+    """Insert videos from (title, description) pairs; deleted again afterwards"""
+    from app import db
+    from models import Video
+
+    added = []
+
+    def add(*documents):
+        videos = [Video(title=title, description=description, url='https://example.com/v', category_id=1)
+                  for title, description in documents]
+        db.session.add_all(videos)
+        db.session.commit()
+        added.extend(video.id for video in videos)
+        return [video.id for video in videos]
+
+    yield add
+    db.session.execute(delete(Video).where(Video.id.in_(added)))
+    db.session.commit()
+
+
+def ids(query, page=1, per_page=24):
+    videos, total = search_index.search(query, page=page, per_page=per_page)
+    return [video.id for video in videos], total
+
+
+def test_title_matches_rank_above_description_matches(backend, add_videos):
+    in_description, in_title, twice = add_videos(
+        ('Evening news', 'a report about the quokka population'),
+        ('Quokka close-up', 'a small marsupial'),
+        ('Quokka quokka', 'more quokka footage'),
+    )
+    found, total = ids('quokka')
+    assert total == 3
+    assert found == [twice, in_title, in_description]
+
+
+def test_every_word_matches_as_a_prefix(backend, add_videos):
+    both, first_only = add_videos(
+        ('Origami cranes folded', 'paper'),
+        ('Origami boats', 'paper'),
+    )
+    assert sorted(ids('orig')[0]) == sorted([both, first_only])
+    assert ids('origami cran')[0] == [both]
+    assert ids('origamix') == ([], 0)
+
+
+def test_index_follows_inserts_and_updates(backend, add_videos):
+    from app import db
+    from models import Video
+
+    # Searching first builds the in-process index, which must then be kept current
+    assert ids('axolotl') == ([], 0)
+    video_id, = add_videos(('Axolotl care', 'aquarium basics'))
+    assert ids('axolotl') == ([video_id], 1)
+
+    db.session.get(Video, video_id).title = 'Salamander care'
+    db.session.commit()
+    assert ids('axolotl') == ([], 0)
+    assert ids('salamander') == ([video_id], 1)
+
+
+def test_pages_split_the_ranking(backend, add_videos):
+    added = add_videos(*[(f'Kestrel flight {n}', 'kestrel ' * n) for n in range(1, 6)])
+    ranking, total = ids('kestrel', per_page=10)
+    assert total == 5 and sorted(ranking) == sorted(added)
+
+    pages = [ids('kestrel', page=page, per_page=2) for page in (1, 2, 3, 4)]
+    assert [found for found, _ in pages] == [ranking[0:2], ranking[2:4], ranking[4:5], []]
+    assert {total for _, total in pages} == {5}
+
+
+@pytest.mark.parametrize('page', ['0', '-4', '99999999999999999999', str(MAX_PAGE + 1)])
+def test_search_route_clamps_the_page(client, page):
+    assert client.get(f'/search?q=video&page={page}').status_code == 200
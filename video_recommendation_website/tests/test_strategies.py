@@ -0,0 +1,71 @@
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+from strategies import STRATEGIES, Strategy, parse_chain, run_chain
+
+
+class Fixed(Strategy):
+    """Returns the same videos every time, minus the excluded ones"""
+
+    def __init__(self, name, video_ids):
+        self.name = name
+        self.videos = [SimpleNamespace(id=video_id) for video_id in video_ids]
+        self.calls = []
+
+    def recommend(self, user_id, limit, exclude, session=None):
+        self.calls.append(('recommend', user_id, limit))
+        return [v for v in self.videos if v.id not in exclude][:limit]
+
+    def related(self, video, limit, exclude, session=None):
+        self.calls.append(('related', video, limit))
+        return [v for v in self.videos if v.id not in exclude][:limit]
+
+
+def names(chain):
+    return [strategy.name for strategy in chain]
+
+
+@pytest.mark.parametrize('setting, expected', [
+    ('category-affinity,popularity', ['category-affinity', 'popularity']),
+    (' co-view , trending ', ['co-view', 'trending', 'popularity']),
+    ('popularity,co-view', ['popularity', 'co-view']),
+    ('', ['popularity']),
+    (',,', ['popularity']),
+])
+def test_parse_chain(setting, expected):
+    assert names(parse_chain(setting)) == expected
+
+
+def test_parse_chain_skips_unknown_names(caplog):
+    with caplog.at_level(logging.WARNING, logger='strategies'):
+        chain = parse_chain('no-such-strategy,co-view')
+    assert names(chain) == ['co-view', 'popularity']
+    assert 'no-such-strategy' in caplog.text
+    assert chain[0] is STRATEGIES['co-view']
+
+
+def test_run_chain_falls_back_to_later_strategies():
+    empty = Fixed('empty', [])
+    partial = Fixed('partial', [1, 2])
+    fill = Fixed('fill', [2, 3, 4, 5, 6])
+    picked = run_chain([empty, partial, fill], 'recommend', 7, 5)
+
+    assert [v.id for v in picked] == [1, 2, 3, 4, 5]
+    assert [call[2] for call in empty.calls + partial.calls + fill.calls] == [5, 5, 3]
+
+
+def test_run_chain_honours_exclusions_and_stops_when_full():
+    first = Fixed('first', [1, 2, 3, 4])
+    second = Fixed('second', [5])
+    picked = run_chain([first, second], 'related', 'video', 2, exclude={1})
+
+    assert [v.id for v in picked] == [2, 3]
+    assert first.calls == [('related', 'video', 2)]
+    assert second.calls == []
+
+
+def test_run_chain_returns_what_the_chain_has():
+    picked = run_chain([Fixed('short', [1]), Fixed('empty', [])], 'recommend', None, 10)
+    assert [v.id for v in picked] == [1]
@@ -0,0 +1,96 @@
+import pytest
+from sqlalchemy import delete
+
+import suggest
+from suggest import SuggestIndex, suggest_index
+
+
+@pytest.fixture
+def zephyr_videos(app_context):
+    """A category and videos sharing the word 'zephyr', with distinct view counts"""
+    from app import db
+    from models import Category, Video
+
+    category = Category(name='Zephyr Sounds', description='Suggest test category')
+    db.session.add(category)
+    db.session.flush()
+    videos = [
+        Video(title=title, url=f'https://example.com/suggest/{n}.mp4',
+              category_id=category.id, view_count=views)
+        for n, (title, views) in enumerate([
+            ('Quiet zephyr at dawn', 10),
+            ('Zephyr guitar session', 300),
+            ('Zephyrus documentary', 40),
+            ('Evening zephyr walk', 300),
+        ])
+    ]
+    db.session.add_all(videos)
+    db.session.commit()
+
+    yield category, videos
+
+    db.session.execute(delete(Video).where(Video.id.in_([video.id for video in videos])))
+    db.session.execute(delete(Category).where(Category.id == category.id))
+    db.session.commit()
+
+
+def labels(suggestions):
+    return [label for _, _, label in suggestions]
+
+
+def test_prefix_ranks_categories_then_views(zephyr_videos):
+    index = SuggestIndex()
+    index.build()
+
+    # Ties on views are broken by label
+    assert labels(index.suggest('zeph')) == [
+        'Zephyr Sounds', 'Evening zephyr walk', 'Zephyr guitar session',
+        'Zephyrus documentary', 'Quiet zephyr at dawn',
+    ]
+    assert labels(index.suggest('ZEPHYR  g')) == ['Zephyr guitar session']
+    assert labels(index.suggest('zephyru')) == ['Zephyrus documentary']
+    assert labels(index.suggest('zeph', k=2)) == ['Zephyr Sounds', 'Evening zephyr walk']
+    assert index.suggest('   ') == []
+
+
+def test_large_ranges_use_the_cached_top_list(zephyr_videos, monkeypatch):
+    index = SuggestIndex()
+    index.build()
+    scanned = index.suggest('zeph')
+
+    monkeypatch.setattr(suggest, 'SCAN_LIMIT', 2)
+    assert index.suggest('zeph') == scanned
+    assert 'zeph' in index._prefix_top
+    assert index.suggest('zeph', k=3) == scanned[:3]
+
+    # Adding an item keeps the cached lists of its prefixes in order
+    index.add('video', 10 ** 6, 'Zephyr live', popularity=1000)
+    cached = index.suggest('zeph')
+    assert labels(cached)[:2] == ['Zephyr Sounds', 'Zephyr live']
+    monkeypatch.setattr(suggest, 'SCAN_LIMIT', 1000)
+    assert index.suggest('zeph') == cached
+
+
+def test_inserted_videos_are_suggested(client, zephyr_videos):
+    from app import db
+    from models import Video
+
+    # Items of other tests' deleted fixtures stay in a built index
+    suggest_index.build()
+
+    category, _ = zephyr_videos
+    video = Video(title='Zephyr remix', url='https://example.com/suggest/remix.mp4',
+                  category_id=category.id, view_count=5000)
+    db.session.add(video)
+    db.session.commit()
+    try:
+        suggestions = client.get('/api/search/suggest', query_string={'q': 'zephyr r'}).get_json()
+        assert suggestions == [{
+            'type': 'video', 'id': video.id, 'label': 'Zephyr remix', 'url': f'/video/{video.id}',
+        }]
+        top = client.get('/api/search/suggest', query_string={'q': 'zeph', 'limit': 2}).get_json()
+        assert [item['label'] for item in top] == ['Zephyr Sounds', 'Zephyr remix']
+        assert top[0]['url'] == f'/category/{category.id}'
+    finally:
+        db.session.execute(delete(Video).where(Video.id == video.id))
+        db.session.commit()
@@ -0,0 +1,86 @@
+import os
+
+import pytest
+from sqlalchemy import delete
+
+import thumbnails
+from thumbnails import source_digest, thumbnail_url
+
+
+class InlineExecutor:
+    """Runs the background fetch right away"""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def origin(monkeypatch):
+    """Fake origin serving one PNG body per URL; records the fetched URLs"""
+    fetched = []
+
+    def fetch(url):
+        fetched.append(url)
+        return f'image from {url}'.encode(), 'image/png'
+
+    monkeypatch.setattr(thumbnails, '_fetch', fetch)
+    monkeypatch.setattr(thumbnails, '_executor', InlineExecutor())
+    # The fake images cannot be decoded, so keep them as they are
+    monkeypatch.setattr(thumbnails, '_resize', lambda content, content_type, width: (content, '.png'))
+    return fetched
+
+
+@pytest.fixture
+def video(app_context):
+    from app import db
+    from models import Video
+
+    video = Video(title='Thumbnail test', url='https://example.com/thumb.mp4', category_id=1,
+                  thumbnail='https://images.example.com/first.png')
+    db.session.add(video)
+    db.session.commit()
+    yield video
+    db.session.execute(delete(Video).where(Video.id == video.id))
+    db.session.commit()
+
+
+def link(app, video, width=None):
+    with app.test_request_context():
+        return thumbnail_url(video, width)
+
+
+def test_edited_thumbnail_is_not_served_stale(app, client, origin, video):
+    from app import db
+
+    first_link = link(app, video)
+    assert f'v={source_digest(video.thumbnail)}' in first_link
+    response = client.get(first_link)
+    assert response.status_code == 302
+    assert response.headers['Location'] == 'https://images.example.com/first.png'
+    assert client.get(first_link).data == b'image from https://images.example.com/first.png'
+
+    video.thumbnail = 'https://images.example.com/second.png'
+    db.session.commit()
+    second_link = link(app, video)
+    assert second_link != first_link
+    response = client.get(second_link)
+    assert response.status_code == 302
+    assert response.headers['Location'] == 'https://images.example.com/second.png'
+    assert client.get(second_link).data == b'image from https://images.example.com/second.png'
+    assert origin == ['https://images.example.com/first.png', 'https://images.example.com/second.png']
+
+    # Links rendered before the edit, or without a digest, get the current image
+    assert client.get(first_link).data == b'image from https://images.example.com/second.png'
+    assert client.get(f'/thumb/{video.id}').data == b'image from https://images.example.com/second.png'
+    # Only the current source is kept on disk
+    directory = os.path.join(thumbnails.THUMBNAIL_CACHE_DIR, '320', str(video.id))
+    assert os.listdir(directory) == [f'{source_digest(video.thumbnail)}.png']
+
+
+def test_widths_are_cached_separately(app, client, origin, video):
+    small = link(app, video, 160)
+    assert 'w=160' in small
+    assert client.get(small).status_code == 302
+    assert client.get(small).status_code == 200
+    assert client.get(link(app, video)).status_code == 302
+    assert client.get(f'/thumb/{video.id}?w=123').status_code == 400
@@ -0,0 +1,149 @@
+import datetime
+
+import pytest
+from sqlalchemy import delete
+
+from trending import BUCKET_SECONDS, PRUNE_SCORE, TrendingIndex, _MAX_EXPONENT
+
+HOUR = BUCKET_SECONDS
+# An hour boundary, so bucket arithmetic is easy to follow
+T0 = 1700000000 // HOUR * HOUR
+
+
+@pytest.fixture
+def index():
+    return TrendingIndex(half_life=HOUR, window_buckets=4)
+
+
+def test_newer_views_outrank_decayed_ones(index):
+    for _ in range(3):
+        index.record(1, 10, T0)
+    # Two half-lives later three old views are worth 0.75, two new ones 2
+    index.record(2, 20, T0 + 2 * HOUR)
+    index.record(2, 20, T0 + 2 * HOUR)
+    index.refresh(T0 + 2 * HOUR)
+
+    assert index.top(10) == [2, 1]
+    assert index.top(10, category_ids=[10]) == [1]
+    assert index.top(10, exclude={2}) == [1]
+    assert index.score(1, T0 + 2 * HOUR) == pytest.approx(0.75)
+    assert index.score(2, T0 + 2 * HOUR) == pytest.approx(2.0)
+
+
+def test_top_is_empty_until_refreshed_and_never_builds(index):
+    # Outside an app context, so building would fail
+    index.record(1, 10, T0)
+    assert index.top(10) == []
+    assert not index.ready
+
+    index.refresh(T0)
+    assert index.top(10) == [1]
+    assert not index.ready
+
+
+def test_epoch_is_rebased_before_scores_overflow(index):
+    index.record(1, 10, T0)
+    later = T0 + (_MAX_EXPONENT / index.decay) * 3
+    index.record(2, 10, later)
+
+    assert index._epoch == later
+    assert index.score(2, later) == pytest.approx(1.0)
+    # Video 1 decayed far below what a float can hold relative to the epoch
+    assert index.score(1, later) == 0.0
+    index.refresh(later)
+    assert index.top(10) == [2]
+
+
+def test_views_long_before_the_epoch_do_not_underflow(index):
+    # A new index starts at the current time; views replayed from years
+    # ago would decay to exactly zero against that epoch
+    index.record(1, 10, T0)
+    index.record(1, 10, T0)
+    index.record(2, 10, T0 + HOUR)
+    assert index.score(1, T0 + HOUR) == pytest.approx(1.0)
+    assert index.score(2, T0 + HOUR) == pytest.approx(1.0)
+
+    # Behind an epoch the current scores cannot be moved back from, the
+    # view is negligible and only counted in its bucket
+    index.record(3, 10, T0 + 3 * _MAX_EXPONENT / index.decay)
+    index.record(4, 10, T0 + HOUR)
+    assert index.score(4, T0 + HOUR) == 0.0
+    assert index.window_views(4, timestamp=T0 + HOUR) == 1
+
+
+def test_refresh_long_after_the_last_view(index):
+    index.record(1, 10, T0)
+    # Long enough that the prune threshold would overflow without a rebase
+    index.refresh(T0 + 2 * _MAX_EXPONENT / index.decay)
+    assert index.top(10) == []
+    assert index.score(1) == 0.0
+
+
+def test_hourly_buckets_cover_the_window(index):
+    index.record(1, 10, T0)
+    index.record(1, 10, T0 + HOUR + 5)
+    index.record(1, 10, T0 + HOUR + 10)
+    index.record(1, 10, T0 + 3 * HOUR)
+
+    now = T0 + 3 * HOUR
+    assert index.window_views(1, hours=1, timestamp=now) == 1
+    assert index.window_views(1, hours=3, timestamp=now) == 3
+    assert index.window_views(1, hours=24, timestamp=now) == 4
+    # The ring buffer drops hours that left the window, including skipped ones
+    index.record(1, 10, T0 + 6 * HOUR)
+    assert index.window_views(1, hours=24, timestamp=T0 + 6 * HOUR) == 2
+    # Views older than the window are not counted in a bucket
+    index.record(1, 10, T0)
+    assert index.window_views(1, hours=24, timestamp=T0 + 6 * HOUR) == 2
+    assert index.window_views(2, timestamp=now) == 0
+
+
+def test_refresh_prunes_decayed_videos_outside_the_window(index):
+    index.record(1, 10, T0)
+    index.record(2, 10, T0 + 10 * HOUR)
+    # Video 1 decayed below PRUNE_SCORE and its last view left the window
+    now = T0 + 12 * HOUR
+    assert index.score(1, now) < PRUNE_SCORE
+    index.refresh(now)
+
+    assert index.top(10) == [2]
+    assert 1 not in index._scores and 1 not in index._buckets
+    assert index.window_views(1, timestamp=now) == 0
+
+
+def test_recent_videos_are_not_pruned_whatever_their_score():
+    index = TrendingIndex(half_life=HOUR / 100, window_buckets=4)
+    index.record(1, 10, T0)
+    # Within the window, a heavily decayed score is kept
+    assert index.score(1, T0 + 2 * HOUR) < PRUNE_SCORE
+    index.refresh(T0 + 2 * HOUR)
+    assert index.top(10) == [1]
+
+
+def test_build_for_a_past_split_point(app_context):
+    """The evaluator seeds the index at a cutoff long before now"""
+    from app import db
+    from models import User, user_video_history
+
+    user = User(username='trending_viewer', email='trending_viewer@example.com')
+    db.session.add(user)
+    db.session.commit()
+    cutoff = datetime.datetime(2015, 6, 1)
+    db.session.execute(user_video_history.insert(), [
+        {'user_id': user.id, 'video_id': 1, 'watched_at': cutoff - datetime.timedelta(hours=30)},
+        {'user_id': user.id, 'video_id': 2, 'watched_at': cutoff - datetime.timedelta(hours=1)},
+    ])
+    db.session.commit()
+    try:
+        index = TrendingIndex()
+        index.build(now=cutoff)
+        at = cutoff.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+        assert index.ready
+        assert index.top(10) == [2, 1]
+        assert index.score(1, at) == pytest.approx(0.5 ** 5)
+        assert index.score(2, at) == pytest.approx(0.5 ** (1 / 6))
+    finally:
+        db.session.execute(delete(user_video_history).where(user_video_history.c.user_id == user.id))
+        db.session.execute(delete(User).where(User.id == user.id))
+        db.session.commit()
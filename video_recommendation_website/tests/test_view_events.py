@@ -0,0 +1,150 @@
+import itertools
+
+import pytest
+from sqlalchemy import func, select, text
+
+from affinity import affinity_index
+from view_events import view_events
+
+_usernames = itertools.count()
+
+
+@pytest.fixture(autouse=True)
+def flush_leftovers(app_context):
+    yield
+    view_events.flush()
+
+
+@pytest.fixture
+def user_id(app_context):
+    from app import db
+    from models import User
+
+    name = f'viewer{next(_usernames)}'
+    user = User(username=name, email=f'{name}@example.com')
+    db.session.add(user)
+    db.session.commit()
+    return user.id
+
+
+@pytest.fixture
+def video(app_context):
+    from app import db
+    from models import Video
+    return db.session.get(Video, 2)
+
+
+def view_count(video_id):
+    from app import db
+    from models import Video
+    db.session.expire_all()
+    return db.session.get(Video, video_id).view_count
+
+
+def history(user_id):
+    from app import db
+    from models import user_video_history
+    return db.session.execute(
+        select(user_video_history.c.video_id, user_video_history.c.watched_at)
+        .where(user_video_history.c.user_id == user_id)
+    ).all()
+
+
+def test_flush_writes_buffered_views_and_history(user_id, video):
+    before = view_count(video.id)
+    for _ in range(3):
+        view_events.record_view(video.id, user_id, video.category_id)
+    view_events.record_view(video.id, None, video.category_id)
+
+    assert view_events.pending_views(video.id) == 4
+    assert view_events.pending_history(user_id) == [(video.id, video.category_id)]
+    assert view_count(video.id) == before
+    assert history(user_id) == []
+
+    view_events.flush()
+
+    assert view_count(video.id) == before + 4
+    assert [video_id for video_id, _ in history(user_id)] == [video.id]
+    assert view_events.pending_views(video.id) == 0
+    assert view_events.pending_history(user_id) == []
+
+
+def test_repeated_view_moves_watched_at_forward(user_id, video):
+    view_events.record_view(video.id, user_id, video.category_id)
+    view_events.flush()
+    (_, first_watched_at), = history(user_id)
+
+    view_events.record_view(video.id, user_id, video.category_id)
+    view_events.flush()
+    (video_id, watched_at), = history(user_id)
+    assert video_id == video.id
+    assert watched_at > first_watched_at
+
+
+def test_affinity_sees_views_before_and_after_flush(user_id, video):
+    view_events.record_view(video.id, user_id, video.category_id)
+    # Loaded from the database while the view is still buffered
+    affinity_index.invalidate_user(user_id)
+    assert video.id in affinity_index.watched(user_id)
+    assert affinity_index.top_categories(user_id) == [video.category_id]
+
+    view_events.flush()
+    assert video.id in affinity_index.watched(user_id)
+    assert affinity_index.top_categories(user_id) == [video.category_id]
+
+
+def test_failed_flush_keeps_events_for_the_next_one(monkeypatch, user_id, video):
+    from app import db
+    from models import user_video_history
+
+    before = view_count(video.id)
+    view_events.record_view(video.id, user_id, video.category_id)
+
+    def fail(views, history):
+        raise RuntimeError('database unavailable')
+    monkeypatch.setattr(view_events, '_write', fail)
+    with pytest.raises(RuntimeError):
+        view_events.flush()
+    assert view_events.pending_views(video.id) == 1
+    assert view_events.pending_history(user_id) == [(video.id, video.category_id)]
+
+    monkeypatch.undo()
+    view_events.flush()
+    assert view_count(video.id) == before + 1
+    assert db.session.execute(
+        select(func.count()).select_from(user_video_history)
+        .where(user_video_history.c.user_id == user_id)
+    ).scalar() == 1
+
+
+def test_poisoned_row_is_dropped_after_retries(user_id, video):
+    from app import db
+
+    before = view_count(video.id)
+    # Stands in for a foreign key violation, e.g. a user deleted meanwhile
+    db.session.execute(text(
+        f"CREATE TRIGGER reject_history BEFORE INSERT ON user_video_history "
+        f"WHEN NEW.user_id = {user_id} BEGIN SELECT RAISE(ABORT, 'user deleted'); END"
+    ))
+    db.session.commit()
+    try:
+        view_events.record_view(video.id, user_id, video.category_id)
+        for _ in range(view_events.flush_retries - 1):
+            with pytest.raises(Exception):
+                view_events.flush()
+        assert view_events.pending_views(video.id) == 1
+
+        view_events.flush()
+    finally:
+        db.session.execute(text('DROP TRIGGER reject_history'))
+        db.session.commit()
+
+    # The view count got through, the poisoned history row was dropped
+    assert view_count(video.id) == before + 1
+    assert history(user_id) == []
+    assert view_events.pending_views(video.id) == 0
+    assert view_events.pending_history(user_id) == []
+
+    view_events.record_view(video.id, user_id, video.category_id)
+    view_events.flush()
+    assert view_count(video.id) == before + 2
@@ -0,0 +1,202 @@
+import hashlib
+import io
+import logging
+import os
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import abort, redirect, request, send_file, url_for
+from sqlalchemy import select
+
+from app import db
+from models import Video
+
+logger = logging.getLogger(__name__)
+
+# Resized thumbnails are stored here as <width>/<video_id>/<source digest>.<ext>
+THUMBNAIL_CACHE_DIR = os.environ.get(
+    "THUMBNAIL_CACHE_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'thumbnails')
+)
+
+# Widths that may be requested; the first one is the default
+WIDTHS = (320, 160, 640)
+
+# Largest image fetched from the origin
+MAX_ORIGIN_BYTES = 5 * 1024 * 1024
+
+# Seconds to wait for the origin
+ORIGIN_TIMEOUT = 5
+
+# Seconds before an origin that failed is tried again for the same thumbnail
+RETRY_AFTER = int(os.environ.get("THUMBNAIL_RETRY_SECONDS", "300"))
+
+# Threads fetching origin images, per process
+FETCH_THREADS = int(os.environ.get("THUMBNAIL_FETCH_THREADS", "4"))
+
+# Pages link thumbnails with the digest of their source URL, so a changed
+# URL gets a new link; links without it pick the change up after a day
+CACHE_CONTROL = 'public, max-age=86400'
+
+# Formats kept as-is when Pillow is not installed
+_EXTENSIONS = {'image/jpeg': '.jpg', 'image/png': '.png', 'image/webp': '.webp', 'image/gif': '.gif'}
+
+
+def source_digest(url):
+    """Short hash of a thumbnail's source URL, part of its cache key"""
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+
+
+def _video_directory(video_id, width):
+    return os.path.join(THUMBNAIL_CACHE_DIR, str(width), str(video_id))
+
+
+def _cached_path(video_id, width, digest):
+    directory = _video_directory(video_id, width)
+    for extension in set(_EXTENSIONS.values()):
+        path = os.path.join(directory, f'{digest}{extension}')
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def _fetch(url):
+    """Download an image; returns (bytes, content type)"""
+    with urllib.request.urlopen(url, timeout=ORIGIN_TIMEOUT) as response:
+        content = response.read(MAX_ORIGIN_BYTES + 1)
+        if len(content) > MAX_ORIGIN_BYTES:
+            raise ValueError(f"{url} is larger than {MAX_ORIGIN_BYTES} bytes")
+        return content, response.headers.get_content_type()
+
+
+def _resize(content, content_type, width):
+    """Shrink an image to the width as JPEG, or keep it as-is without Pillow"""
+    try:
+        from PIL import Image
+    except ImportError:
+        extension = _EXTENSIONS.get(content_type)
+        if extension is None:
+            raise ValueError(f"Unsupported thumbnail type {content_type}")
+        return content, extension
+    with Image.open(io.BytesIO(content)) as image:
+        image.thumbnail((width, width * 4))
+        out = io.BytesIO()
+        image.convert('RGB').save(out, format='JPEG', quality=82, optimize=True, progressive=True)
+        return out.getvalue(), '.jpg'
+
+
+def _store(video_id, width, digest, content, extension):
+    directory = _video_directory(video_id, width)
+    os.makedirs(directory, exist_ok=True)
+    # Write then rename, so concurrent requests never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    path = os.path.join(directory, f'{digest}{extension}')
+    os.replace(tmp_path, path)
+    # Drop the thumbnails of earlier source URLs
+    for name in os.listdir(directory):
+        if not name.startswith(digest) and not name.endswith('.tmp'):
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return path
+
+
+_executor = ThreadPoolExecutor(max_workers=FETCH_THREADS, thread_name_prefix='thumbnail-fetch')
+_lock = threading.Lock()
+# (video_id, width, digest) being fetched, and -> monotonic time of the last failure
+_pending = set()
+_failed = {}
+
+
+def _fill(video_id, width, url):
+    digest = source_digest(url)
+    key = (video_id, width, digest)
+    try:
+        content, content_type = _fetch(url)
+        _store(video_id, width, digest, *_resize(content, content_type, width))
+    except (OSError, ValueError, urllib.error.URLError) as e:
+        logger.warning(f"Could not cache thumbnail of video {video_id}: {str(e)}")
+        with _lock:
+            now = time.monotonic()
+            _failed[key] = now
+            if len(_failed) > 10000:
+                for expired in [k for k, failed_at in _failed.items() if now - failed_at >= RETRY_AFTER]:
+                    del _failed[expired]
+    finally:
+        with _lock:
+            _pending.discard(key)
+
+
+def _schedule_fill(video_id, width, url):
+    """Start caching a thumbnail unless it is being fetched or failed recently"""
+    key = (video_id, width, source_digest(url))
+    with _lock:
+        if key in _pending:
+            return
+        failed_at = _failed.get(key)
+        if failed_at is not None:
+            if time.monotonic() - failed_at < RETRY_AFTER:
+                return
+            del _failed[key]
+        _pending.add(key)
+    _executor.submit(_fill, video_id, width, url)
+
+
+def thumbnail_url(video, width=None):
+    """URL of a video's thumbnail through the local cache, at one of WIDTHS"""
+    args = {'v': source_digest(video.thumbnail)} if video.thumbnail else {}
+    if width is not None and width != WIDTHS[0]:
+        args['w'] = width
+    return url_for('thumbnail', video_id=video.id, **args)
+
+
+def init_app(app):
+    """Register the /thumb/<video_id> route and the thumbnail_url template helper"""
+
+    @app.context_processor
+    def _thumbnail_helpers():
+        return {'thumbnail_url': thumbnail_url}
+
+    @app.route('/thumb/<int:video_id>')
+    def thumbnail(video_id):
+        """
+        Serve a video's thumbnail from the local cache
+
+        Files are keyed by the digest of the source URL, given as `v` by
+        thumbnail_url, so an edited thumbnail is fetched again instead of
+        served stale. The first request for a video, width and source
+        redirects to the origin image while a background thread fetches
+        it, resizes it (with Pillow) and stores it on disk; concurrent
+        requests share one fetch, and an origin that failed is not tried
+        again for RETRY_AFTER seconds. Later requests are answered from the
+        file without touching the database; send_file lets the server use
+        sendfile.
+        """
+        width = request.args.get('w', WIDTHS[0], type=int)
+        if width not in WIDTHS:
+            abort(400)
+
+        digest = request.args.get('v', '')
+        path = _cached_path(video_id, width, digest) if digest.isalnum() else None
+        if path is None:
+            # Unknown or outdated digest: look up the current source
+            url = db.session.execute(select(Video.thumbnail).where(Video.id == video_id)).scalar()
+            if not url:
+                abort(404)
+            if not url.startswith(('http://', 'https://')):
+                abort(404)
+            path = _cached_path(video_id, width, source_digest(url))
+            if path is None:
+                _schedule_fill(video_id, width, url)
+                return redirect(url)
+
+        response = send_file(path, conditional=True)
+        response.headers['Cache-Control'] = CACHE_CONTROL
+        return response
@@ -0,0 +1,269 @@
+import datetime
+import heapq
+import logging
+import math
+import os
+import threading
+import time
+from array import array
+
+from sqlalchemy import select
+
+from app import db
+from models import Video, user_video_history
+from cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+# Width of one view-count bucket, in seconds
+BUCKET_SECONDS = 3600
+
+# Buckets kept per video; views older than this only live on in the score
+WINDOW_BUCKETS = int(os.environ.get("TRENDING_WINDOW_HOURS", "48"))
+
+# Time after which a view counts half as much in the trending score
+HALF_LIFE = float(os.environ.get("TRENDING_HALF_LIFE_HOURS", "6")) * 3600
+
+# Seconds between recomputations of the top list
+REFRESH_INTERVAL = 60
+
+# Videos kept in the top list
+TOP_N = 1000
+
+# Videos whose decayed view count fell below this, with no views left in
+# their buckets, are dropped on refresh
+PRUNE_SCORE = 0.01
+
+# Scores are stored as sum(exp(decay * (t - epoch))). Once exponents get this
+# large the epoch is moved forward so the floats cannot overflow; decayed
+# scores are computed through logarithms so they cannot underflow to zero.
+_MAX_EXPONENT = 500.0
+
+
+class TrendingIndex:
+    """
+    Time-decayed popularity per video
+
+    Every view adds exp(decay * (t - epoch)) to the video's score, so at any
+    moment the ordering of scores is the ordering by exponentially decayed
+    view count, without touching other videos. Views are also counted in
+    hourly buckets, kept per video in a ring buffer covering WINDOW_BUCKETS
+    hours, for windowed counts such as views in the last 24 hours.
+
+    The index is seeded from recent user_video_history rows and then fed by
+    the views recorded in this process. With several workers each one sees a
+    share of the traffic, which ranks the same videos on top. The top list is
+    recomputed every REFRESH_INTERVAL seconds, off the request path from the
+    view flush thread. Until build() has run (see app.warm_up) the list only
+    holds the views recorded so far, possibly none. Each refresh also forgets videos that have not been
+    watched for longer than the window and whose score decayed below
+    PRUNE_SCORE, so the index holds only recently watched videos.
+    """
+
+    def __init__(self, half_life=HALF_LIFE, window_buckets=WINDOW_BUCKETS,
+                 refresh_interval=REFRESH_INTERVAL, top_n=TOP_N):
+        self.half_life = half_life
+        self.decay = math.log(2) / half_life
+        self.window_buckets = window_buckets
+        self.refresh_interval = refresh_interval
+        self.top_n = top_n
+        self._lock = threading.Lock()
+        self._epoch = time.time()
+        # video_id -> scaled score
+        self._scores = {}
+        # video_id -> category_id
+        self._categories = {}
+        # video_id -> array of view counts by hour slot, and the last hour written
+        self._buckets = {}
+        self._last_hour = {}
+        # [(video_id, category_id), ...] ordered by score
+        self._top = []
+        self._refreshed_at = None
+        self._built = False
+
+    @property
+    def ready(self):
+        """True once the index has been seeded from history"""
+        return self._built
+
+    def _rebase(self, now):
+        # Through logarithms: the shift alone can overflow or underflow
+        offset = self.decay * (now - self._epoch)
+        for video_id, score in self._scores.items():
+            if score > 0:
+                self._scores[video_id] = math.exp(math.log(score) - offset)
+        self._epoch = now
+
+    def _add(self, video_id, category_id, timestamp, count=1):
+        # Caller holds the lock
+        exponent = self.decay * (timestamp - self._epoch)
+        if exponent > _MAX_EXPONENT:
+            self._rebase(timestamp)
+            exponent = 0.0
+        elif exponent < -_MAX_EXPONENT:
+            # A view long before the epoch (e.g. replayed history) would
+            # underflow; move the epoch back if the other scores allow it
+            highest = max(self._scores.values(), default=0.0)
+            if highest == 0.0 or math.log(highest) - exponent <= _MAX_EXPONENT:
+                self._rebase(timestamp)
+                exponent = 0.0
+        self._scores[video_id] = self._scores.get(video_id, 0.0) + count * math.exp(exponent)
+        if category_id is not None:
+            self._categories[video_id] = category_id
+
+        hour = int(timestamp // BUCKET_SECONDS)
+        buckets = self._buckets.get(video_id)
+        if buckets is None:
+            buckets = self._buckets[video_id] = array('I', bytes(4 * self.window_buckets))
+            self._last_hour[video_id] = hour
+        last = self._last_hour[video_id]
+        if hour > last:
+            # Clear the slots of the hours skipped since the last write
+            for skipped in range(last + 1, min(hour, last + self.window_buckets) + 1):
+                buckets[skipped % self.window_buckets] = 0
+            self._last_hour[video_id] = hour
+        elif hour <= last - self.window_buckets:
+            return
+        buckets[hour % self.window_buckets] += count
+
+    def record(self, video_id, category_id=None, timestamp=None):
+        """
+        Count a view of a video
+
+        Args:
+            video_id: The ID of the video being watched
+            category_id: The video's category, needed for per-category rankings
+            timestamp: Time of the view in seconds since the epoch, default now
+        """
+        with self._lock:
+            self._add(video_id, category_id, time.time() if timestamp is None else timestamp)
+
+    def build(self, now=None):
+        """
+        Seed the index from recent history. Must run inside an app context.
+
+        Args:
+            now: Naive UTC datetime the window ends at, default the current
+                 time; the offline evaluator passes its split point
+        """
+        now = now or datetime.datetime.utcnow()
+        since = now - datetime.timedelta(seconds=self.window_buckets * BUCKET_SECONDS)
+        stmt = select(
+            user_video_history.c.video_id, Video.category_id, user_video_history.c.watched_at
+        ).join(Video, Video.id == user_video_history.c.video_id).where(
+            user_video_history.c.watched_at >= since,
+            user_video_history.c.watched_at <= now
+        ).execution_options(yield_per=10000)
+
+        # Seed into a separate index so recording views is not blocked
+        # meanwhile. Its epoch is the start of the window, so the exponents
+        # stay small however far in the past `now` is.
+        seeded = TrendingIndex(self.half_life, self.window_buckets)
+        seeded._epoch = since.replace(tzinfo=datetime.timezone.utc).timestamp()
+        rows = 0
+        for video_id, category_id, watched_at in db.session.execute(stmt):
+            timestamp = watched_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+            seeded._add(video_id, category_id, timestamp)
+            rows += 1
+
+        with self._lock:
+            self._epoch = seeded._epoch
+            self._scores = seeded._scores
+            self._categories = seeded._categories
+            self._buckets = seeded._buckets
+            self._last_hour = seeded._last_hour
+            self._built = True
+        self.refresh(now.replace(tzinfo=datetime.timezone.utc).timestamp())
+        response_cache.bump('popular')
+        logger.info(f"Trending index seeded from {rows} history rows")
+
+    def _prune(self, now):
+        # Caller holds the lock
+        if self.decay * (now - self._epoch) > _MAX_EXPONENT:
+            # Nothing was recorded for a long time; the threshold would overflow
+            self._rebase(now)
+        threshold = PRUNE_SCORE * math.exp(self.decay * (now - self._epoch))
+        expired_hour = int(now // BUCKET_SECONDS) - self.window_buckets
+        stale = [
+            video_id for video_id, score in self._scores.items()
+            if score < threshold and self._last_hour.get(video_id, expired_hour) <= expired_hour
+        ]
+        for video_id in stale:
+            del self._scores[video_id]
+            self._categories.pop(video_id, None)
+            self._buckets.pop(video_id, None)
+            self._last_hour.pop(video_id, None)
+        return len(stale)
+
+    def refresh(self, timestamp=None):
+        """
+        Drop videos no longer trending and recompute the top list
+
+        Args:
+            timestamp: Time that counts as now, in seconds since the epoch,
+                       default the current time
+        """
+        with self._lock:
+            pruned = self._prune(time.time() if timestamp is None else timestamp)
+            top = heapq.nlargest(self.top_n, self._scores.items(), key=lambda item: item[1])
+            self._top = [(video_id, self._categories.get(video_id)) for video_id, _ in top]
+            self._refreshed_at = time.monotonic()
+        if pruned:
+            logger.debug(f"Dropped {pruned} videos from the trending index")
+
+    def refresh_if_stale(self):
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at > self.refresh_interval:
+            self.refresh()
+
+    def on_views_flushed(self, views, history, categories):
+        """View flush listener; keeps the top list fresh from the flush thread"""
+        self.refresh_if_stale()
+
+    def top(self, limit, category_ids=None, exclude=()):
+        """
+        Get the trending videos
+
+        Args:
+            limit: Maximum number of video IDs to return
+            category_ids: Only return videos from these categories
+            exclude: Container of video IDs to skip
+
+        Returns:
+            List of video IDs, most trending first. May be shorter than limit
+            when few videos were watched recently, and empty before the first
+            refresh; the index is never built on the request path.
+        """
+        picked = []
+        for video_id, category_id in self._top:
+            if video_id in exclude or (category_ids is not None and category_id not in category_ids):
+                continue
+            picked.append(video_id)
+            if len(picked) >= limit:
+                break
+        return picked
+
+    def score(self, video_id, timestamp=None):
+        """Decayed view count of a video at the given time (default now)"""
+        now = time.time() if timestamp is None else timestamp
+        with self._lock:
+            score = self._scores.get(video_id, 0.0)
+            exponent = -self.decay * (now - self._epoch)
+        # The factor alone can underflow (or overflow) far from the epoch
+        return math.exp(math.log(score) + exponent) if score > 0 else 0.0
+
+    def window_views(self, video_id, hours=24, timestamp=None):
+        """Number of views of a video in the last `hours` hours (at most WINDOW_BUCKETS)"""
+        now_hour = int((time.time() if timestamp is None else timestamp) // BUCKET_SECONDS)
+        with self._lock:
+            buckets = self._buckets.get(video_id)
+            if buckets is None:
+                return 0
+            last = self._last_hour[video_id]
+            return sum(
+                buckets[hour % self.window_buckets]
+                for hour in range(now_hour - min(hours, self.window_buckets) + 1, now_hour + 1)
+                if last - self.window_buckets < hour <= last
+            )
+
+
+trending_index = TrendingIndex()
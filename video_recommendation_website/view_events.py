@@ -0,0 +1,298 @@
+import atexit
+import datetime
+import logging
+import os
+import threading
+from collections import Counter
+
+from sqlalchemy import bindparam, update
+
+from app import db
+from models import Video, user_video_history
+from affinity import affinity_index
+from trending import trending_index
+
+logger = logging.getLogger(__name__)
+
+# Seconds between background flushes
+FLUSH_INTERVAL = float(os.environ.get("VIEW_FLUSH_INTERVAL", "5"))
+
+# Number of buffered events that triggers an early flush
+FLUSH_THRESHOLD = int(os.environ.get("VIEW_FLUSH_THRESHOLD", "500"))
+
+# Failed flushes in a row after which events are written one by one, and
+# the ones that still fail are dropped
+FLUSH_RETRIES = int(os.environ.get("VIEW_FLUSH_RETRIES", "3"))
+
+
+def _history_upsert(dialect_name):
+    """Build an INSERT ... ON CONFLICT statement for user_video_history, if supported"""
+    if dialect_name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    stmt = insert(user_video_history)
+    return stmt.on_conflict_do_update(
+        index_elements=[user_video_history.c.user_id, user_video_history.c.video_id],
+        set_={'watched_at': stmt.excluded.watched_at}
+    )
+
+
+class ViewEventAggregator:
+    """
+    Write-behind buffer for video views
+
+    Views are counted in memory per video and history entries are kept per
+    (user, video) with the latest watch time. A background thread writes them
+    out in batches every FLUSH_INTERVAL seconds, or sooner once
+    FLUSH_THRESHOLD events are pending, and once more at interpreter exit.
+    A failed flush keeps its events for the next one; after FLUSH_RETRIES
+    failures in a row they are written one at a time, so a single bad row
+    (e.g. history of a deleted user) cannot block every later flush.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_threshold=FLUSH_THRESHOLD,
+                 flush_retries=FLUSH_RETRIES):
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.flush_retries = flush_retries
+        self._failed_flushes = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._views = Counter()
+        self._history = {}
+        self._categories = set()
+        # video_id -> category_id of videos with buffered history entries
+        self._history_categories = {}
+        self._flush_listeners = []
+        self._app = None
+        self._background = True
+        self._thread = None
+        self._pid = None
+        self._wake = threading.Event()
+        self._stopping = threading.Event()
+
+    def init_app(self, app, background=True):
+        """
+        Attach the aggregator to the app; the flush thread starts on the first view
+
+        Args:
+            app: The Flask app, whose context flushes run in
+            background: Flush from a background thread. Pass False for
+                        in-memory databases: all their sessions share one
+                        connection (StaticPool), so a commit from the flush
+                        thread could land in the middle of a request. Views
+                        are then written when the request that recorded
+                        them ends.
+        """
+        self._app = app
+        self._background = background
+        affinity_index.set_pending_source(self.pending_history)
+        if not background:
+            app.teardown_request(self._flush_after_request)
+
+    def _flush_after_request(self, exc):
+        try:
+            self.flush()
+        except Exception as e:
+            logger.error(f"Error flushing view events: {str(e)}")
+
+    def _ensure_thread(self):
+        # Threads do not survive fork, so each (pre-forked) worker starts its own
+        if not self._background or self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='view-event-flush', daemon=True)
+            self._thread.start()
+            atexit.register(self.shutdown)
+
+    def add_flush_listener(self, listener):
+        """Call listener(views, history, categories) after every successful flush"""
+        self._flush_listeners.append(listener)
+
+    def record_view(self, video_id, user_id=None, category_id=None):
+        """
+        Record a view without touching the database
+
+        Args:
+            video_id: The ID of the video being watched
+            user_id: The ID of the viewer, if known
+            category_id: The video's category, used to keep the affinity index current
+        """
+        self._ensure_thread()
+        with self._lock:
+            self._views[video_id] += 1
+            if user_id:
+                self._history[(user_id, video_id)] = datetime.datetime.utcnow()
+                self._history_categories[video_id] = category_id
+            if category_id is not None:
+                self._categories.add(category_id)
+            pending = len(self._views) + len(self._history)
+
+        trending_index.record(video_id, category_id)
+        if user_id and category_id is not None:
+            affinity_index.record_view(user_id, video_id, category_id)
+
+        if self._background and pending >= self.flush_threshold:
+            self._wake.set()
+
+    def pending_views(self, video_id):
+        """Number of views of a video that have not been written yet"""
+        with self._lock:
+            return self._views.get(video_id, 0)
+
+    def pending_history(self, user_id):
+        """(video_id, category_id) of the user's views that have not been written yet"""
+        with self._lock:
+            return [(video_id, self._history_categories.get(video_id))
+                    for (viewer_id, video_id) in self._history if viewer_id == user_id]
+
+    def _run(self):
+        while not self._stopping.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing view events: {str(e)}")
+
+    def flush(self):
+        """
+        Write all buffered views and history entries in one transaction
+
+        Raises the database error if the write failed and the events were
+        kept for a retry.
+        """
+        with self._flush_lock:
+            with self._lock:
+                views, self._views = self._views, Counter()
+                history, self._history = self._history, {}
+                categories, self._categories = self._categories, set()
+                history_categories, self._history_categories = self._history_categories, {}
+            if not views and not history:
+                return
+
+            try:
+                with self._app.app_context():
+                    self._write(views, history)
+                self._failed_flushes = 0
+            except Exception as e:
+                self._failed_flushes += 1
+                if self._failed_flushes >= self.flush_retries:
+                    logger.error(f"Flush failed {self._failed_flushes} times ({str(e)}); writing events one by one")
+                    with self._app.app_context():
+                        views, history = self._write_each(views, history)
+                    self._failed_flushes = 0
+                    self._after_flush(views, history, categories)
+                    return
+                # Put the events back so the next flush retries them
+                with self._lock:
+                    self._views.update(views)
+                    self._categories.update(categories)
+                    for video_id, category_id in history_categories.items():
+                        self._history_categories.setdefault(video_id, category_id)
+                    for key, watched_at in history.items():
+                        if key not in self._history or self._history[key] < watched_at:
+                            self._history[key] = watched_at
+                raise
+
+            self._after_flush(views, history, categories)
+
+    def _after_flush(self, views, history, categories):
+        # Users loaded into the affinity index before their views were
+        # written may have missed them
+        for user_id in {user_id for user_id, _ in history}:
+            affinity_index.invalidate_user(user_id)
+
+        for listener in self._flush_listeners:
+            listener(views, history, categories)
+
+        logger.debug(f"Flushed {sum(views.values())} views and {len(history)} history entries")
+
+    def _write_each(self, views, history):
+        """
+        Write events in separate transactions, dropping the ones that fail
+
+        Returns:
+            (views, history) that were written
+        """
+        db.session.rollback()
+        written_views = Counter()
+        written_history = {}
+        for video_id, count in views.items():
+            try:
+                self._write({video_id: count}, {})
+                written_views[video_id] = count
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Dropped {count} views of video {video_id}: {str(e)}")
+        for key, watched_at in history.items():
+            try:
+                self._write({}, {key: watched_at})
+                written_history[key] = watched_at
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Dropped history entry of user {key[0]} for video {key[1]}: {str(e)}")
+        return written_views, written_history
+
+    def _write(self, views, history):
+        video_table = Video.__table__
+        if views:
+            stmt = update(video_table).where(
+                video_table.c.id == bindparam('b_video_id')
+            ).values(view_count=video_table.c.view_count + bindparam('b_views'))
+            db.session.execute(stmt, [
+                {'b_video_id': video_id, 'b_views': count}
+                for video_id, count in views.items()
+            ])
+
+        if history:
+            rows = [
+                {'user_id': user_id, 'video_id': video_id, 'watched_at': watched_at}
+                for (user_id, video_id), watched_at in history.items()
+            ]
+            upsert = _history_upsert(db.engine.dialect.name)
+            if upsert is not None:
+                db.session.execute(upsert, rows)
+            else:
+                self._write_history_generic(rows)
+
+        db.session.commit()
+
+    def _write_history_generic(self, rows):
+        stmt = update(user_video_history).where(
+            user_video_history.c.user_id == bindparam('b_user_id'),
+            user_video_history.c.video_id == bindparam('b_video_id')
+        ).values(watched_at=bindparam('b_watched_at'))
+        missing = []
+        for row in rows:
+            result = db.session.execute(stmt, {
+                'b_user_id': row['user_id'],
+                'b_video_id': row['video_id'],
+                'b_watched_at': row['watched_at']
+            })
+            if result.rowcount == 0:
+                missing.append(row)
+        if missing:
+            db.session.execute(user_video_history.insert(), missing)
+
+    def shutdown(self):
+        """Stop the background thread and write out anything still buffered"""
+        self._stopping.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=self.flush_interval)
+        if self._app is not None:
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error flushing view events at shutdown: {str(e)}")
+
+
+view_events = ViewEventAggregator()